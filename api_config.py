@@ -11,17 +11,56 @@ DEFAULT_API_CONFIG = {
     'siliconflow': {
         'api_url': 'https://api.siliconflow.cn/v1/chat/completions',
         'api_key': '',  # 用户需要配置
-        'model': 'deepseek-ai/DeepSeek-R1-Distill-Qwen-7B'  # 使用SiliconFlow支持的模型
+        'model': 'deepseek-ai/DeepSeek-R1-Distill-Qwen-7B',  # 使用SiliconFlow支持的模型
+        'concurrency': 4,  # 最大并发请求数
+        'rpm': 0,  # 每分钟最多请求数，0表示不限制
+        'tpm': 0,  # 每分钟最多token数，0表示不限制
+        'input_price': 0.0,  # 每百万输入token的价格，用于 --dry-run 估算费用
+        'output_price': 0.0,  # 每百万输出token的价格
+        'output_tps': 30.0,  # 每秒生成的token数，用于估算耗时
+        'first_token_latency': 1.0,  # 发出请求到开始生成的秒数，用于估算耗时
+        'max_request_tokens': 0,  # 单个请求的输入token上限，0表示不限制
+        'max_request_cost': 0.0,  # 单个请求的费用上限，0表示不限制
+        'budget_action': 'chunk',  # 超出上限时: chunk 自动分段，refuse 拒绝请求
+        'prompt_cache': 'on',  # 是否标记可缓存的提示词前缀（Anthropic 的 cache_control），off 关闭
+        'cache_read_price': 0.0,  # 每百万命中缓存的输入token的价格，0表示按 input_price 计算
+        'cache_write_price': 0.0  # 每百万写入缓存的输入token的价格，0表示按 input_price 计算
     },
     'openai': {
         'api_url': 'https://api.openai.com/v1/chat/completions',
         'api_key': '',  # 用户需要配置
-        'model': 'gpt-3.5-turbo'
+        'model': 'gpt-3.5-turbo',
+        'concurrency': 4,  # 最大并发请求数
+        'rpm': 0,  # 每分钟最多请求数，0表示不限制
+        'tpm': 0,  # 每分钟最多token数，0表示不限制
+        'input_price': 0.0,  # 每百万输入token的价格，用于 --dry-run 估算费用
+        'output_price': 0.0,  # 每百万输出token的价格
+        'output_tps': 30.0,  # 每秒生成的token数，用于估算耗时
+        'first_token_latency': 1.0,  # 发出请求到开始生成的秒数，用于估算耗时
+        'max_request_tokens': 0,  # 单个请求的输入token上限，0表示不限制
+        'max_request_cost': 0.0,  # 单个请求的费用上限，0表示不限制
+        'budget_action': 'chunk',  # 超出上限时: chunk 自动分段，refuse 拒绝请求
+        'prompt_cache': 'on',  # 是否标记可缓存的提示词前缀（Anthropic 的 cache_control），off 关闭
+        'cache_read_price': 0.0,  # 每百万命中缓存的输入token的价格，0表示按 input_price 计算
+        'cache_write_price': 0.0  # 每百万写入缓存的输入token的价格，0表示按 input_price 计算
     },
     'anthropic': {
         'api_url': 'https://api.anthropic.com/v1/messages',
         'api_key': '',  # 用户需要配置
-        'model': 'claude-3-sonnet-20240229'
+        'model': 'claude-3-sonnet-20240229',
+        'concurrency': 4,  # 最大并发请求数
+        'rpm': 0,  # 每分钟最多请求数，0表示不限制
+        'tpm': 0,  # 每分钟最多token数，0表示不限制
+        'input_price': 0.0,  # 每百万输入token的价格，用于 --dry-run 估算费用
+        'output_price': 0.0,  # 每百万输出token的价格
+        'output_tps': 30.0,  # 每秒生成的token数，用于估算耗时
+        'first_token_latency': 1.0,  # 发出请求到开始生成的秒数，用于估算耗时
+        'max_request_tokens': 0,  # 单个请求的输入token上限，0表示不限制
+        'max_request_cost': 0.0,  # 单个请求的费用上限，0表示不限制
+        'budget_action': 'chunk',  # 超出上限时: chunk 自动分段，refuse 拒绝请求
+        'prompt_cache': 'on',  # 是否标记可缓存的提示词前缀（Anthropic 的 cache_control），off 关闭
+        'cache_read_price': 0.0,  # 每百万命中缓存的输入token的价格，0表示按 input_price 计算
+        'cache_write_price': 0.0  # 每百万写入缓存的输入token的价格，0表示按 input_price 计算
     }
 }
 
@@ -33,7 +72,15 @@ def create_default_config():
         config[api_name] = {
             'api_key': api_info['api_key'] or os.environ.get(f"{api_name.upper()}_API_KEY", ''),
             'api_url': api_info['api_url'],
-            'model': api_info['model']
+            'model': api_info['model'],
+            'concurrency': str(api_info['concurrency']),
+            'rpm': str(api_info['rpm']),
+            'tpm': str(api_info['tpm']),
+            'input_price': str(api_info['input_price']),
+            'output_price': str(api_info['output_price']),
+            'max_request_tokens': str(api_info['max_request_tokens']),
+            'max_request_cost': str(api_info['max_request_cost']),
+            'budget_action': api_info['budget_action']
         }
     
     with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
@@ -42,6 +89,32 @@ def create_default_config():
     print(f"已创建默认配置文件: {CONFIG_FILE}")
     print("请编辑此文件，填入你的API密钥。")
 
+def _get_int(section, key, default):
+    """读取配置中的非负整数，缺失或无效时使用默认值"""
+    try:
+        value = section.getint(key, default)
+    except ValueError:
+        print(f"警告: 配置项 [{section.name}] {key} 不是整数，使用默认值 {default}")
+        return default
+    return max(0, value)
+
+def _get_float(section, key, default):
+    """读取配置中的非负数，缺失或无效时使用默认值"""
+    try:
+        value = section.getfloat(key, default)
+    except ValueError:
+        print(f"警告: 配置项 [{section.name}] {key} 不是数字，使用默认值 {default}")
+        return default
+    return max(0.0, value)
+
+def _get_choice(section, key, default, choices):
+    """读取配置中的选项，不在可选值中时使用默认值"""
+    value = section.get(key, default).strip().lower()
+    if value not in choices:
+        print(f"警告: 配置项 [{section.name}] {key} 应为 {'/'.join(choices)} 之一，使用默认值 {default}")
+        return default
+    return value
+
 def load_api_config():
     """加载API配置"""
     config_path = Path(CONFIG_FILE)
@@ -51,8 +124,8 @@ def load_api_config():
         create_default_config()
         return DEFAULT_API_CONFIG
     
-    # 读取配置文件
-    config = configparser.ConfigParser()
+    # 读取配置文件（允许行尾以 # 开头的注释）
+    config = configparser.ConfigParser(inline_comment_prefixes=('#', ';'))
     config.read(CONFIG_FILE, encoding='utf-8')
     
     api_config = {}
@@ -61,7 +134,20 @@ def load_api_config():
             api_config[api_name] = {
                 'api_url': config[api_name].get('api_url', api_info['api_url']),
                 'api_key': config[api_name].get('api_key') or os.environ.get(f"{api_name.upper()}_API_KEY", ''),
-                'model': config[api_name].get('model', api_info['model'])
+                'model': config[api_name].get('model', api_info['model']),
+                'concurrency': _get_int(config[api_name], 'concurrency', api_info['concurrency']),
+                'rpm': _get_int(config[api_name], 'rpm', api_info['rpm']),
+                'tpm': _get_int(config[api_name], 'tpm', api_info['tpm']),
+                'input_price': _get_float(config[api_name], 'input_price', api_info['input_price']),
+                'output_price': _get_float(config[api_name], 'output_price', api_info['output_price']),
+                'output_tps': _get_float(config[api_name], 'output_tps', api_info['output_tps']),
+                'first_token_latency': _get_float(config[api_name], 'first_token_latency', api_info['first_token_latency']),
+                'max_request_tokens': _get_int(config[api_name], 'max_request_tokens', api_info['max_request_tokens']),
+                'max_request_cost': _get_float(config[api_name], 'max_request_cost', api_info['max_request_cost']),
+                'budget_action': _get_choice(config[api_name], 'budget_action', api_info['budget_action'], ('chunk', 'refuse')),
+                'prompt_cache': _get_choice(config[api_name], 'prompt_cache', api_info['prompt_cache'], ('on', 'off')),
+                'cache_read_price': _get_float(config[api_name], 'cache_read_price', api_info['cache_read_price']),
+                'cache_write_price': _get_float(config[api_name], 'cache_write_price', api_info['cache_write_price'])
             }
         else:
             api_config[api_name] = api_info.copy()
@@ -0,0 +1,151 @@
+import time
+import asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from provider_client import (
+    CONNECT_TIMEOUT, READ_TIMEOUT, MAX_RETRIES, RETRY_STATUS_CODES,
+    CircuitBreaker, backoff_delay, parse_retry_after, record_attempt,
+)
+from metrics import METRICS
+from rate_limiter import AsyncProviderLimiter
+
+# 是否安装了异步HTTP客户端 aiohttp（pip install aiohttp）
+AIOHTTP_AVAILABLE = aiohttp is not None
+
+# 异步请求的网络错误: aiohttp 的所有客户端错误（连接、响应体、解码等）和超时
+NETWORK_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError) if AIOHTTP_AVAILABLE else (asyncio.TimeoutError,)
+
+class AsyncProviderClient:
+    """
+    单个API源的异步HTTP客户端
+
+    重试、退避和熔断规则与 provider_client.ProviderClient 相同，等待时让出事件循环。
+    """
+
+    def __init__(self, name, session, max_retries=MAX_RETRIES):
+        """
+        Args:
+            name: API源名称
+            session: 该API源共用的 aiohttp.ClientSession
+            max_retries: 最大重试次数
+        """
+        self.name = name
+        self.session = session
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker(name)
+
+    async def post(self, url, headers, data):
+        """
+        发送POST请求，必要时重试
+
+        Args:
+            url: 请求地址
+            headers: 请求头
+            data: JSON请求体
+
+        Returns:
+            (status_code, content_type, text)；重试耗尽时返回最后一次的响应
+
+        Raises:
+            CircuitOpenError: API源处于熔断状态
+            aiohttp.ClientError / asyncio.TimeoutError: 重试耗尽后仍然出现网络错误，或出现不可重试的错误
+        """
+        self.breaker.before_request()
+        try:
+            return await self._post(url, headers, data)
+        except asyncio.CancelledError:
+            # 分段总结失败或 --hedge 已有结果时会取消其余请求，不计入熔断，
+            # 但必须解除试探状态，否则该API源会一直处于熔断
+            self.breaker.release()
+            raise
+
+    async def _post(self, url, headers, data):
+        """post 的重试循环，每个请求在返回或抛出异常前都记录熔断结果（被取消时除外）"""
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                async with self.session.post(url, headers=headers, json=data) as response:
+                    ttfb = time.monotonic() - start
+                    status = response.status
+                    content_type = response.headers.get('content-type', '')
+                    retry_after = response.headers.get('retry-after')
+                    text = await response.text()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                record_attempt(self.name, 'error', time.monotonic() - start)
+                if attempt >= self.max_retries:
+                    self.breaker.record(False)
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"{self.name} API网络错误，{delay:.1f} 秒后重试 ({attempt + 1}/{self.max_retries}): {e!r}")
+            except Exception:
+                # ClientPayloadError、解码错误等重试无意义，直接失败
+                record_attempt(self.name, 'error', time.monotonic() - start)
+                self.breaker.record(False)
+                raise
+            else:
+                record_attempt(self.name, status, time.monotonic() - start, ttfb)
+                if status not in RETRY_STATUS_CODES:
+                    # 4xx 等请求本身的错误重试也不会成功，不计入熔断
+                    self.breaker.record(status < 500)
+                    return status, content_type, text
+                if attempt >= self.max_retries:
+                    self.breaker.record(False)
+                    return status, content_type, text
+                delay = backoff_delay(attempt, parse_retry_after(retry_after))
+                print(f"{self.name} API返回状态码 {status}，{delay:.1f} 秒后重试 ({attempt + 1}/{self.max_retries})")
+
+            METRICS.inc('api_retries', api=self.name)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+class AsyncClients:
+    """
+    一次异步运行中各API源共用的HTTP会话、客户端和限流器
+
+    必须在事件循环中以 async with 使用，退出时关闭所有连接。
+    """
+
+    def __init__(self, api_sources, api_config):
+        """
+        Args:
+            api_sources: API源列表
+            api_config: load_api_config 返回的配置，读取每个API源的 concurrency、rpm、tpm
+        """
+        if not AIOHTTP_AVAILABLE:
+            raise ValueError("异步模式需要安装aiohttp，请运行: pip install aiohttp")
+        self.api_sources = list(api_sources)
+        self.api_config = api_config
+        self._sessions = []
+        self._clients = {}
+        self._limiters = {}
+
+    async def __aenter__(self):
+        timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        for api in self.api_sources:
+            config = self.api_config[api]
+            limiter = AsyncProviderLimiter(api, config.get('concurrency', 4), config.get('rpm', 0), config.get('tpm', 0))
+            # 连接池大小与并发上限一致，请求数再多也只复用这些连接
+            connector = aiohttp.TCPConnector(limit=limiter.concurrency)
+            session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._sessions.append(session)
+            self._clients[api] = AsyncProviderClient(api, session)
+            self._limiters[api] = limiter
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for session in self._sessions:
+            await session.close()
+        self._sessions.clear()
+
+    def client(self, api):
+        """获取API源的异步HTTP客户端"""
+        return self._clients[api]
+
+    def limiter(self, api):
+        """获取API源的异步限流器"""
+        return self._limiters[api]
@@ -0,0 +1,529 @@
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+
+from pipeline_state import STATE_FILE, load_state, save_state, file_digest
+from summary_cache import CACHE_DIR, SummaryCache, cache_key
+from chunked_summary import MAP_PROMPT, REDUCE_PROMPT, SUMMARY_SEPARATOR, split_content, reduce_groups
+from provider_client import get_client
+import generate_conclusion
+from generate_conclusion import (
+    API_NAMES, MAX_TOKENS, TEMPERATURE, build_request, chunk_token_budget,
+    needs_conclusion, parse_response, record_conclusion, request_headers, resolve_model, resolve_prompt, write_conclusion,
+)
+
+# 批处理进度文件的默认路径，进程重启后从中恢复已提交的批次
+BATCH_STATE_FILE = ".batch_state.json"
+
+# 每个批次提交的请求保存为此目录下的JSONL文件
+BATCH_DIR = "batches"
+
+# 轮询批次状态的初始间隔和最长间隔（秒），没有进展时间隔按 POLL_BACKOFF 倍增加
+POLL_INTERVAL = 30.0
+POLL_MAX_INTERVAL = 600.0
+POLL_BACKOFF = 1.5
+
+# OpenAI 批处理的完成时限
+COMPLETION_WINDOW = "24h"
+
+# 单个请求在批次中失败后重新提交的次数
+BATCH_RETRIES = 2
+
+# 批次的最终状态: OpenAI 的 status 和 Anthropic 的 processing_status
+FINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled', 'ended'}
+
+def batch_url(api, path=''):
+    """
+    获取API源批处理接口的地址，由 api_keys.ini 中的 api_url 推出
+
+    - SiliconFlow/OpenAI: .../v1/chat/completions -> .../v1/files、.../v1/batches
+    - Anthropic: .../v1/messages -> .../v1/messages/batches
+
+    Args:
+        api: API源名称
+        path: 追加的路径，如 '/batches'
+
+    Returns:
+        地址
+    """
+    url = generate_conclusion.API_CONFIG[api]['api_url'].rstrip('/')
+    if api == 'anthropic':
+        return f"{url}/batches{path}"
+    suffix = '/chat/completions'
+    if url.endswith(suffix):
+        url = url[:-len(suffix)]
+    return f"{url}{path}"
+
+def _check(api, response, action):
+    """批处理接口返回错误状态码时抛出 ValueError"""
+    if response.status_code >= 300:
+        raise ValueError(f"{API_NAMES[api]} {action}失败 (状态码: {response.status_code}): {response.text[:500]}")
+    return response
+
+def load_batch_state(state_file=BATCH_STATE_FILE):
+    """
+    加载批处理进度
+
+    进度文件记录:
+    - jobs: 每个 (文件, API源) 任务 {文件名|API源: {file, api, sha256, prompt, chunk_tokens, final, requests, summary, error}}
+    - batches: 已提交的批次 {批次ID: {api, status, artifact, submitted, custom_ids}}
+    - next_id: 下一个请求的编号（custom_id 只能使用字母数字，不能直接使用中文文件名）
+
+    Args:
+        state_file: 进度文件路径
+
+    Returns:
+        进度字典
+    """
+    state = {}
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"警告: 无法读取批处理进度文件 '{state_file}'，将重新开始: {e}")
+            state = {}
+    state.setdefault('jobs', {})
+    state.setdefault('batches', {})
+    state.setdefault('next_id', 0)
+    return state
+
+def _new_request(state, job, content, prompt):
+    """在任务的当前一轮中添加一个请求，命中总结缓存时直接记录结果"""
+    custom_id = f"req-{state['next_id']}"
+    state['next_id'] += 1
+    request = {'content': content, 'prompt': prompt, 'batch': None, 'attempts': 0, 'summary': None, 'error': None}
+    cache = generate_conclusion.SUMMARY_CACHE
+    if cache is not None:
+        summary = cache.get(_cache_key(job['api'], content, prompt))
+        if summary is not None:
+            request.update(content=None, summary=summary)
+    job['requests'][custom_id] = request
+    job['order'].append(custom_id)
+
+def _cache_key(api, content, prompt):
+    return cache_key(api, resolve_model(api), generate_conclusion.SYSTEM_PROMPT, resolve_prompt(prompt), content, TEMPERATURE, MAX_TOKENS)
+
+def _start_round(state, job, items, final):
+    """开始任务的下一轮请求，items 为 [(内容, 提示词)]"""
+    job['requests'] = {}
+    job['order'] = []
+    job['final'] = final
+    for content, prompt in items:
+        _new_request(state, job, content, prompt)
+
+def add_jobs(state, input_files, api_sources, custom_prompt=None):
+    """
+    为每个 (文件, API源) 创建任务的第一轮请求，与 map_reduce_summarize 相同: 不超过预算时一次总结，
+    否则先分段总结
+
+    已有任务且文件内容未变化时保留原有进度（进程重启后继续）。
+
+    Args:
+        state: 批处理进度
+        input_files: 需要总结的文件路径列表
+        api_sources: API源列表
+        custom_prompt: 自定义提示词
+    """
+    for input_file in input_files:
+        digest = file_digest(input_file)
+        with open(input_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+        for api in api_sources:
+            key = f"{os.path.basename(input_file)}|{api}"
+            job = state['jobs'].get(key)
+            if job is not None and job['sha256'] == digest and job['prompt'] == custom_prompt:
+                continue
+            job = state['jobs'][key] = {
+                'file': input_file, 'api': api, 'sha256': digest, 'prompt': custom_prompt,
+                'chunk_tokens': None, 'summary': None, 'error': None,
+            }
+            try:
+                job['chunk_tokens'] = chunk_token_budget(api, content, custom_prompt)
+            except ValueError as e:
+                job['error'] = str(e)
+                _start_round(state, job, [], True)
+                continue
+            chunks = split_content(content, job['chunk_tokens'])
+            if len(chunks) <= 1:
+                _start_round(state, job, [(content, custom_prompt)], True)
+            else:
+                total = len(chunks)
+                _start_round(state, job, [(chunk, MAP_PROMPT.format(index=index, total=total)) for index, chunk in enumerate(chunks, 1)], False)
+
+def advance_job(state, job):
+    """
+    当前一轮的请求都有结果后，开始下一轮（逐层合并或最终合并）或记录最终总结
+
+    Args:
+        state: 批处理进度
+        job: 任务
+
+    Returns:
+        任务是否已结束（成功或失败）
+    """
+    if job['summary'] is not None or job['error'] is not None:
+        return True
+    requests = [job['requests'][custom_id] for custom_id in job['order']]
+    errors = [request['error'] for request in requests if request['error'] is not None]
+    if errors:
+        job['error'] = errors[0]
+        return True
+    if any(request['summary'] is None for request in requests):
+        return False
+
+    summaries = [request['summary'] for request in requests]
+    if job['final']:
+        job['summary'] = summaries[0]
+        job['requests'], job['order'] = {}, []
+        return True
+    groups = reduce_groups(summaries, job['chunk_tokens'])
+    if groups is None:
+        _start_round(state, job, [(SUMMARY_SEPARATOR.join(summaries), job['prompt'] or REDUCE_PROMPT)], True)
+    else:
+        _start_round(state, job, [(SUMMARY_SEPARATOR.join(group), REDUCE_PROMPT) for group in groups], False)
+    # 新一轮的请求可能全部命中缓存
+    return advance_job(state, job)
+
+def submit_batch(api, requests, batch_dir=BATCH_DIR):
+    """
+    将一组请求写入JSONL文件并提交到API源的批处理接口
+
+    Args:
+        api: API源名称
+        requests: [(custom_id, 内容, 提示词)]
+        batch_dir: JSONL文件的保存目录
+
+    Returns:
+        (批次ID, JSONL文件路径)
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    lines = []
+    for custom_id, content, prompt in requests:
+        _, _, body = build_request(api, content, prompt)
+        if api == 'anthropic':
+            lines.append({'custom_id': custom_id, 'params': body})
+        else:
+            lines.append({'custom_id': custom_id, 'method': 'POST', 'url': '/v1/chat/completions', 'body': body})
+    artifact = os.path.join(batch_dir, f"{api}-{datetime.now():%Y%m%d-%H%M%S-%f}.jsonl")
+    data = ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines)
+    with open(artifact, 'w', encoding='utf-8') as f:
+        f.write(data)
+
+    client = get_client(api)
+    headers = request_headers(api)
+    if api == 'anthropic':
+        response = _check(api, client.post(batch_url(api), headers=headers, json={'requests': lines}), '提交批次')
+        return response.json()['id'], artifact
+
+    # OpenAI 格式: 先上传JSONL文件，再用文件ID创建批次；上传使用 multipart，去掉JSON的 content-type
+    upload_headers = {key: value for key, value in headers.items() if key.lower() != 'content-type'}
+    response = _check(api, client.post(
+        batch_url(api, '/files'), headers=upload_headers, data={'purpose': 'batch'},
+        files={'file': (os.path.basename(artifact), data.encode('utf-8'), 'application/jsonl')},
+    ), '上传批处理文件')
+    file_id = response.json()['id']
+    response = _check(api, client.post(batch_url(api, '/batches'), headers=headers, json={
+        'input_file_id': file_id, 'endpoint': '/v1/chat/completions', 'completion_window': COMPLETION_WINDOW,
+    }), '提交批次')
+    return response.json()['id'], artifact
+
+def poll_batch(api, batch_id):
+    """
+    查询批次状态
+
+    Returns:
+        批次信息（接口返回的JSON），状态在 status（OpenAI）或 processing_status（Anthropic）中
+    """
+    return _check(api, get_client(api).get(batch_url(api, f"/{batch_id}" if api == 'anthropic' else f"/batches/{batch_id}"), headers=request_headers(api)), '查询批次').json()
+
+def batch_status(api, info):
+    return info.get('processing_status') if api == 'anthropic' else info.get('status')
+
+def fetch_results(api, info):
+    """
+    下载已结束批次的结果
+
+    Args:
+        api: API源名称
+        info: poll_batch 返回的批次信息
+
+    Returns:
+        {custom_id: (总结, 错误信息)}，成功时错误信息为None，失败时总结为None
+    """
+    if api == 'anthropic':
+        urls = [info['results_url']] if info.get('results_url') else []
+    else:
+        urls = [batch_url(api, f"/files/{info[key]}/content") for key in ('output_file_id', 'error_file_id') if info.get(key)]
+
+    results = {}
+    for url in urls:
+        response = _check(api, get_client(api).get(url, headers=request_headers(api)), '下载批次结果')
+        response.encoding = 'utf-8'
+        for line in response.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            results[item['custom_id']] = _parse_result(api, item)
+    return results
+
+def _parse_result(api, item):
+    """解析批次结果中的一行，成功的响应与同步调用一样记录token用量"""
+    try:
+        if api == 'anthropic':
+            result = item['result']
+            if result['type'] != 'succeeded':
+                return None, f"{API_NAMES[api]} 批处理请求{result['type']}: {json.dumps(result.get('error'), ensure_ascii=False)[:500]}"
+            return parse_response(api, 200, 'application/json', json.dumps(result['message'])), None
+        if item.get('error'):
+            return None, f"{API_NAMES[api]} 批处理请求失败: {json.dumps(item['error'], ensure_ascii=False)[:500]}"
+        response = item['response']
+        return parse_response(api, response['status_code'], 'application/json', json.dumps(response['body'])), None
+    except (KeyError, TypeError, ValueError) as e:
+        return None, str(e)
+
+class BatchRunner:
+    """
+    通过批处理接口总结多个文件: 提交所有待发出的请求，按退避间隔轮询，结果返回后开始下一轮
+    （分段总结的合并），某个文件的所有API源都结束后写入总结文件
+
+    每次状态变化后保存进度文件，进程中断后重新运行同样的命令即可继续轮询已提交的批次。
+    """
+
+    def __init__(self, output_dir, api_sources, state_file=BATCH_STATE_FILE, batch_dir=BATCH_DIR,
+                 pipeline_state=None, pipeline_state_file=STATE_FILE):
+        """
+        Args:
+            output_dir: 总结输出目录
+            api_sources: API源列表
+            state_file: 批处理进度文件路径
+            batch_dir: 提交的JSONL文件的保存目录
+            pipeline_state: 增量处理状态，为None时不记录
+            pipeline_state_file: 增量处理状态文件路径
+        """
+        self.output_dir = output_dir
+        self.api_sources = api_sources
+        self.state_file = state_file
+        self.batch_dir = batch_dir
+        self.pipeline_state = pipeline_state
+        self.pipeline_state_file = pipeline_state_file
+        self.state = load_batch_state(state_file)
+        self.success_count = 0
+
+    def save(self):
+        save_state(self.state, self.state_file)
+
+    def submit_pending(self):
+        """
+        每个API源把所有未提交的请求作为一个批次提交
+
+        Returns:
+            提交的批次数
+        """
+        pending = {}
+        for job in self.state['jobs'].values():
+            for custom_id in job['order']:
+                request = job['requests'][custom_id]
+                if request['batch'] is None and request['summary'] is None and request['error'] is None:
+                    pending.setdefault(job['api'], []).append((custom_id, request))
+
+        submitted = 0
+        for api, requests in pending.items():
+            try:
+                batch_id, artifact = submit_batch(api, [(custom_id, request['content'], request['prompt']) for custom_id, request in requests], self.batch_dir)
+            except (ValueError, OSError) as e:
+                # 提交失败（网络错误已在 provider_client 中重试）时下一轮再试
+                print(f"提交 {api} 批次时出错: {e}")
+                continue
+            for custom_id, request in requests:
+                request['batch'] = batch_id
+                request['attempts'] += 1
+            self.state['batches'][batch_id] = {
+                'api': api, 'status': 'submitted', 'artifact': artifact,
+                'submitted': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'custom_ids': [custom_id for custom_id, _ in requests],
+            }
+            print(f"已提交 {api} 批次 {batch_id}: {len(requests)} 个请求（{artifact}）")
+            submitted += 1
+            self.save()
+        return submitted
+
+    def poll(self):
+        """
+        查询所有未结束的批次，已结束的批次下载结果并推进相应的任务
+
+        Returns:
+            是否有批次结束
+        """
+        requests = {}
+        for job in self.state['jobs'].values():
+            for custom_id, request in job['requests'].items():
+                requests[custom_id] = (job, request)
+
+        progressed = False
+        for batch_id, batch in self.state['batches'].items():
+            if batch['status'] == 'done':
+                continue
+            api = batch['api']
+            try:
+                info = poll_batch(api, batch_id)
+                status = batch_status(api, info)
+                if status not in FINAL_STATUSES:
+                    if status != batch['status']:
+                        print(f"{api} 批次 {batch_id}: {status}")
+                        batch['status'] = status
+                    continue
+                results = fetch_results(api, info) if status != 'failed' else {}
+            except (ValueError, OSError) as e:
+                print(f"查询 {api} 批次 {batch_id} 时出错: {e}")
+                continue
+
+            cache = generate_conclusion.SUMMARY_CACHE
+            for custom_id in batch['custom_ids']:
+                if custom_id not in requests:
+                    continue
+                job, request = requests[custom_id]
+                summary, error = results.get(custom_id, (None, f"{API_NAMES[api]} 批次 {batch_id} 结束（{status}）时没有该请求的结果"))
+                if summary is not None:
+                    if cache is not None:
+                        cache.put(_cache_key(api, request['content'], request['prompt']), summary, api=api, model=resolve_model(api))
+                    request.update(content=None, summary=summary)
+                elif request['attempts'] <= BATCH_RETRIES:
+                    print(f"{custom_id} 失败，将重新提交: {error}")
+                    request['batch'] = None
+                else:
+                    request['error'] = error
+            batch['status'] = 'done'
+            print(f"{api} 批次 {batch_id} 已结束（{status}），返回 {len(results)}/{len(batch['custom_ids'])} 个结果")
+            progressed = True
+            self.save()
+        return progressed
+
+    def finish_files(self):
+        """写入所有API源都已结束的文件的总结，并从进度中移除这些文件的任务"""
+        files = {}
+        for key, job in self.state['jobs'].items():
+            files.setdefault(job['file'], []).append((key, job))
+
+        for input_file, jobs in files.items():
+            # 每个任务都要推进（开始下一轮），不能在第一个未结束的任务处停止
+            if not all([advance_job(self.state, job) for _, job in jobs]):
+                continue
+            file = os.path.basename(input_file)
+            for _, job in jobs:
+                if job['error'] is not None:
+                    print(f"调用 {job['api']} API总结 {file} 时出错：{job['error']}")
+            results = {job['api']: job['summary'] for _, job in jobs if job['summary'] is not None}
+            summary_results = {api: results[api] for api in self.api_sources if api in results}
+            if not summary_results:
+                print(f"处理文件 {file} 时出错: 未能从任何API源获取总结结果")
+            else:
+                try:
+                    output_file = write_conclusion(input_file, self.output_dir, summary_results)
+                except OSError as e:
+                    print(f"处理文件 {file} 时出错: {e}")
+                    continue
+                if self.pipeline_state is not None:
+                    record_conclusion(self.pipeline_state, input_file, jobs[0][1]['sha256'], summary_results, output_file)
+                    save_state(self.pipeline_state, self.pipeline_state_file)
+                print(f"成功处理文件: {file} -> {os.path.basename(output_file)}")
+                self.success_count += 1
+            for key, _ in jobs:
+                del self.state['jobs'][key]
+        # 所有请求都已取得结果的批次不再需要保留
+        active = {request['batch'] for job in self.state['jobs'].values() for request in job['requests'].values()}
+        self.state['batches'] = {batch_id: batch for batch_id, batch in self.state['batches'].items()
+                                 if batch['status'] != 'done' or batch_id in active}
+        self.save()
+
+    def run(self, poll_interval=POLL_INTERVAL, max_interval=POLL_MAX_INTERVAL, wait=True):
+        """
+        提交并轮询，直到所有任务结束
+
+        Args:
+            poll_interval: 初始轮询间隔（秒）
+            max_interval: 最长轮询间隔（秒）
+            wait: 为False时提交后立即返回，之后再次运行以继续轮询
+
+        Returns:
+            本次运行中成功生成总结的文件数
+        """
+        interval = poll_interval
+        while True:
+            # 先推进已有结果的任务，新一轮的请求在同一次循环中提交
+            self.finish_files()
+            if not self.state['jobs']:
+                break
+            if self.submit_pending():
+                interval = poll_interval
+            if not wait:
+                print(f"已提交，尚有 {len(self.state['jobs'])} 个任务未完成，稍后重新运行以取回结果")
+                break
+            time.sleep(interval)
+            interval = poll_interval if self.poll() else min(interval * POLL_BACKOFF, max_interval)
+        return self.success_count
+
+def main():
+    """命令行入口函数"""
+    parser = argparse.ArgumentParser(description='通过 OpenAI Batch / Anthropic Message Batches 接口离线批量总结（费用更低，适合不着急的夜间任务）')
+    parser.add_argument('-f', '--file', help='指定要处理的文件路径')
+    parser.add_argument('-d', '--input-dir', default='outputs', help='指定要处理的文件目录，默认为outputs')
+    parser.add_argument('-o', '--output-dir', default='conclusion', help='指定总结文件输出目录，默认为conclusion')
+    parser.add_argument('-a', '--api', nargs='+', default=['openai'], choices=['siliconflow', 'openai', 'anthropic'],
+                        help='指定要使用的API源，可多选，默认为openai（SiliconFlow 使用与 OpenAI 相同的批处理接口）')
+    parser.add_argument('-p', '--prompt', help='自定义提示词')
+    parser.add_argument('-m', '--model', help='指定要使用的SiliconFlow模型名称')
+    parser.add_argument('--incremental', action='store_true', help='增量处理，只总结新增或内容有变化的文件')
+    parser.add_argument('--state-file', default=STATE_FILE, help=f'增量处理状态文件路径，默认为{STATE_FILE}')
+    parser.add_argument('--batch-state', default=BATCH_STATE_FILE, help=f'批处理进度文件路径，默认为{BATCH_STATE_FILE}')
+    parser.add_argument('--batch-dir', default=BATCH_DIR, help=f'提交的JSONL请求文件的保存目录，默认为{BATCH_DIR}')
+    parser.add_argument('--chunk-tokens', type=int, default=generate_conclusion.CHUNK_TOKENS, help=f'每个请求中聊天内容的token预算，默认为{generate_conclusion.CHUNK_TOKENS}')
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help=f'初始轮询间隔（秒），没有进展时逐渐增加，默认为{POLL_INTERVAL:g}')
+    parser.add_argument('--max-poll-interval', type=float, default=POLL_MAX_INTERVAL, help=f'最长轮询间隔（秒），默认为{POLL_MAX_INTERVAL:g}')
+    parser.add_argument('--no-wait', action='store_true', help='提交后立即退出，之后重新运行以取回结果（适合由cron定时运行）')
+    parser.add_argument('--no-cache', action='store_true', help='不使用总结缓存')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help=f'总结缓存目录，默认为{CACHE_DIR}')
+
+    args = parser.parse_args()
+    if args.chunk_tokens <= 0 or args.poll_interval <= 0:
+        print("错误: --chunk-tokens 和 --poll-interval 必须为正数")
+        return
+    generate_conclusion.CHUNK_TOKENS = args.chunk_tokens
+    generate_conclusion.SUMMARY_CACHE = None if args.no_cache else SummaryCache(args.cache_dir)
+    if args.model and 'siliconflow' in generate_conclusion.API_CONFIG:
+        generate_conclusion.API_CONFIG['siliconflow']['model'] = args.model
+
+    missing_keys = [api for api in args.api if not generate_conclusion.API_CONFIG[api]['api_key']]
+    if missing_keys:
+        print(f"错误: 以下API源未设置密钥: {', '.join(missing_keys)}，请使用 'python api_config.py' 设置密钥")
+        return
+
+    if args.file:
+        if not os.path.exists(args.file):
+            print(f"错误: 文件 {args.file} 不存在")
+            return
+        input_files = [args.file]
+    else:
+        input_files = [os.path.join(args.input_dir, f) for f in sorted(os.listdir(args.input_dir))
+                       if f.startswith('cleaned_') and os.path.isfile(os.path.join(args.input_dir, f))]
+
+    pipeline_state = None
+    if args.incremental:
+        pipeline_state = load_state(args.state_file)
+        input_files = [f for f in input_files if needs_conclusion(f, args.output_dir, args.api, pipeline_state)]
+
+    runner = BatchRunner(args.output_dir, args.api, args.batch_state, args.batch_dir, pipeline_state, args.state_file)
+    add_jobs(runner.state, input_files, args.api, args.prompt)
+    if not runner.state['jobs']:
+        print("没有需要总结的文件")
+        return
+    runner.save()
+    print(f"共 {len(runner.state['jobs'])} 个 (文件, API源) 任务")
+
+    success_count = runner.run(args.poll_interval, args.max_poll_interval, wait=not args.no_wait)
+    print(f"总计: 本次写入 {success_count} 个总结文件")
+
+if __name__ == "__main__":
+    main()
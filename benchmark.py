@@ -0,0 +1,279 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+import multiprocessing
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:
+    # Windows 上没有 resource 模块，不统计内存峰值
+    resource = None
+
+from synthetic_export import generate_export, parse_size
+from filter_engine import load_filter_engine
+from process_chat_logs import get_last_message_date, filter_by_date, clean_content, clean_chat_log, clean_chat_log_stream
+
+# 结果文件格式版本，格式变化时递增
+RESULTS_VERSION = 1
+
+# 合成数据的缓存目录，相同参数的文件只生成一次
+DATA_DIR = '.bench_data'
+
+# 默认测试的文件大小
+DEFAULT_SIZES = ['1MB', '10MB', '100MB']
+
+# 合成数据的日期范围
+START_DATE = datetime(2025, 3, 1)
+DAYS = 30
+
+# 比较结果时，耗时增加超过此比例视为性能退化
+REGRESSION_THRESHOLD = 0.1
+
+def _last_message_date(data):
+    get_last_message_date(data['content'])
+
+def _filter_by_date(data):
+    filter_by_date(data['content'], data['start_date'], data['end_date'])
+
+def _filter_rules(data):
+    data['engine'].apply_lines(data['content'])
+
+def _filter_rules_sequential(data):
+    # 逐条规则依次扫描全文，作为 apply_lines 的对照
+    data['engine']._apply_sequential(data['content'])
+
+def _clean_content(data):
+    clean_content(data['content'], data['engine'])
+
+def _clean_chat_log(data, clean=clean_chat_log):
+    with redirect_stdout(io.StringIO()):
+        clean(data['input_file'], os.path.join(data['output_dir'], 'cleaned.txt'),
+              filter_file=data['filter_file'], date_range=data['date_range'], use_index=False)
+
+def _clean_chat_log_stream(data):
+    _clean_chat_log(data, clean=clean_chat_log_stream)
+
+# 测试项: 名称 -> (是否需要预先读入文件内容, 测试函数)
+# 需要预先读入内容的测试项只计算处理时间；clean_chat_log 测试项包括读取和写入文件的完整耗时
+STAGES = {
+    'get_last_message_date': (True, _last_message_date),
+    'filter_by_date': (True, _filter_by_date),
+    'filter_rules': (True, _filter_rules),
+    'filter_rules_sequential': (True, _filter_rules_sequential),
+    'clean_content': (True, _clean_content),
+    'clean_chat_log': (False, _clean_chat_log),
+    'clean_chat_log_stream': (False, _clean_chat_log_stream),
+}
+
+def peak_rss_mb():
+    """当前进程的内存峰值（MB），不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为KB，macOS 上为字节
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+def run_stage(stage, input_file, filter_file, repeat):
+    """
+    在当前进程中运行一个测试项
+
+    Args:
+        stage: 测试项名称（见 STAGES）
+        input_file: 聊天记录文件路径
+        filter_file: 过滤关键词配置文件路径
+        repeat: 重复次数，取最短耗时
+
+    Returns:
+        (最短耗时秒数, 内存峰值MB)
+    """
+    needs_content, fn = STAGES[stage]
+    end_date = START_DATE + timedelta(days=DAYS - 1)
+    data = {
+        'input_file': input_file,
+        'filter_file': filter_file,
+        'start_date': START_DATE,
+        'end_date': end_date,
+        'date_range': f"{START_DATE:%Y-%m-%d}={end_date:%Y-%m-%d}",
+        'engine': load_filter_engine(filter_file),
+        'output_dir': tempfile.mkdtemp(prefix='bench_'),
+    }
+    if needs_content:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            data['content'] = f.read()
+
+    try:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        shutil.rmtree(data['output_dir'], ignore_errors=True)
+    return best, peak_rss_mb()
+
+def run_stage_isolated(stage, input_file, filter_file, repeat):
+    """在新的子进程中运行一个测试项，使内存峰值只反映该测试项"""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_stage, stage, input_file, filter_file, repeat).result()
+
+def prepare_data(size, data_dir=DATA_DIR, seed=0):
+    """
+    获取指定大小的合成聊天记录文件，不存在时生成
+
+    Args:
+        size: 文件大小（字节）
+        data_dir: 缓存目录
+        seed: 随机种子
+
+    Returns:
+        文件路径
+    """
+    path = os.path.join(data_dir, f"synthetic_{size}_{seed}_{DAYS}.txt")
+    if not os.path.exists(path):
+        print(f"生成测试数据 {path} ...")
+        # 先写入临时文件，生成中断时不会留下不完整的缓存
+        generate_export(path + '.tmp', size, seed, DAYS, START_DATE)
+        os.replace(path + '.tmp', path)
+    return path
+
+def git_commit():
+    """当前的 git 提交，不在 git 仓库中时返回None"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes, stages, filter_file='filter_keywords.txt', repeat=3, data_dir=DATA_DIR, seed=0):
+    """
+    运行性能测试
+
+    Args:
+        sizes: 文件大小字符串列表，如 ['1MB', '100MB']
+        stages: 测试项名称列表
+        filter_file: 过滤关键词配置文件路径
+        repeat: 每个测试项的重复次数，取最短耗时
+        data_dir: 合成数据的缓存目录
+        seed: 合成数据的随机种子
+
+    Returns:
+        结果字典，可用 json 保存并与其他提交的结果比较
+    """
+    results = []
+    for size in sizes:
+        input_file = prepare_data(parse_size(size), data_dir, seed)
+        file_bytes = os.path.getsize(input_file)
+        for stage in stages:
+            seconds, peak = run_stage_isolated(stage, input_file, filter_file, repeat)
+            result = {
+                'size': size,
+                'bytes': file_bytes,
+                'stage': stage,
+                'seconds': round(seconds, 6),
+                'mb_per_s': round(file_bytes / (1 << 20) / seconds, 2) if seconds else None,
+                'peak_rss_mb': round(peak, 1) if peak is not None else None,
+            }
+            results.append(result)
+            print(format_result(result))
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+
+def format_result(result):
+    """生成一项测试结果的说明文字"""
+    rss = f"{result['peak_rss_mb']:8.1f} MB" if result['peak_rss_mb'] is not None else "       -"
+    return f"{result['size']:>8}  {result['stage']:<24} {result['seconds']:9.3f} s  {result['mb_per_s'] or 0:9.1f} MB/s  峰值内存 {rss}"
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    比较两次测试的结果，打印每一项的耗时变化
+
+    Args:
+        baseline: 作为基准的结果字典
+        current: 本次的结果字典
+        threshold: 耗时增加超过此比例视为性能退化
+
+    Returns:
+        性能退化的测试项列表 [(size, stage, 比例)]
+    """
+    if baseline.get('version') != current.get('version'):
+        print(f"警告: 结果文件格式版本不同（{baseline.get('version')} / {current.get('version')}），比较结果可能不准确")
+
+    previous = {(r['size'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    print(f"与 {baseline.get('commit') or '基准结果'} 比较:")
+    for result in current['results']:
+        old = previous.get((result['size'], result['stage']))
+        if old is None or not old['seconds']:
+            continue
+        ratio = result['seconds'] / old['seconds']
+        mark = ''
+        if ratio > 1 + threshold:
+            mark = '  <- 变慢'
+            regressions.append((result['size'], result['stage'], ratio))
+        elif ratio < 1 - threshold:
+            mark = '  <- 变快'
+        print(f"{result['size']:>8}  {result['stage']:<24} {old['seconds']:9.3f} s -> {result['seconds']:9.3f} s  ({ratio:.2f}x){mark}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天记录清理的性能测试（吞吐量、内存峰值、各阶段耗时）')
+    parser.add_argument('-s', '--sizes', nargs='+', default=DEFAULT_SIZES, help=f'测试的文件大小，默认为{" ".join(DEFAULT_SIZES)}')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES), help='要运行的测试项，默认为全部')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='每个测试项的重复次数，取最短耗时，默认为3')
+    parser.add_argument('-k', '--filter-file', default='filter_keywords.txt', help='过滤关键词配置文件，默认为filter_keywords.txt')
+    parser.add_argument('-o', '--output', help='将结果保存为JSON文件')
+    parser.add_argument('--compare', help='与之前保存的JSON结果比较，有性能退化时以状态码1退出')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help=f'耗时增加超过此比例视为性能退化，默认为{REGRESSION_THRESHOLD}')
+    parser.add_argument('--data-dir', default=DATA_DIR, help=f'合成数据的缓存目录，默认为{DATA_DIR}')
+    parser.add_argument('--seed', type=int, default=0, help='合成数据的随机种子，默认为0')
+
+    args = parser.parse_args()
+
+    if args.repeat <= 0:
+        print("错误: --repeat 必须为正整数")
+        return 1
+    try:
+        for size in args.sizes:
+            parse_size(size)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return 1
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(args.sizes, args.stages, args.filter_file, args.repeat, args.data_dir, args.seed)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存至: {args.output}")
+
+    if baseline is not None and compare_results(baseline, results, args.threshold):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
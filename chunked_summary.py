@@ -0,0 +1,226 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from token_estimator import estimate_tokens
+from metrics import METRICS, propagate_group
+
+# 每个请求中聊天内容的默认token预算（不含提示词和输出）
+CHUNK_TOKENS = 6000
+
+# 并行总结分段时的默认线程数
+CHUNK_WORKERS = 4
+
+# 分段总结（map）时使用的提示词，{index}/{total} 为分段序号；提示词放在内容之后
+MAP_PROMPT = "上面是一段较长聊天记录按时间顺序切分后的第{index}/{total}部分。请按话题提取这一部分的主要内容和关键信息，链接原样保留。"
+
+# 合并分段总结（reduce）时使用的提示词
+REDUCE_PROMPT = "上面是同一段聊天记录按时间顺序分段总结的结果。请将它们合并为一份完整的总结，相同话题的内容放在一起，按话题划分小标题，链接原样保留。"
+
+# 合并时分段总结之间的分隔符
+SUMMARY_SEPARATOR = "\n\n---\n\n"
+
+def split_content(content, max_tokens=CHUNK_TOKENS):
+    """
+    将聊天内容按消息边界切分为不超过token预算的分段
+
+    清理后的聊天记录每行是一条消息（或一条多行消息中的一行），分段只在行之间切开；
+    单独一行就超过预算时，才在行内按字符切开。
+
+    Args:
+        content: 清理后的聊天内容
+        max_tokens: 每个分段的token预算
+
+    Returns:
+        分段文本列表，按原顺序排列
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for line in content.splitlines(keepends=True):
+        tokens = estimate_tokens(line)
+        if tokens > max_tokens:
+            # 单行过长，先结束当前分段，再把这一行按字符切开
+            if current:
+                chunks.append(''.join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_long_line(line, max_tokens))
+            continue
+
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(''.join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += tokens
+
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+def _split_long_line(line, max_tokens):
+    """把超过预算的单行按字符切开（每个字符至多算一个token，按预算的字符数切开一定不超预算）"""
+    return [line[i:i + max_tokens] for i in range(0, len(line), max_tokens)]
+
+def _group_summaries(summaries, max_tokens, measure=estimate_tokens):
+    """把分段总结按顺序分组，每组不超过token预算，且至少两个一组以保证每轮都能减少数量"""
+    groups = []
+    current = []
+    current_tokens = 0
+    for summary in summaries:
+        tokens = measure(summary)
+        if len(current) >= 2 and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(summary)
+        current_tokens += tokens
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    return groups
+
+def reduce_groups(summaries, max_tokens=CHUNK_TOKENS):
+    """
+    决定如何合并一轮分段总结（与 map_reduce_summarize 的合并方式相同，供分多次提交请求的调用方使用）
+
+    Args:
+        summaries: 按顺序排列的分段总结
+        max_tokens: 每个请求中内容的token预算
+
+    Returns:
+        合并后仍超过预算时返回下一轮的分组列表，可以一次合并时返回None
+    """
+    if estimate_tokens(SUMMARY_SEPARATOR.join(summaries)) > max_tokens and len(summaries) > 2:
+        return _group_summaries(summaries, max_tokens)
+    return None
+
+def map_reduce_summarize(summarize, content, prompt=None, max_tokens=CHUNK_TOKENS, workers=CHUNK_WORKERS, verbose=True, final_summarize=None):
+    """
+    分段总结较长的聊天内容：先并行总结每个分段，再合并分段总结（必要时逐层合并）
+
+    Args:
+        summarize: 总结函数 summarize(content, prompt)，返回总结文本
+        content: 清理后的聊天内容
+        prompt: 最终合并时使用的自定义提示词，默认为 REDUCE_PROMPT
+        max_tokens: 每个请求中内容的token预算
+        workers: 并行请求的线程数
+        verbose: 是否打印分段进度
+        final_summarize: 生成最终总结（不分段时的唯一一次请求，或最后一次合并）时使用的总结函数，
+            默认与 summarize 相同，例如流式输出时只有最终总结需要流式写入
+
+    Returns:
+        最终总结内容
+    """
+    final_summarize = final_summarize or summarize
+    with METRICS.stage('split'):
+        chunks = split_content(content, max_tokens)
+    if len(chunks) <= 1:
+        return final_summarize(content, prompt)
+
+    total = len(chunks)
+    if verbose:
+        print(f"内容约 {estimate_tokens(content)} tokens，切分为 {total} 段分别总结")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # map: 并行总结每个分段，结果保持原顺序
+        # 线程池中的请求仍计入当前的群（见 metrics.propagate_group）
+        summaries = list(executor.map(
+            propagate_group(lambda item: summarize(item[1], MAP_PROMPT.format(index=item[0], total=total))),
+            enumerate(chunks, 1)
+        ))
+
+        # reduce: 合并后仍超过预算时，分组合并，直到可以一次合并
+        level = 1
+        while estimate_tokens(SUMMARY_SEPARATOR.join(summaries)) > max_tokens and len(summaries) > 2:
+            groups = _group_summaries(summaries, max_tokens)
+            if verbose:
+                print(f"第 {level} 层合并: {len(summaries)} 段总结合并为 {len(groups)} 段")
+            summaries = list(executor.map(
+                propagate_group(lambda group: summarize(SUMMARY_SEPARATOR.join(group), REDUCE_PROMPT)),
+                groups
+            ))
+            level += 1
+
+    return final_summarize(SUMMARY_SEPARATOR.join(summaries), prompt or REDUCE_PROMPT)
+
+def plan_requests(content, max_tokens=CHUNK_TOKENS, summary_tokens=1500, measure=estimate_tokens):
+    """
+    按 map_reduce_summarize 的分段和合并方式预估需要发出的请求，不调用API
+
+    分段总结的长度无法预知，按每段总结都达到 summary_tokens（即请求的最大输出长度）估算，
+    因此合并的层数和请求数是上限。
+
+    Args:
+        content: 清理后的聊天内容
+        max_tokens: 每个请求中内容的token预算
+        summary_tokens: 每段总结的token数
+        measure: 计算分段token数的函数，默认为 estimate_tokens，可传入模型对应的分词器
+
+    Returns:
+        每一轮请求的列表，每轮为该轮各请求内容（不含提示词）的token数列表，最后一轮只有一个请求
+    """
+    chunks = split_content(content, max_tokens)
+    if len(chunks) <= 1:
+        return [[measure(content)]]
+
+    rounds = [[measure(chunk) for chunk in chunks]]
+    separator = estimate_tokens(SUMMARY_SEPARATOR)
+    summaries = [summary_tokens] * len(chunks)
+    while sum(summaries) + separator * (len(summaries) - 1) > max_tokens and len(summaries) > 2:
+        groups = _group_summaries(summaries, max_tokens, measure=lambda tokens: tokens)
+        rounds.append([sum(group) + separator * (len(group) - 1) for group in groups])
+        summaries = [summary_tokens] * len(groups)
+    rounds.append([sum(summaries) + separator * (len(summaries) - 1)])
+    return rounds
+
+async def _gather_or_cancel(coroutines):
+    """并发执行协程并按顺序返回结果；任何一个失败时取消其余仍在进行的请求"""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def map_reduce_summarize_async(summarize, content, prompt=None, max_tokens=CHUNK_TOKENS, verbose=True):
+    """
+    map_reduce_summarize 的异步版本，所有分段同时发出请求，并发数由调用方的限流器控制
+
+    Args:
+        summarize: 总结协程函数 summarize(content, prompt)，返回总结文本
+        content: 清理后的聊天内容
+        prompt: 最终合并时使用的自定义提示词，默认为 REDUCE_PROMPT
+        max_tokens: 每个请求中内容的token预算
+        verbose: 是否打印分段进度
+
+    Returns:
+        最终总结内容
+    """
+    with METRICS.stage('split'):
+        chunks = split_content(content, max_tokens)
+    if len(chunks) <= 1:
+        return await summarize(content, prompt)
+
+    total = len(chunks)
+    if verbose:
+        print(f"内容约 {estimate_tokens(content)} tokens，切分为 {total} 段分别总结")
+
+    summaries = await _gather_or_cancel(
+        summarize(chunk, MAP_PROMPT.format(index=index, total=total))
+        for index, chunk in enumerate(chunks, 1)
+    )
+
+    level = 1
+    while estimate_tokens(SUMMARY_SEPARATOR.join(summaries)) > max_tokens and len(summaries) > 2:
+        groups = _group_summaries(summaries, max_tokens)
+        if verbose:
+            print(f"第 {level} 层合并: {len(summaries)} 段总结合并为 {len(groups)} 段")
+        summaries = await _gather_or_cancel(
+            summarize(SUMMARY_SEPARATOR.join(group), REDUCE_PROMPT) for group in groups
+        )
+        level += 1
+
+    return await summarize(SUMMARY_SEPARATOR.join(summaries), prompt or REDUCE_PROMPT)
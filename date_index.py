@@ -0,0 +1,290 @@
+import os
+import re
+import json
+import bisect
+import hashlib
+from datetime import datetime
+
+# 索引文件格式版本，格式变化时旧索引会被重建
+INDEX_VERSION = 1
+
+# 校验文件追加内容时，比对已索引部分末尾这么多字节的哈希
+TAIL_CHECK_BYTES = 4096
+
+# 与 process_chat_logs.extract_date_from_line / get_last_message_date 使用的日期格式一致
+DATE_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+
+# 按通用换行符（\r\n、\r、\n）切分一行原始字节
+_RAW_LINE_PATTERN = re.compile(rb'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+
+def index_path(input_file):
+    """
+    获取聊天记录文件对应的日期索引文件路径（与聊天记录放在同一目录下的隐藏文件）
+
+    Args:
+        input_file: 聊天记录文件路径
+
+    Returns:
+        索引文件路径
+    """
+    dir_name = os.path.dirname(input_file)
+    base_name = os.path.basename(input_file)
+    return os.path.join(dir_name, f".{base_name}.dateidx")
+
+def _to_datetime(date_str):
+    year, month, day = map(int, date_str.split('-'))
+    return datetime(year, month, day)
+
+def _tail_hash(f, end):
+    """计算文件中 end 之前最多 TAIL_CHECK_BYTES 字节的哈希，用于判断文件是否只是追加了内容"""
+    begin = max(0, end - TAIL_CHECK_BYTES)
+    f.seek(begin)
+    return hashlib.sha1(f.read(end - begin)).hexdigest()
+
+def tail_hash(input_file, end):
+    """
+    计算文件中 end 之前最多 TAIL_CHECK_BYTES 字节的哈希，用于判断文件是否只是追加了内容
+
+    Args:
+        input_file: 文件路径
+        end: 结束位置（字节偏移）
+
+    Returns:
+        十六进制哈希字符串
+    """
+    with open(input_file, 'rb') as f:
+        return _tail_hash(f, end)
+
+def _iter_raw_lines(raw):
+    """按通用换行符切分原始字节，返回 (在raw中的偏移, 行字节)"""
+    if b'\r' not in raw:
+        yield 0, raw
+        return
+    for match in _RAW_LINE_PATTERN.finditer(raw):
+        yield match.start(), match.group()
+
+def _decode_lines(raw):
+    """将原始字节解码为文本行，换行符统一为 \\n（与以文本模式读取文件时一致）"""
+    text = raw.decode('utf-8')
+    if '\r' not in text:
+        return [text]
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return re.findall(r'[^\n]*\n|[^\n]+', text)
+
+class DateIndex:
+    """
+    聊天记录文件的日期索引
+
+    记录每一段连续相同日期的消息（以日期开头的行决定当前日期）在文件中的字节偏移，
+    按日期筛选时可以直接定位并只读取所需的部分。
+    """
+
+    def __init__(self, input_file, data):
+        self.input_file = input_file
+        self.data = data
+        self._dates = [_to_datetime(date) for _, date in data['runs']]
+        self._sorted = all(a <= b for a, b in zip(self._dates, self._dates[1:]))
+
+    @property
+    def line_count(self):
+        """文件的行数，与 content.count('\\n') + 1 一致"""
+        return self.data['lines'] + 1
+
+    @property
+    def last_date(self):
+        """文件中最后出现的日期（datetime对象），没有日期时为None"""
+        if self.data['last_date'] is None:
+            return None
+        return _to_datetime(self.data['last_date'])
+
+    def spans(self, start_date, end_date):
+        """
+        获取日期范围内的消息在文件中的字节区间
+
+        Args:
+            start_date: 开始日期
+            end_date: 结束日期
+
+        Returns:
+            (spans, reaches_end): 字节区间 [(begin, end), ...] 列表，以及最后一个区间是否到达文件末尾
+        """
+        runs = self.data['runs']
+        if self._sorted:
+            # 日期递增时二分查找，只需定位窗口的起止位置
+            selected = range(bisect.bisect_left(self._dates, start_date), bisect.bisect_right(self._dates, end_date))
+        else:
+            selected = [i for i, date in enumerate(self._dates) if start_date <= date <= end_date]
+
+        spans = []
+        for i in selected:
+            begin = runs[i][0]
+            stop = runs[i + 1][0] if i + 1 < len(runs) else self.data['size']
+            if spans and spans[-1][1] == begin:
+                spans[-1] = (spans[-1][0], stop)
+            else:
+                spans.append((begin, stop))
+
+        reaches_end = bool(spans) and spans[-1][1] == self.data['size']
+        return spans, reaches_end
+
+    @property
+    def size(self):
+        """建立索引时文件的大小（字节）"""
+        return self.data['size']
+
+    def dates_since(self, offset):
+        """
+        获取从某个字节偏移开始到文件末尾之间涉及的所有日期
+
+        Args:
+            offset: 字节偏移，例如上次处理时的文件大小
+
+        Returns:
+            日期（datetime对象）列表，按日期排序
+        """
+        runs = self.data['runs']
+        dates = set()
+        for i, (begin, _) in enumerate(runs):
+            stop = runs[i + 1][0] if i + 1 < len(runs) else self.data['size']
+            if stop > offset:
+                dates.add(self._dates[i])
+        return sorted(dates)
+
+    def iter_lines(self, start_date, end_date):
+        """
+        逐行读取日期范围内的内容，拼接结果与 filter_by_date 的返回值一致
+
+        Args:
+            start_date: 开始日期
+            end_date: 结束日期
+
+        Yields:
+            文本行（保留行尾换行符）
+        """
+        spans, reaches_end = self.spans(start_date, end_date)
+        pending = None
+        with open(self.input_file, 'rb') as f:
+            for begin, stop in spans:
+                f.seek(begin)
+                while f.tell() < stop:
+                    raw = f.readline(stop - f.tell())
+                    if not raw:
+                        break
+                    for line in _decode_lines(raw):
+                        if pending is not None:
+                            yield pending
+                        pending = line
+
+        if pending is not None:
+            # filter_by_date 用换行符连接保留的行，窗口之后还有内容时末尾没有换行符
+            if not reaches_end and pending.endswith('\n'):
+                pending = pending[:-1]
+            yield pending
+
+    def read(self, start_date, end_date):
+        """
+        读取日期范围内的内容，结果与 filter_by_date(整个文件内容, start_date, end_date) 一致
+
+        Args:
+            start_date: 开始日期
+            end_date: 结束日期
+
+        Returns:
+            日期范围内的文本内容
+        """
+        return ''.join(self.iter_lines(start_date, end_date))
+
+def _scan(f, data):
+    """从 data['offset'] 开始扫描文件，更新索引数据"""
+    runs = data['runs']
+    # 上次扫描时末尾不完整的一行需要重新扫描
+    while runs and runs[-1][0] >= data['offset']:
+        runs.pop()
+    current = runs[-1][1] if runs else None
+    last_date = data['last_date_complete']
+    lines = data['lines_complete']
+
+    f.seek(data['offset'])
+    position = data['offset']
+    for raw in f:
+        for start, piece in _iter_raw_lines(raw):
+            line = piece.decode('utf-8')
+            match = DATE_PATTERN.match(line)
+            if match:
+                date = match.group()
+                # 与 extract_date_from_line 一致，无效日期直接报错
+                _to_datetime(date)
+                if date != current:
+                    runs.append([position + start, date])
+                    current = date
+            found = DATE_PATTERN.findall(line)
+            if found:
+                last_date = '-'.join(found[-1])
+            if line.endswith(('\n', '\r')):
+                lines += 1
+
+        position += len(raw)
+        if raw.endswith(b'\n'):
+            data['offset'] = position
+            data['last_date_complete'] = last_date
+            data['lines_complete'] = lines
+
+    data['size'] = position
+    data['last_date'] = last_date
+    data['lines'] = lines
+
+def load_date_index(input_file, save=True):
+    """
+    加载聊天记录文件的日期索引，必要时创建或增量更新
+
+    索引以文件大小和修改时间校验：文件未变化时直接使用；文件只是追加了内容时，
+    只扫描新增的部分；否则重新建立索引。
+
+    Args:
+        input_file: 聊天记录文件路径
+        save: 是否将新建或更新的索引写回索引文件
+
+    Returns:
+        DateIndex 对象；无法建立索引时返回None
+    """
+    path = index_path(input_file)
+    try:
+        stat = os.stat(input_file)
+
+        data = None
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') != INDEX_VERSION:
+                    data = None
+            except (OSError, ValueError):
+                data = None
+
+        if data and data['size'] == stat.st_size and data['mtime_ns'] == stat.st_mtime_ns:
+            return DateIndex(input_file, data)
+
+        with open(input_file, 'rb') as f:
+            if not data or stat.st_size < data['offset'] or _tail_hash(f, data['offset']) != data['tail_hash']:
+                data = {
+                    'version': INDEX_VERSION,
+                    'offset': 0,
+                    'runs': [],
+                    'last_date_complete': None,
+                    'lines_complete': 0,
+                }
+            _scan(f, data)
+            data['tail_hash'] = _tail_hash(f, data['offset'])
+        data['mtime_ns'] = stat.st_mtime_ns
+    except (OSError, ValueError):
+        # 包括文件编码错误、无效日期等情况，由调用方回退为读取整个文件
+        return None
+
+    if save:
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+        except OSError:
+            pass
+
+    return DateIndex(input_file, data)
@@ -0,0 +1,195 @@
+import re
+import zlib
+import random
+
+from token_estimator import estimate_tokens
+
+# 相似消息判断: 按字符3-gram（shingle）集合的 Jaccard 相似度
+SHINGLE_SIZE = 3
+# Jaccard 相似度不低于此值时视为相似消息
+NEAR_DUP_THRESHOLD = 0.8
+# 少于这么多字的短消息（如"好的""哈哈哈"）只合并连续重复，不做相似判断
+NEAR_DUP_MIN_CHARS = 12
+
+# MinHash 签名长度和 LSH 分桶方式（BANDS * ROWS == NUM_PERM），
+# 相似度约 (1/BANDS)^(1/ROWS) ≈ 0.7 以上的消息会成为候选，再按实际相似度确认
+NUM_PERM = 16
+BANDS = 4
+ROWS = 4
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# 固定种子，保证每次运行的签名一致
+_rng = random.Random(20250318)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+# 计算相似度前去掉空白和标点，大小写不敏感
+_NORMALIZE_PATTERN = re.compile(r'[\s\W_]+')
+# 连续数字（广告中的QQ号、电话号码等经常变化）视为同一个字符
+_DIGITS_PATTERN = re.compile(r'\d+')
+
+def shingles(text):
+    """
+    获取文本的字符 shingle 集合
+
+    Args:
+        text: 已规范化的文本
+
+    Returns:
+        shingle 字符串的集合
+    """
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+def minhash(shingle_set):
+    """
+    计算 shingle 集合的 MinHash 签名
+
+    Args:
+        shingle_set: shingles 返回的集合
+
+    Returns:
+        长度为 NUM_PERM 的整数元组
+    """
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingle_set]
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+class Deduplicator:
+    """
+    合并重复和相似的消息行
+
+    连续完全相同的行合并为一行并标注次数（如 "计院的复试线为什么还不出 ×4"）；
+    较长的行还会与之前出现过的所有行比较，与某一行相似（如改了几个字的广告）时
+    不再输出，次数累加到最先出现的那一行上。相似判断用 MinHash 签名分桶（LSH）
+    找出候选行，再计算实际的 Jaccard 相似度确认，耗时与行数近似线性。
+    """
+
+    def __init__(self, near_duplicates=True, threshold=NEAR_DUP_THRESHOLD, min_chars=NEAR_DUP_MIN_CHARS):
+        """
+        Args:
+            near_duplicates: 是否合并不相邻的相似消息，为False时只合并连续重复
+            threshold: 相似消息的 Jaccard 相似度阈值
+            min_chars: 参与相似判断的最短消息长度（规范化后的字数）
+        """
+        self.near_duplicates = near_duplicates
+        self.threshold = threshold
+        self.min_chars = min_chars
+        self.exact = 0
+        self.near = 0
+        self._lines = []
+        self._counts = []
+        self._shingles = {}
+        self._buckets = {}
+        self._last = None
+        self._last_position = None
+
+    def add(self, line):
+        """
+        加入一行
+
+        Args:
+            line: 清理后的一行文本（不含换行符）
+        """
+        key = line.strip()
+        if key == self._last:
+            # 与上一行相同，计入上一行所合并到的那一行
+            self._counts[self._last_position] += 1
+            self.exact += 1
+            return
+        self._last = key
+
+        if self.near_duplicates:
+            normalized = _DIGITS_PATTERN.sub('0', _NORMALIZE_PATTERN.sub('', key).lower())
+            if len(normalized) >= self.min_chars:
+                shingle_set = shingles(normalized)
+                signature = minhash(shingle_set)
+                bands = [(band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+                match = self._find_similar(shingle_set, bands)
+                if match is not None:
+                    self._counts[match] += 1
+                    self._last_position = match
+                    self.near += 1
+                    return
+
+                position = len(self._lines)
+                self._shingles[position] = shingle_set
+                for band in bands:
+                    self._buckets.setdefault(band, []).append(position)
+
+        self._last_position = len(self._lines)
+        self._lines.append(line)
+        self._counts.append(1)
+
+    def _find_similar(self, shingle_set, bands):
+        """在已出现的行中查找相似的一行，返回其位置，没有时返回None"""
+        checked = set()
+        for band in bands:
+            for position in self._buckets.get(band, ()):
+                if position in checked:
+                    continue
+                checked.add(position)
+                other = self._shingles[position]
+                if len(shingle_set & other) >= self.threshold * len(shingle_set | other):
+                    return position
+        return None
+
+    def lines(self):
+        """
+        获取合并后的行
+
+        Returns:
+            文本行列表，出现多次的行末尾标注次数
+        """
+        return [line if count == 1 else f"{line} ×{count}" for line, count in zip(self._lines, self._counts)]
+
+def dedup_content(content, near_duplicates=True):
+    """
+    合并清理后聊天记录中重复和相似的消息行
+
+    Args:
+        content: 清理后的文本（每行一条消息或消息的一行）
+        near_duplicates: 是否合并不相邻的相似消息
+
+    Returns:
+        (合并后的文本, 统计信息字典: exact、near、tokens_before、tokens_after)
+    """
+    deduplicator = Deduplicator(near_duplicates)
+    for line in content.split('\n'):
+        deduplicator.add(line)
+    deduped = '\n'.join(deduplicator.lines())
+    return deduped, {
+        'exact': deduplicator.exact,
+        'near': deduplicator.near,
+        'tokens_before': estimate_tokens(content),
+        'tokens_after': estimate_tokens(deduped),
+    }
+
+def dedup_file(path, near_duplicates=True):
+    """
+    合并文件中重复和相似的消息行（原地改写）
+
+    Args:
+        path: 清理后的文件路径
+        near_duplicates: 是否合并不相邻的相似消息
+
+    Returns:
+        (合并后的行数, 统计信息字典)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    deduped, stats = dedup_content(content, near_duplicates)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(deduped)
+    return deduped.count('\n') + 1, stats
+
+def format_dedup_stats(stats):
+    """生成去重统计信息的说明文字"""
+    saved = stats['tokens_before'] - stats['tokens_after']
+    percent = 100 * saved / stats['tokens_before'] if stats['tokens_before'] else 0
+    return f"合并了 {stats['exact']} 行连续重复、{stats['near']} 行相似消息，约节省 {saved} tokens ({percent:.1f}%)"
@@ -0,0 +1,544 @@
+import os
+import re
+import time
+import signal
+import threading
+import bisect
+import itertools
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+# 已编译过滤引擎的缓存: {文件绝对路径: (修改时间, 文件大小, 引擎)}
+_ENGINE_CACHE = {}
+
+# 每条规则的耗时统计: {规则: [执行次数, 秒数, 删除的字符数]}，为None时不统计（见 profile_rules）
+_RULE_PROFILE = None
+
+# 每条规则的执行时间上限（秒），为0时不限制（见 set_rule_timeout）
+_RULE_TIMEOUT = 0
+
+class RuleTimeout(Exception):
+    """过滤规则的执行时间超过上限"""
+
+def _raise_rule_timeout(signum, frame):
+    raise RuleTimeout()
+
+# 正则的无上限量词（* + {n,}），POSSESSIVE_REPEAT 不回溯，不在此列
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+
+def _is_unbounded(op, av):
+    return op in _REPEATS and av[1] == sre_parse.MAXREPEAT
+
+def _subpatterns(op, av):
+    """返回一个正则节点包含的子序列"""
+    if op in _REPEATS or op == getattr(sre_parse, 'POSSESSIVE_REPEAT', None):
+        return [av[2]]
+    if op == sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_parse.BRANCH:
+        return av[1]
+    if op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+        return [av]
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    return []
+
+def _contains_unbounded(items):
+    for op, av in items:
+        if _is_unbounded(op, av):
+            return True
+        if any(_contains_unbounded(sub) for sub in _subpatterns(op, av)):
+            return True
+    return False
+
+def _char_set(items):
+    """
+    单个字符的重复（如 a*、\d+、.*）可以匹配的字符集合，只由普通字符组成时返回集合，
+    其他情况返回None（视为可能匹配任意字符）
+    """
+    if len(items) != 1:
+        return None
+    op, av = items[0]
+    if op == sre_parse.LITERAL:
+        return {av}
+    if op == sre_parse.IN and all(kind == sre_parse.LITERAL for kind, _ in av):
+        return {code for _, code in av}
+    return None
+
+def _find_risk(items, top=False):
+    """在正则的节点序列中查找回溯风险，返回 (级别, 说明) 或None"""
+    for op, av in items:
+        if _is_unbounded(op, av) and _contains_unbounded(av[2]):
+            return 'exponential', "嵌套的无上限量词（如 (a+)+、(.*)*），不匹配时回溯次数随长度指数增长"
+        for sub in _subpatterns(op, av):
+            risk = _find_risk(sub)
+            if risk is not None:
+                return risk
+
+    if top:
+        first = items[0] if items else None
+        if first is not None and _is_unbounded(*first) and list(first[1][2]) == [(sre_parse.ANY, None)]:
+            return 'quadratic', "以没有锚点的 .* 或 .+ 开头，每个起始位置都要扫描到行尾，耗时随行长平方增长"
+
+    for (op1, av1), (op2, av2) in zip(items, items[1:]):
+        if _is_unbounded(op1, av1) and _is_unbounded(op2, av2):
+            first, second = _char_set(av1[2]), _char_set(av2[2])
+            if first is None or second is None or first & second:
+                return 'quadratic', "相邻的两个无上限量词可以匹配相同的字符（如 \\d+\\d+、.*.*），匹配失败时耗时随长度平方增长"
+    return None
+
+def backtracking_risk(pattern):
+    """
+    静态检查正则表达式是否有灾难性回溯的风险
+
+    Args:
+        pattern: 正则表达式
+
+    Returns:
+        (级别, 说明)，级别为 'exponential'（指数级，一条长行就可能使清理停住）或
+        'quadratic'（平方级，长行上明显变慢）；没有发现风险或无法解析时返回None
+    """
+    try:
+        items = sre_parse.parse(pattern)
+    except re.error:
+        return None
+    return _find_risk(list(items), top=True)
+
+class AhoCorasick:
+    """
+    Aho-Corasick 多模式匹配自动机
+
+    一次扫描即可找出文本中出现的所有普通文本关键词，扫描耗时与关键词数量无关。
+    """
+
+    def __init__(self, patterns):
+        """
+        构建自动机
+
+        Args:
+            patterns: 关键词列表，search 返回的是关键词在此列表中的下标
+        """
+        children = [{}]
+        outputs = [[]]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                nxt = children[state].get(ch)
+                if nxt is None:
+                    nxt = len(children)
+                    children[state][ch] = nxt
+                    children.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(index)
+
+        # 按层次遍历计算失败指针，并把失败链上的转移和输出合并到每个状态中，
+        # 扫描时每个字符只需一次字典查找（根节点的转移单独保存，避免重复存储）
+        fail = [0] * len(children)
+        delta = [dict() for _ in children]
+        queue = list(children[0].values())
+        for state in queue:
+            delta[state] = dict(children[state])
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in children[state].items():
+                f = fail[state]
+                while f and ch not in children[f]:
+                    f = fail[f]
+                fail[nxt] = children[f].get(ch, 0)
+                if fail[nxt] == nxt:
+                    fail[nxt] = 0
+                outputs[nxt] = outputs[nxt] + outputs[fail[nxt]]
+                inherited = delta[fail[nxt]] if fail[nxt] else {}
+                delta[nxt] = {**inherited, **children[nxt]}
+                queue.append(nxt)
+
+        self._root = children[0]
+        self._delta = delta
+        self._outputs = [tuple(out) if out else None for out in outputs]
+        # 处于初始状态时，用字符集正则在C层面跳到下一个可能的关键词首字符
+        first_chars = ''.join(re.escape(ch) for ch in self._root)
+        self._skip = re.compile(f'[{first_chars}]') if first_chars else None
+
+    def finditer(self, text):
+        """
+        查找文本中所有关键词的出现位置（包括相互重叠的出现）
+
+        Args:
+            text: 待扫描的文本
+
+        Yields:
+            (end, index): 关键词结束位置（不含）和关键词下标
+        """
+        if self._skip is None:
+            return
+        delta = self._delta
+        outputs = self._outputs
+        root_get = self._root.get
+        skip = self._skip.search
+        state = 0
+        pos = 0
+        length = len(text)
+        while pos < length:
+            if state == 0:
+                match = skip(text, pos)
+                if match is None:
+                    return
+                pos = match.start()
+            ch = text[pos]
+            state = delta[state].get(ch) or root_get(ch, 0)
+            pos += 1
+            if outputs[state] is not None:
+                for index in outputs[state]:
+                    yield pos, index
+
+    def search(self, text):
+        """
+        查找文本中出现的关键词
+
+        Args:
+            text: 待扫描的文本
+
+        Returns:
+            出现过的关键词下标集合
+        """
+        return {index for _, index in self.finditer(text)}
+
+class FilterEngine:
+    """
+    预编译的自定义过滤规则
+
+    规则按逐行的语义生效，结果与对每一行依次执行 re.sub/str.replace 相同。
+
+    规则较少时直接按顺序在整段文本上执行（C实现，最快）；规则很多时，普通文本关键词
+    编译为一个 Aho-Corasick 自动机，以 \\ 开头的正则规则合并为一个正则表达式，一次
+    扫描即可找出每条规则命中的行，之后每条规则只作用于它命中的行，耗时不再随规则
+    数量线性增长。被修改的行会重新扫描，以发现删除后新拼接出的匹配。
+    """
+
+    # 规则不超过此数量时，直接逐条在整段文本上执行 str.replace/re.sub（C实现）更快；
+    # 按整个文件和逐条消息（--stream）分别测试，两种方式在约100条规则时耗时相当
+    SEQUENTIAL_MAX_RULES = 100
+    # 普通文本关键词不超过此数量时，逐个 str.find 比 Python 实现的自动机更快
+    AUTOMATON_MIN_KEYWORDS = 256
+
+    def __init__(self, keywords):
+        """
+        Args:
+            keywords: load_filter_keywords 返回的关键词列表（保持文件中的顺序）
+        """
+        self.keywords = list(keywords)
+        self.rules = []
+        # 因超过执行时间上限而停用的规则下标
+        self.disabled = set()
+        # 编译规则时发现的问题（无效的正则、灾难性回溯风险），由 load_filter_engine 打印
+        self.warnings = []
+        literal_patterns = []
+        self._literal_rules = []
+        self._regex_rules = []
+        self._unscanned_rules = []
+        self._multiline = {}
+
+        for index, keyword in enumerate(self.keywords):
+            compiled = None
+            if keyword.startswith('\\'):
+                try:
+                    compiled = re.compile(keyword)
+                except re.error as e:
+                    # 如果正则表达式无效，按普通文本处理
+                    compiled = None
+                    self.warnings.append(f"规则 {keyword} 不是有效的正则表达式（{e}），按普通文本处理")
+                else:
+                    risk = backtracking_risk(keyword)
+                    if risk is not None and risk[0] == 'exponential':
+                        self.warnings.append(f"规则 {keyword} 可能导致灾难性回溯: {risk[1]}")
+
+            self.rules.append((keyword, compiled))
+            if compiled is None:
+                literal_patterns.append(keyword)
+                self._literal_rules.append(index)
+            elif re.search(r'\\[AZ]|\(\?<?!', keyword) or compiled.groups:
+                # 在多行文本中扫描时结果可能与单独一行不同（否定断言、\\A、\\Z），
+                # 或者合并后组号会错位，这些规则对每一行都单独判断
+                self._unscanned_rules.append(index)
+            else:
+                # 扫描时用多行模式，使 ^ 和 $ 在每一行都能匹配
+                self._multiline[index] = re.compile(keyword, re.MULTILINE)
+                self._regex_rules.append((index, self._multiline[index]))
+
+        self._literal_patterns = literal_patterns
+        self._automaton = None
+        if len(literal_patterns) > self.AUTOMATON_MIN_KEYWORDS:
+            self._automaton = AhoCorasick(literal_patterns)
+
+        self._prefilter = None
+        if self._regex_rules:
+            try:
+                self._prefilter = re.compile('|'.join(f'(?:{self.keywords[index]})' for index, _ in self._regex_rules), re.MULTILINE)
+            except re.error:
+                # 例如规则中含有全局标志，无法合并，只能逐条扫描
+                self._prefilter = None
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _find_literals(self, text):
+        """查找普通文本关键词的所有出现位置，返回 (结束位置, 关键词下标) 序列"""
+        if self._automaton is not None:
+            return self._automaton.finditer(text)
+
+        found = []
+        for i, keyword in enumerate(self._literal_patterns):
+            pos = text.find(keyword)
+            while pos != -1:
+                found.append((pos + len(keyword), i))
+                pos = text.find(keyword, pos + 1)
+        return found
+
+    def _scan(self, lines, numbers, after=-1):
+        """
+        扫描指定的行，找出每条规则命中的行
+
+        Args:
+            lines: 全部文本行
+            numbers: 需要扫描的行号（升序）
+            after: 只返回下标大于此值的规则
+
+        Returns:
+            {规则下标: 命中的行号集合}
+        """
+        found = {}
+        bisect_right = bisect.bisect_right
+
+        def join(subset):
+            starts = [0]
+            starts.extend(itertools.accumulate(len(lines[n]) + 1 for n in subset[:-1]))
+            return '\n'.join(lines[n] for n in subset), starts
+
+        def spanned_lines(pattern, text, starts):
+            """返回正则匹配覆盖到的行在 starts 中的位置"""
+            hits = set()
+            last_start = starts[-1]
+            for match in pattern.finditer(text):
+                start, end = match.span()
+                first = bisect_right(starts, start) - 1
+                hits.add(first)
+                if end - 1 > start and (start >= last_start or end > starts[first + 1]):
+                    hits.update(range(first, bisect_right(starts, end - 1)))
+            return hits
+
+        text, starts = join(numbers)
+
+        literal_rules = self._literal_rules
+        for end, i in self._find_literals(text):
+            rule = literal_rules[i]
+            if rule > after:
+                hits = found.get(rule)
+                if hits is None:
+                    hits = found[rule] = set()
+                hits.add(bisect_right(starts, end - 1) - 1)
+        found = {rule: {numbers[k] for k in hits} for rule, hits in found.items()}
+
+        regex_rules = [(index, pattern) for index, pattern in self._regex_rules if index > after]
+        if regex_rules:
+            subset = numbers
+            if self._prefilter is not None:
+                # 先用合并后的正则一次扫描，只在可能命中的行上逐条判断
+                subset = [numbers[k] for k in sorted(spanned_lines(self._prefilter, text, starts))]
+                if subset:
+                    text, starts = join(subset)
+            if subset:
+                for index, pattern in regex_rules:
+                    hits = spanned_lines(pattern, text, starts)
+                    if hits:
+                        found[index] = {subset[k] for k in hits}
+
+        for index in self._unscanned_rules:
+            if index > after:
+                found[index] = set(numbers)
+
+        return found
+
+    def apply_lines(self, content):
+        """
+        逐行应用全部过滤规则
+
+        Args:
+            content: 多行文本
+
+        Returns:
+            过滤后的文本
+        """
+        if not self.rules:
+            return content
+        guarded = _RULE_TIMEOUT and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+        if _RULE_PROFILE is not None or guarded:
+            return self._apply_guarded(content, _RULE_TIMEOUT if guarded else 0, _RULE_PROFILE)
+        if len(self.rules) <= self.SEQUENTIAL_MAX_RULES:
+            return self._apply_sequential(content)
+
+        lines = content.split('\n')
+        pending = self._scan(lines, list(range(len(lines))))
+
+        for index, (keyword, compiled) in enumerate(self.rules):
+            numbers = pending.pop(index, None)
+            if not numbers or index in self.disabled:
+                continue
+            numbers = sorted(numbers)
+            before = [lines[n] for n in numbers]
+            if compiled is None:
+                # 关键词不含换行符，可以一次替换所有命中的行
+                after = '\n'.join(before).replace(keyword, '').split('\n')
+            else:
+                after = [compiled.sub('', line) for line in before]
+
+            changed = [n for n, old, new in zip(numbers, before, after) if old != new]
+            if not changed:
+                continue
+            for n, new in zip(numbers, after):
+                lines[n] = new
+            # 删除后可能拼接出新的匹配，重新扫描被修改的行
+            for rule, hit_lines in self._scan(lines, changed, after=index).items():
+                pending.setdefault(rule, set()).update(hit_lines)
+
+        return '\n'.join(lines)
+
+    def _apply_sequential(self, content):
+        """规则较少时，按顺序在整段文本上逐条执行，每条规则的效果与逐行执行相同"""
+        for index in range(len(self.rules)):
+            if index not in self.disabled:
+                content = self._apply_rule(index, content)
+        return content
+
+    def _apply_rule(self, index, content):
+        """在整段文本上执行一条规则，效果与逐行执行相同"""
+        keyword, compiled = self.rules[index]
+        if compiled is None:
+            return content.replace(keyword, '')
+
+        multiline = self._multiline.get(index)
+        if multiline is not None:
+            new_content = multiline.sub('', content)
+            # 匹配跨越了换行符时结果与逐行执行不同，改为逐行执行
+            if new_content.count('\n') == content.count('\n'):
+                return new_content
+        return '\n'.join(compiled.sub('', line) for line in content.split('\n'))
+
+    def _apply_guarded(self, content, timeout, profile=None):
+        """
+        逐条执行规则，单条规则超过 timeout 秒时中止（正则匹配过程中会响应信号）并停用该规则
+
+        timeout 大于0时只能在支持 SIGALRM 的系统的主线程中使用，为0时不限制。profile 不为None时
+        同时记录每条规则的耗时和删除的字符数（--profile）：规则很多时也逐条执行（结果与 apply_lines
+        相同），统计的是每条规则单独扫描全文的耗时。已停用的规则在两种情况下都跳过。
+        """
+        perf_counter = time.perf_counter
+        previous = signal.signal(signal.SIGALRM, _raise_rule_timeout) if timeout else None
+        try:
+            for index, (keyword, _) in enumerate(self.rules):
+                if index in self.disabled:
+                    continue
+                start = perf_counter()
+                try:
+                    if timeout:
+                        signal.setitimer(signal.ITIMER_REAL, timeout)
+                    try:
+                        new_content = self._apply_rule(index, content)
+                    finally:
+                        if timeout:
+                            signal.setitimer(signal.ITIMER_REAL, 0)
+                except RuleTimeout:
+                    self.disabled.add(index)
+                    print(f"警告: 规则 {keyword} 执行超过 {timeout:g} 秒，已跳过并停用（可运行 rule_analyzer.py 检查）")
+                    new_content = content
+                if profile is not None:
+                    stats = profile.get(keyword)
+                    if stats is None:
+                        stats = profile[keyword] = [0, 0.0, 0]
+                    stats[0] += 1
+                    stats[1] += perf_counter() - start
+                    stats[2] += len(content) - len(new_content)
+                content = new_content
+        finally:
+            if timeout:
+                signal.signal(signal.SIGALRM, previous)
+        return content
+
+def profile_rules(enabled=True):
+    """
+    开始或停止统计每条过滤规则的耗时（--profile 使用）
+
+    Args:
+        enabled: True 时清空并开始统计，False 时停止统计
+
+    Returns:
+        统计字典 {规则: [执行次数, 秒数, 删除的字符数]}，停止时返回停止前的统计
+    """
+    global _RULE_PROFILE
+    profile = _RULE_PROFILE
+    _RULE_PROFILE = {} if enabled else None
+    return _RULE_PROFILE if enabled else (profile or {})
+
+def set_rule_timeout(seconds):
+    """
+    设置每条过滤规则的执行时间上限，超过时跳过该规则并在此后停用，0 表示不限制
+
+    上限依靠 SIGALRM 实现，只在 Linux/macOS 的主线程中生效。并行清理的子进程需要在进程池的
+    initializer 中分别设置。
+    """
+    global _RULE_TIMEOUT
+    _RULE_TIMEOUT = seconds
+
+def get_rule_timeout():
+    """当前的过滤规则执行时间上限（秒）"""
+    return _RULE_TIMEOUT
+
+def read_filter_keywords(filter_file):
+    """
+    读取过滤关键词配置文件，忽略空行和#开头的注释行
+
+    Args:
+        filter_file: 过滤关键词配置文件路径
+
+    Returns:
+        关键词列表
+    """
+    keywords = []
+    with open(filter_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                keywords.append(line)
+
+    return keywords
+
+def load_filter_engine(filter_file='filter_keywords.txt'):
+    """
+    加载并编译过滤规则，按文件的修改时间和大小缓存，文件未变化时直接复用
+
+    Args:
+        filter_file: 过滤关键词配置文件路径
+
+    Returns:
+        FilterEngine 对象
+    """
+    if not os.path.exists(filter_file):
+        print(f"警告: 过滤配置文件 '{filter_file}' 不存在，将使用默认过滤规则")
+        return FilterEngine([])
+
+    path = os.path.abspath(filter_file)
+    stat = os.stat(path)
+    cached = _ENGINE_CACHE.get(path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    engine = FilterEngine(read_filter_keywords(path))
+    for warning in engine.warnings:
+        print(f"警告: {warning}（可运行 rule_analyzer.py 检查）")
+    _ENGINE_CACHE[path] = (stat.st_mtime_ns, stat.st_size, engine)
+    return engine
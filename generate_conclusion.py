@@ -1,6 +1,11 @@
 import os
 import re
+import math
 import json
+import time
+import atexit
+import asyncio
+import threading
 import requests
 import argparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -8,137 +13,323 @@ from datetime import datetime
 
 # 导入API配置模块
 from api_config import load_api_config, setup_api_keys
+from pipeline_state import STATE_FILE, load_state, save_state, file_digest
+from summary_cache import CACHE_DIR, SummaryCache, cache_key
+from chunked_summary import CHUNK_TOKENS, CHUNK_WORKERS, MAP_PROMPT, REDUCE_PROMPT, SUMMARY_SEPARATOR, map_reduce_summarize, map_reduce_summarize_async, plan_requests, split_content
+from provider_client import configure_clients, get_client
+from rate_limiter import get_limiter
+from token_estimator import estimate_tokens, get_tokenizer
+from async_engine import AIOHTTP_AVAILABLE, NETWORK_ERRORS, AsyncClients
+from sse_stream import iter_sse_events, iter_text_deltas
+from message_store import MESSAGE_DB
+from metrics import METRICS, propagate_group
+from profiler import PROFILE_DIR, PROFILE_TOP, start_profiler
+from hedged_request import HedgeCancelled, LatencyHistory, first_response, first_response_async
+from process_chat_logs import clean_chat_log_from_store
 
 # ===== 可自定义的系统提示词 =====
 # 此提示词用于指导AI如何总结聊天内容
 # 可根据需要修改以获得不同风格或侧重点的总结
 SYSTEM_PROMPT = "你是一个专业的聊天内容分析助手。你的任务是对QQ聊天记录进行简明扼要的总结。内容上，你需要着重关注事实上发生的内容，尤其是当前时事的细节。如果有链接，你需要原样保留。*不要*添加任何主观评论。格式上，你需要按照内容前后的顺序，按话题划分小标题。"
 
-# 加载API配置
+# 默认的用户提示词，放在聊天记录内容之后（见 build_request）
+DEFAULT_PROMPT = "请对上面的聊天记录内容进行简要总结，提取主要话题和关键信息。"
+
+# 聊天记录内容与之后的提示词之间的分隔
+PROMPT_SEPARATOR = "\n\n---\n\n"
+
+# 所有API源共用的生成参数
+TEMPERATURE = 0.7
+MAX_TOKENS = 1500
+
+# 加载API配置（导入时加载一次，配置文件不存在时创建默认配置；其他脚本直接读取和修改此字典，
+# watch_daemon 在 api_keys.ini 修改后整体替换）
 API_CONFIG = load_api_config()
 
-def call_siliconflow_api(content, prompt=None):
+# 总结缓存，内容、模型和提示词都未变化时直接复用上次的总结；为None时不使用缓存
+SUMMARY_CACHE = SummaryCache()
+
+# 各API源成功请求的耗时历史，用于 --hedge 模式选择最快的API源和追加请求的等待时间
+LATENCY_HISTORY = LatencyHistory()
+
+# --hedge 模式中等待一个API源多久后向下一个API源追加请求: 按历史耗时的此百分位数估计
+HEDGE_PERCENTILE = 95
+
+def resolve_model(api):
     """
-    调用SiliconFlow API进行内容总结
+    获取API源实际使用的模型名称
     
     Args:
-        content: 需要总结的内容
-        prompt: 自定义提示词，默认为None
+        api: API源名称
     
     Returns:
-        总结内容
+        模型名称
+    """
+    model = API_CONFIG[api]['model']
+    if api == 'siliconflow' and not model:
+        # 如果未设置或为空，使用推荐的免费模型
+        model = "qwen/Qwen2.5-7B-Chat"
+    return model
+
+def resolve_prompt(prompt):
     """
-    if not API_CONFIG['siliconflow']['api_key']:
-        raise ValueError("未设置SiliconFlow API密钥，请使用 'python api_config.py' 设置密钥或设置环境变量SILICONFLOW_API_KEY")
+    获取请求实际使用的提示词，构建请求、计算token数和缓存键都使用此函数
     
-    if prompt is None:
-        prompt = "请对以下聊天记录内容进行简要总结，提取主要话题和关键信息：\n\n"
+    Args:
+        prompt: 自定义提示词，为None时使用 DEFAULT_PROMPT（空字符串表示不使用提示词）
+    
+    Returns:
+        提示词
+    """
+    return DEFAULT_PROMPT if prompt is None else prompt
+
+# API源的显示名称，用于错误信息
+API_NAMES = {
+    'siliconflow': 'SiliconFlow',
+    'openai': 'OpenAI',
+    'anthropic': 'Anthropic',
+}
+
+def request_headers(api):
+    """
+    获取调用API源时使用的请求头（包含密钥）
     
-    headers = {
+    Args:
+        api: API源名称
+    
+    Returns:
+        请求头字典
+    """
+    if not API_CONFIG[api]['api_key']:
+        raise ValueError(f"未设置{API_NAMES[api]} API密钥，请使用 'python api_config.py' 设置密钥或设置环境变量{api.upper()}_API_KEY")
+    
+    api_key = API_CONFIG[api]['api_key']
+    if api == 'anthropic':
+        return {
+            "Content-Type": "application/json",
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01"
+        }
+    # SiliconFlow 与 OpenAI 使用相同的接口格式
+    return {
         "accept": "application/json",
         "content-type": "application/json",
-        "authorization": f"Bearer {API_CONFIG['siliconflow']['api_key']}"
+        "authorization": f"Bearer {api_key}"
     }
+
+def build_request(api, content, prompt=None, stream=False):
+    """
+    构建调用API源进行内容总结的请求，线程和异步两种调用方式共用
     
-    # 使用SiliconFlow支持的模型
-    model = API_CONFIG['siliconflow']['model']
-    # 检查模型名称，确保使用有效模型
-    if model == "Yi-1.5-Large-Instruct-B":
-        # 可以使用这个默认模型，但确保这是SiliconFlow支持的
-        pass
-    elif not model or model == "":
-        # 如果未设置或为空，使用推荐的免费模型
-        model = "qwen/Qwen2.5-7B-Chat"
+    请求按 系统提示词 -> 聊天记录内容 -> 提示词 的顺序排列，不变的部分在前：同一段内容换用不同的
+    提示词（包括分段总结的提示词）、或者较早的消息相同的重叠时间范围，都能共用前面的部分，
+    命中各API源的提示词前缀缓存（OpenAI、SiliconFlow 自动缓存；Anthropic 需要用 cache_control
+    标记缓存位置，api_keys.ini 中 prompt_cache = off 时不标记）。
     
-    user_message = f"{prompt}{content}"
+    Args:
+        api: API源名称
+        content: 需要总结的内容
+        prompt: 自定义提示词，默认为None
+        stream: 是否请求流式响应
     
-    data = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_message}
-        ],
-        "temperature": 0.7,
-        "max_tokens": 1500
-    }
+    Returns:
+        (url, headers, data): 请求地址、请求头和JSON请求体
+    """
+    headers = request_headers(api)
+    prompt = resolve_prompt(prompt)
+    
+    if api == 'anthropic':
+        system = {"type": "text", "text": SYSTEM_PROMPT}
+        chat = {"type": "text", "text": content}
+        if API_CONFIG[api]['prompt_cache'] == 'on':
+            # 缓存到系统提示词、缓存到聊天记录内容结束两个位置；不足模型最小缓存长度时不会缓存，也不额外收费
+            system["cache_control"] = {"type": "ephemeral"}
+            chat["cache_control"] = {"type": "ephemeral"}
+        data = {
+            "model": resolve_model(api),
+            "system": [system],
+            "messages": [
+                {"role": "user", "content": [chat, {"type": "text", "text": f"{PROMPT_SEPARATOR}{prompt}"}]}
+            ],
+            "temperature": TEMPERATURE,
+            "max_tokens": MAX_TOKENS
+        }
+    else:
+        # SiliconFlow 与 OpenAI 使用相同的接口格式
+        data = {
+            "model": resolve_model(api),
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": f"{content}{PROMPT_SEPARATOR}{prompt}"}
+            ],
+            "temperature": TEMPERATURE,
+            "max_tokens": MAX_TOKENS
+        }
+    
+    if stream:
+        data["stream"] = True
+        if api == 'openai':
+            # 在最后一个事件中返回token用量
+            data["stream_options"] = {"include_usage": True}
+    
+    return API_CONFIG[api]['api_url'], headers, data
+
+def record_usage(api, usage):
+    """
+    记录API响应中的token用量和按 api_keys.ini 中的价格计算的费用
+    
+    Args:
+        api: API源名称
+        usage: 响应中的 usage 字段（SiliconFlow/OpenAI 为 prompt_tokens/completion_tokens，
+            Anthropic 为 input_tokens/output_tokens），没有时为None
+    """
+    if not usage:
+        return
+    output_tokens = usage.get('completion_tokens', usage.get('output_tokens')) or 0
+    input_tokens, cache_read, cache_write = prompt_cache_usage(usage)
+    METRICS.record_usage(api, input_tokens, output_tokens, request_cost(api, input_tokens, output_tokens, cache_read, cache_write), cache_read, cache_write)
+
+def prompt_cache_usage(usage):
+    """
+    从响应的 usage 字段中取出输入token数和其中命中、写入提示词缓存的部分
+    
+    - OpenAI: prompt_tokens 包括缓存部分，命中的在 prompt_tokens_details.cached_tokens
+    - SiliconFlow（DeepSeek 等模型）: prompt_tokens 包括缓存部分，命中的在 prompt_cache_hit_tokens
+    - Anthropic: input_tokens 不包括缓存部分，另有 cache_read_input_tokens、cache_creation_input_tokens
+    
+    Args:
+        usage: 响应中的 usage 字段
+    
+    Returns:
+        (input_tokens, cache_read, cache_write): 全部输入token数、命中缓存的token数、写入缓存的token数
+    """
+    if 'prompt_tokens' in usage:
+        details = usage.get('prompt_tokens_details') or {}
+        cache_read = details.get('cached_tokens') or usage.get('prompt_cache_hit_tokens') or 0
+        return usage['prompt_tokens'] or 0, cache_read, 0
+    cache_read = usage.get('cache_read_input_tokens') or 0
+    cache_write = usage.get('cache_creation_input_tokens') or 0
+    return (usage.get('input_tokens') or 0) + cache_read + cache_write, cache_read, cache_write
+
+def parse_response(api, status_code, content_type, text):
+    """
+    解析API源的响应，线程和异步两种调用方式共用
+    
+    Args:
+        api: API源名称
+        status_code: HTTP状态码
+        content_type: 响应的Content-Type
+        text: 响应内容
     
+    Returns:
+        总结内容
+    """
+    with METRICS.stage('parse_response'):
+        return _parse_response(api, status_code, content_type, text)
+
+def _parse_response(api, status_code, content_type, text):
     try:
-        response = requests.post(
-            API_CONFIG['siliconflow']['api_url'],
-            headers=headers,
-            json=data,
-            timeout=60
-        )
-        
         # 错误处理
-        if response.status_code != 200:
-            error_info = response.json() if response.headers.get('content-type', '').startswith('application/json') else {"message": response.text}
+        if status_code != 200:
+            error_info = json.loads(text) if (content_type or '').startswith('application/json') else {"message": text}
             error_message = error_info.get('message', '未知错误')
-            raise ValueError(f"SiliconFlow API错误 (状态码: {response.status_code}): {error_message}")
+            raise ValueError(f"{API_NAMES[api]} API错误 (状态码: {status_code}): {error_message}")
         
-        result = response.json()
+        result = json.loads(text)
+        record_usage(api, result.get('usage'))
+        if api == 'anthropic':
+            return result['content'][0]['text']
         return result['choices'][0]['message']['content']
-    except requests.exceptions.RequestException as e:
-        raise ValueError(f"网络请求错误: {str(e)}")
     except json.JSONDecodeError:
-        raise ValueError(f"无法解析API响应: {response.text}")
+        raise ValueError(f"无法解析API响应: {text}")
     except KeyError as e:
-        raise ValueError(f"API响应格式错误: {str(e)}\n响应内容: {response.text[:500]}")
+        raise ValueError(f"API响应格式错误: {str(e)}\n响应内容: {text[:500]}")
 
-def call_openai_api(content, prompt=None):
+def call_api(api, content, prompt=None):
     """
-    调用OpenAI API进行内容总结
+    使用共用的HTTP会话同步调用API源进行内容总结
     
     Args:
+        api: API源名称
         content: 需要总结的内容
         prompt: 自定义提示词，默认为None
     
     Returns:
         总结内容
     """
-    if not API_CONFIG['openai']['api_key']:
-        raise ValueError("未设置OpenAI API密钥，请使用 'python api_config.py' 设置密钥或设置环境变量OPENAI_API_KEY")
-    
-    if prompt is None:
-        prompt = "请对以下聊天记录内容进行简要总结，提取主要话题和关键信息：\n\n"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {API_CONFIG['openai']['api_key']}"
-    }
+    url, headers, data = build_request(api, content, prompt)
+    try:
+        with METRICS.stage('request'):
+            response = get_client(api).post(url, headers=headers, json=data)
+    except requests.exceptions.RequestException as e:
+        raise ValueError(f"网络请求错误: {str(e)}")
+    return parse_response(api, response.status_code, response.headers.get('content-type', ''), response.text)
+
+def call_api_stream(api, content, prompt=None, sink=None):
+    """
+    以流式响应调用API源进行内容总结，每收到一段文本就交给 sink
     
-    data = {
-        "model": API_CONFIG['openai']['model'],
-        "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": f"{prompt}{content}"}
-        ],
-        "temperature": 0.7,
-        "max_tokens": 1500
-    }
+    Args:
+        api: API源名称
+        content: 需要总结的内容
+        prompt: 自定义提示词，默认为None
+        sink: StreamSink 对象，接收逐段生成的文本
     
+    Returns:
+        完整的总结内容
+    """
+    url, headers, data = build_request(api, content, prompt, stream=True)
+    sink.start()
+    start = time.monotonic()
+    pieces = []
+    usage = {}
     try:
-        response = requests.post(
-            API_CONFIG['openai']['api_url'],
-            headers=headers,
-            json=data,
-            timeout=60
-        )
-        
-        # 错误处理
-        if response.status_code != 200:
-            error_info = response.json() if response.headers.get('content-type', '').startswith('application/json') else {"message": response.text}
-            error_message = error_info.get('message', '未知错误')
-            raise ValueError(f"OpenAI API错误 (状态码: {response.status_code}): {error_message}")
-        
-        result = response.json()
-        return result['choices'][0]['message']['content']
+        response = get_client(api).post(url, headers=headers, json=data, stream=True)
+        with METRICS.stage('request'), response:
+            if response.status_code != 200:
+                # 出错时响应不是事件流，parse_response 会抛出包含错误信息的异常
+                parse_response(api, response.status_code, response.headers.get('content-type', ''), response.text)
+            # 事件流通常不声明字符集，按UTF-8解码；chunk_size=None 表示收到多少处理多少
+            response.encoding = 'utf-8'
+            lines = response.iter_lines(chunk_size=None, decode_unicode=True)
+            for text in iter_text_deltas(api, iter_sse_events(lines), API_NAMES[api], usage):
+                if not pieces:
+                    METRICS.observe('api_first_token', time.monotonic() - start, api=api)
+                pieces.append(text)
+                sink.write(text)
     except requests.exceptions.RequestException as e:
         raise ValueError(f"网络请求错误: {str(e)}")
-    except json.JSONDecodeError:
-        raise ValueError(f"无法解析API响应: {response.text}")
-    except KeyError as e:
-        raise ValueError(f"API响应格式错误: {str(e)}\n响应内容: {response.text[:500]}")
+    
+    if not pieces:
+        raise ValueError(f"{API_NAMES[api]} API流式响应中没有生成任何内容")
+    record_usage(api, usage)
+    return ''.join(pieces)
+
+def call_siliconflow_api(content, prompt=None):
+    """
+    调用SiliconFlow API进行内容总结
+    
+    Args:
+        content: 需要总结的内容
+        prompt: 自定义提示词，默认为None
+    
+    Returns:
+        总结内容
+    """
+    return call_api('siliconflow', content, prompt)
+
+def call_openai_api(content, prompt=None):
+    """
+    调用OpenAI API进行内容总结
+    
+    Args:
+        content: 需要总结的内容
+        prompt: 自定义提示词，默认为None
+    
+    Returns:
+        总结内容
+    """
+    return call_api('openai', content, prompt)
 
 def call_anthropic_api(content, prompt=None):
     """
@@ -151,50 +342,497 @@ def call_anthropic_api(content, prompt=None):
     Returns:
         总结内容
     """
-    if not API_CONFIG['anthropic']['api_key']:
-        raise ValueError("未设置Anthropic API密钥，请使用 'python api_config.py' 设置密钥或设置环境变量ANTHROPIC_API_KEY")
+    return call_api('anthropic', content, prompt)
+
+# API源名称到调用函数的映射
+API_FUNCTIONS = {
+    'siliconflow': call_siliconflow_api,
+    'openai': call_openai_api,
+    'anthropic': call_anthropic_api,
+}
+
+def count_input_tokens(api, content, prompt=None):
+    """计算一次请求的输入token数（系统提示词、提示词和内容），使用API源和模型对应的分词器，没有时为估算值"""
+    return get_tokenizer(api, resolve_model(api))(f"{SYSTEM_PROMPT}{content}{PROMPT_SEPARATOR}{resolve_prompt(prompt)}")
+
+def estimate_request_tokens(api, content, prompt=None):
+    """按输入加最大输出估算一次请求占用的token数，用于 tpm 限流"""
+    return count_input_tokens(api, content, prompt) + MAX_TOKENS
+
+def request_cost(api, input_tokens, output_tokens, cache_read=0, cache_write=0):
+    """
+    按 api_keys.ini 中的价格（每百万token）计算费用
     
-    if prompt is None:
-        prompt = "请对以下聊天记录内容进行简要总结，提取主要话题和关键信息：\n\n"
+    输入中命中和写入提示词缓存的部分分别按 cache_read_price、cache_write_price 计算（为0时按 input_price），
+    其余按 input_price 计算。
+    """
+    config = API_CONFIG[api]
+    cache_read_price = config.get('cache_read_price') or config['input_price']
+    cache_write_price = config.get('cache_write_price') or config['input_price']
+    cost = ((input_tokens - cache_read - cache_write) * config['input_price'] + cache_read * cache_read_price
+            + cache_write * cache_write_price + output_tokens * config['output_price'])
+    return cost / 1_000_000
+
+def request_token_limit(api, prompt=None):
+    """
+    根据 api_keys.ini 中的 max_request_tokens、max_request_cost 计算单个请求中内容部分的token上限
     
-    headers = {
-        "Content-Type": "application/json",
-        "x-api-key": API_CONFIG['anthropic']['api_key'],
-        "anthropic-version": "2023-06-01"
-    }
+    Args:
+        api: API源名称
+        prompt: 自定义提示词
+    
+    Returns:
+        内容的token上限，未设置上限时返回None
+    
+    Raises:
+        ValueError: 上限连提示词和最大输出都容纳不下
+    """
+    config = API_CONFIG[api]
+    # 分段和合并时使用不同的提示词，按最长的计算
+    overhead = max(count_input_tokens(api, '', p) for p in (prompt, MAP_PROMPT, REDUCE_PROMPT))
+    limits = []
+    if config['max_request_tokens']:
+        limits.append(config['max_request_tokens'] - overhead)
+    if config['max_request_cost'] and (config['input_price'] or config['output_price']):
+        budget = config['max_request_cost'] * 1_000_000 - MAX_TOKENS * config['output_price']
+        if config['input_price']:
+            limits.append(int(budget / config['input_price']) - overhead)
+        elif budget < 0:
+            limits.append(0)
+    if not limits:
+        return None
+    limit = min(limits)
+    if limit <= 0:
+        raise ValueError(f"{api} 的单次请求上限（max_request_tokens/max_request_cost）容纳不下提示词和 {MAX_TOKENS} tokens 的输出")
+    return limit
+
+def chunk_token_budget(api, content, prompt=None):
+    """
+    确定总结内容时每个请求中内容的token预算
+    
+    未设置单次请求上限时为 CHUNK_TOKENS；设置了上限时，budget_action 为 chunk 则按上限缩小分段，
+    为 refuse 则在任何一个请求超出上限时拒绝总结。合并时每个请求至少包含两段总结（各至多
+    MAX_TOKENS），需要分段而上限容纳不下两段总结时同样拒绝。
+    
+    Args:
+        api: API源名称
+        content: 需要总结的内容
+        prompt: 自定义提示词
+    
+    Returns:
+        每个请求中内容的token预算
+    
+    Raises:
+        ValueError: 超出单次请求上限且 budget_action 为 refuse，或上限小到无法合并分段总结
+    """
+    limit = request_token_limit(api, prompt)
+    if limit is None:
+        return CHUNK_TOKENS
+    if API_CONFIG[api]['budget_action'] == 'chunk':
+        budget = min(CHUNK_TOKENS, limit)
+        reduce_tokens = 2 * MAX_TOKENS + estimate_tokens(SUMMARY_SEPARATOR)
+        if limit < reduce_tokens and len(split_content(content, budget)) > 1:
+            raise ValueError(f"{api} 的单次请求上限 {limit} tokens 容纳不下合并两段总结所需的约 {reduce_tokens} tokens，无法分段总结")
+        return budget
+    
+    measure = get_tokenizer(api, resolve_model(api))
+    largest = max(max(tokens) for tokens in plan_requests(content, CHUNK_TOKENS, MAX_TOKENS, measure))
+    if largest > limit:
+        raise ValueError(f"{api} 的请求内容约 {largest} tokens，超出单次请求上限 {limit} tokens，已拒绝（budget_action = refuse）")
+    return CHUNK_TOKENS
+
+def call_api_limited(api, content, prompt=None, sink=None, cancelled=None):
+    """
+    在API源的并发和速率限制（api_keys.ini 中的 concurrency、rpm、tpm）内调用API，成功时记录耗时
+    
+    Args:
+        api: API源名称
+        content: 需要总结的内容
+        prompt: 自定义提示词，默认为None
+        sink: 流式输出时接收逐段文本的 StreamSink 对象，为None时不使用流式响应
+        cancelled: --hedge 模式中的取消标志（threading.Event），已设置时不再发出请求
+    
+    Returns:
+        总结内容
+    
+    Raises:
+        HedgeCancelled: 等待限流期间其他API源已经返回总结
+    """
+    with get_limiter(api, API_CONFIG[api]).limit(estimate_request_tokens(api, content, prompt)):
+        if cancelled is not None and cancelled.is_set():
+            raise HedgeCancelled(f"{api} 的请求已取消")
+        start = time.monotonic()
+        if sink is not None:
+            summary = call_api_stream(api, content, prompt, sink)
+        else:
+            summary = API_FUNCTIONS[api](content, prompt)
+    LATENCY_HISTORY.record(api, resolve_model(api), time.monotonic() - start)
+    return summary
+
+def lookup_summary_cache(api, content, prompt=None):
+    """
+    查找总结缓存
+    
+    Args:
+        api: API源名称
+        content: 需要总结的内容
+        prompt: 自定义提示词，默认为None
+    
+    Returns:
+        (key, model, summary): 缓存键、模型名称和缓存的总结（未命中时为None）
+    """
+    model = resolve_model(api)
+    key = cache_key(api, model, SYSTEM_PROMPT, resolve_prompt(prompt), content, TEMPERATURE, MAX_TOKENS)
+    summary = SUMMARY_CACHE.get(key)
+    METRICS.inc('summary_cache', api=api, result='miss' if summary is None else 'hit')
+    if summary is not None:
+        print(f"{api} 命中总结缓存，跳过API调用")
+    return key, model, summary
+
+def call_api_cached(api, content, prompt=None, sink=None, cancelled=None):
+    """
+    调用API进行内容总结，相同的请求直接返回缓存的总结
+    
+    Args:
+        api: API源名称
+        content: 需要总结的内容
+        prompt: 自定义提示词，默认为None
+        sink: 流式输出时接收逐段文本的 StreamSink 对象，命中缓存时一次写入全部内容
+        cancelled: --hedge 模式中的取消标志（threading.Event）
+    
+    Returns:
+        总结内容
+    """
+    if SUMMARY_CACHE is None:
+        return call_api_limited(api, content, prompt, sink, cancelled)
+    
+    key, model, summary = lookup_summary_cache(api, content, prompt)
+    if summary is not None:
+        if sink is not None:
+            sink.start()
+            sink.write(summary)
+        return summary
     
-    data = {
-        "model": API_CONFIG['anthropic']['model'],
-        "system": SYSTEM_PROMPT,
-        "messages": [
-            {"role": "user", "content": f"{prompt}{content}"}
-        ],
-        "temperature": 0.7,
-        "max_tokens": 1500
+    summary = call_api_limited(api, content, prompt, sink, cancelled)
+    SUMMARY_CACHE.put(key, summary, api=api, model=model)
+    return summary
+
+def summarize_with_api(api, content, prompt=None, sink=None, cancelled=None):
+    """
+    使用一个API源总结内容，超过 CHUNK_TOKENS（或单次请求上限）的内容分段并行总结后再合并
+    
+    Args:
+        api: API源名称
+        content: 需要总结的内容
+        prompt: 自定义提示词，默认为None
+        sink: 流式输出时接收最终总结逐段文本的 StreamSink 对象（分段总结不流式输出）
+        cancelled: --hedge 模式中的取消标志（threading.Event），设置后剩余的分段不再发出请求
+    
+    Returns:
+        总结内容
+    
+    Raises:
+        ValueError: 超出单次请求上限且 budget_action 为 refuse
+        HedgeCancelled: 其他API源已经返回总结
+    """
+    return map_reduce_summarize(
+        lambda text, text_prompt: call_api_cached(api, text, text_prompt, cancelled=cancelled),
+        content, prompt, chunk_token_budget(api, content, prompt), CHUNK_WORKERS,
+        final_summarize=lambda text, text_prompt: call_api_cached(api, text, text_prompt, sink, cancelled)
+    )
+
+async def call_api_async(clients, api, content, prompt=None):
+    """
+    异步调用API源进行内容总结（在该API源的限流器内），相同的请求直接返回缓存的总结
+    
+    Args:
+        clients: async_engine.AsyncClients 对象
+        api: API源名称
+        content: 需要总结的内容
+        prompt: 自定义提示词，默认为None
+    
+    Returns:
+        总结内容
+    """
+    if SUMMARY_CACHE is not None:
+        key, model, summary = lookup_summary_cache(api, content, prompt)
+        if summary is not None:
+            return summary
+    
+    url, headers, data = build_request(api, content, prompt)
+    async with clients.limiter(api).limit(estimate_request_tokens(api, content, prompt)):
+        start = time.monotonic()
+        try:
+            status_code, content_type, text = await clients.client(api).post(url, headers, data)
+        except NETWORK_ERRORS as e:
+            raise ValueError(f"网络请求错误: {e!r}")
+    summary = parse_response(api, status_code, content_type, text)
+    LATENCY_HISTORY.record(api, resolve_model(api), time.monotonic() - start)
+    
+    if SUMMARY_CACHE is not None:
+        SUMMARY_CACHE.put(key, summary, api=api, model=model)
+    return summary
+
+async def summarize_file_async(clients, api, input_file, custom_prompt=None):
+    """
+    读取文件并使用一个API源异步总结，超过 CHUNK_TOKENS（或单次请求上限）的内容分段总结后再合并
+    
+    Args:
+        clients: async_engine.AsyncClients 对象
+        api: API源名称
+        input_file: 需要总结的文件路径
+        custom_prompt: 自定义提示词
+    
+    Returns:
+        总结内容
+    """
+    with METRICS.stage('read'), open(input_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    # 每个任务在自己的 asyncio 任务中运行，设置的群只影响本任务发出的请求
+    with METRICS.group(group_label(input_file)):
+        return await map_reduce_summarize_async(
+            lambda text, text_prompt: call_api_async(clients, api, text, text_prompt),
+            content, custom_prompt, chunk_token_budget(api, content, custom_prompt)
+        )
+
+def estimate_summary(api, content, prompt=None):
+    """
+    预估使用一个API源总结内容所需的请求数、token数、费用和耗时，不调用API
+    
+    输出token数按每个请求都达到 MAX_TOKENS 计算，是上限；耗时按 api_keys.ini 中的
+    first_token_latency、output_tps 和并发、rpm 限制粗略估算。
+    
+    Args:
+        api: API源名称
+        content: 需要总结的内容
+        prompt: 自定义提示词
+    
+    Returns:
+        字典: requests、input_tokens、output_tokens、cost、seconds，以及 error（会被拒绝时的原因，否则为None）
+    """
+    config = API_CONFIG[api]
+    measure = get_tokenizer(api, resolve_model(api))
+    error = None
+    try:
+        chunk_tokens = chunk_token_budget(api, content, prompt)
+    except ValueError as e:
+        chunk_tokens, error = CHUNK_TOKENS, str(e)
+    
+    rounds = plan_requests(content, chunk_tokens, MAX_TOKENS, measure)
+    requests_count = sum(len(tokens) for tokens in rounds)
+    input_tokens = sum(map(sum, rounds)) + prompt_tokens(api, rounds, prompt)
+    output_tokens = requests_count * MAX_TOKENS
+    
+    seconds = sequential_requests(api, rounds) * configured_latency(api)
+    if config['rpm']:
+        seconds = max(seconds, (requests_count - 1) * 60 / config['rpm'])
+    
+    return {
+        'requests': requests_count,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cost': request_cost(api, input_tokens, output_tokens),
+        'seconds': seconds,
+        'error': error,
     }
+
+def prompt_tokens(api, rounds, prompt=None):
+    """
+    计算 plan_requests 规划的各请求中系统提示词和提示词的token数之和
     
+    不分段时只有一个使用 prompt 的请求；分段时分段请求使用 MAP_PROMPT，中间的合并使用
+    REDUCE_PROMPT，最后一次合并使用 prompt（默认为 REDUCE_PROMPT）。
+    """
+    if len(rounds) == 1:
+        return count_input_tokens(api, '', prompt)
+    total = len(rounds[0])
+    tokens = total * count_input_tokens(api, '', MAP_PROMPT.format(index=total, total=total))
+    tokens += sum(len(requests) for requests in rounds[1:-1]) * count_input_tokens(api, '', REDUCE_PROMPT)
+    return tokens + count_input_tokens(api, '', prompt or REDUCE_PROMPT)
+
+def configured_latency(api):
+    """按 api_keys.ini 中的 first_token_latency 和 output_tps 估计一次请求（输出 MAX_TOKENS）的秒数"""
+    config = API_CONFIG[api]
+    return config['first_token_latency'] + (MAX_TOKENS / config['output_tps'] if config['output_tps'] else 0)
+
+def sequential_requests(api, rounds):
+    """
+    计算分段总结时需要依次等待的请求数：每一轮的请求并行发出（不超过 CHUNK_WORKERS 和 concurrency），
+    下一轮等上一轮全部完成
+    
+    Args:
+        api: API源名称
+        rounds: plan_requests 返回的每一轮请求
+    
+    Returns:
+        依次等待的请求数
+    """
+    workers = max(1, min(CHUNK_WORKERS, API_CONFIG[api]['concurrency']))
+    return sum(math.ceil(len(tokens) / workers) for tokens in rounds)
+
+def format_estimate(api, estimate):
+    """生成 estimate_summary 结果的说明文字"""
+    config = API_CONFIG[api]
+    if config['input_price'] or config['output_price']:
+        cost = f"费用至多约 {estimate['cost']:.4f}"
+    else:
+        cost = "未设置价格"
+    text = (f"{api} ({resolve_model(api)}): {estimate['requests']} 次请求，"
+            f"输入约 {estimate['input_tokens']} tokens，输出至多 {estimate['output_tokens']} tokens，"
+            f"{cost}，预计耗时 {estimate['seconds']:.0f} 秒")
+    if estimate['error']:
+        text += f"\n    将被拒绝: {estimate['error']}"
+    return text
+
+def dry_run(input_files, api_sources, custom_prompt=None):
+    """
+    打印每个文件使用每个API源总结时预计的请求数、token数、费用和耗时，不调用API
+    
+    Args:
+        input_files: 需要总结的文件路径列表
+        api_sources: API源列表
+        custom_prompt: 自定义提示词
+    """
+    api_sources = [api for api in api_sources if api in API_FUNCTIONS]
+    totals = {api: {'requests': 0, 'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0, 'seconds': 0.0, 'error': None} for api in api_sources}
+    for input_file in input_files:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+        print(f"{os.path.basename(input_file)}（约 {estimate_tokens(content)} tokens）:")
+        for api in api_sources:
+            estimate = estimate_summary(api, content, custom_prompt)
+            print(f"  {format_estimate(api, estimate)}")
+            for key in ('requests', 'input_tokens', 'output_tokens', 'cost', 'seconds'):
+                totals[api][key] += estimate[key]
+    
+    if len(input_files) > 1:
+        # 合计耗时为逐个文件耗时之和，多个文件并发处理时实际更短
+        print(f"合计 {len(input_files)} 个文件:")
+        for api in api_sources:
+            print(f"  {format_estimate(api, totals[api])}")
+
+def expected_latency(api, content, prompt=None):
+    """
+    预计使用一个API源总结内容的耗时（--hedge 模式用于排序和决定何时追加请求）
+    
+    每次请求的耗时取该API源（模型）历史耗时的中位数和 HEDGE_PERCENTILE 百分位数，历史记录
+    不足时都按 api_keys.ini 中的延迟估计；再乘以分段总结时需要依次等待的请求数。
+    
+    Args:
+        api: API源名称
+        content: 需要总结的内容
+        prompt: 自定义提示词
+    
+    Returns:
+        (typical, slow): 通常的耗时和较慢时的耗时（秒）
+    """
+    model = resolve_model(api)
     try:
-        response = requests.post(
-            API_CONFIG['anthropic']['api_url'],
-            headers=headers,
-            json=data,
-            timeout=60
+        chunk_tokens = chunk_token_budget(api, content, prompt)
+    except ValueError:
+        # 会被拒绝的API源很快失败，失败后立即请求下一个API源
+        chunk_tokens = CHUNK_TOKENS
+    sequential = sequential_requests(api, plan_requests(content, chunk_tokens, MAX_TOKENS, get_tokenizer(api, model)))
+    typical = LATENCY_HISTORY.percentile(api, model, 50)
+    slow = LATENCY_HISTORY.percentile(api, model, HEDGE_PERCENTILE)
+    if typical is None:
+        typical = slow = configured_latency(api)
+    return typical * sequential, slow * sequential
+
+def hedge_plan(content, api_sources, prompt=None):
+    """
+    --hedge 模式中请求API源的顺序和每个API源的等待时间
+    
+    Args:
+        content: 需要总结的内容
+        api_sources: API源列表
+        prompt: 自定义提示词
+    
+    Returns:
+        (candidates, delays): 按通常耗时从快到慢排列的API源列表，{API源: 追加请求下一个API源前等待的秒数}
+    """
+    latencies = {api: expected_latency(api, content, prompt) for api in api_sources}
+    candidates = sorted(api_sources, key=lambda api: latencies[api][0])
+    print("按预计耗时依次请求: " + ', '.join(f"{api}（约 {latencies[api][0]:.1f} 秒，{latencies[api][1]:.1f} 秒后追加请求）" for api in candidates))
+    return candidates, {api: slow for api, (_, slow) in latencies.items()}
+
+def summarize_first(content, api_sources, prompt=None):
+    """
+    --hedge 模式: 先请求预计最快的API源，超过其较慢时的耗时仍未返回（或失败）时再请求下一个API源，
+    取最先返回的总结，其余API源不再发出新的请求
+    
+    Args:
+        content: 需要总结的内容
+        api_sources: API源列表
+        prompt: 自定义提示词
+    
+    Returns:
+        (api, summary): 最先返回的API源和它的总结
+    
+    Raises:
+        ValueError: 所有API源都失败
+    """
+    candidates, delays = hedge_plan(content, api_sources, prompt)
+    return first_response(
+        propagate_group(lambda api, cancelled: summarize_with_api(api, content, prompt, cancelled=cancelled)),
+        candidates, delays.get
+    )
+
+def summarize_file_first(input_file, api_sources, custom_prompt=None):
+    """
+    读取文件并以 --hedge 模式总结
+    
+    Args:
+        input_file: 需要总结的文件路径
+        api_sources: API源列表
+        custom_prompt: 自定义提示词
+    
+    Returns:
+        (api, summary): 最先返回的API源和它的总结
+    """
+    with METRICS.stage('read'), open(input_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    with METRICS.group(group_label(input_file)):
+        return summarize_first(content, api_sources, custom_prompt)
+
+async def summarize_file_first_async(clients, input_file, api_sources, custom_prompt=None):
+    """
+    summarize_file_first 的异步版本，取得总结后取消其余API源仍在进行的请求
+    
+    Args:
+        clients: async_engine.AsyncClients 对象
+        input_file: 需要总结的文件路径
+        api_sources: API源列表
+        custom_prompt: 自定义提示词
+    
+    Returns:
+        (api, summary): 最先返回的API源和它的总结
+    """
+    with METRICS.stage('read'), open(input_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    async def summarize(api):
+        return await map_reduce_summarize_async(
+            lambda text, text_prompt: call_api_async(clients, api, text, text_prompt),
+            content, custom_prompt, chunk_token_budget(api, content, custom_prompt)
         )
-        
-        # 错误处理
-        if response.status_code != 200:
-            error_info = response.json() if response.headers.get('content-type', '').startswith('application/json') else {"message": response.text}
-            error_message = error_info.get('message', '未知错误')
-            raise ValueError(f"Anthropic API错误 (状态码: {response.status_code}): {error_message}")
-        
-        result = response.json()
-        return result['content'][0]['text']
-    except requests.exceptions.RequestException as e:
-        raise ValueError(f"网络请求错误: {str(e)}")
-    except json.JSONDecodeError:
-        raise ValueError(f"无法解析API响应: {response.text}")
-    except KeyError as e:
-        raise ValueError(f"API响应格式错误: {str(e)}\n响应内容: {response.text[:500]}")
+    
+    candidates, delays = hedge_plan(content, api_sources, custom_prompt)
+    with METRICS.group(group_label(input_file)):
+        return await first_response_async(summarize, candidates, delays.get)
+
+def group_label(input_file):
+    """
+    获取运行指标中按群统计用量时使用的名称：清理后的文件名去掉 cleaned_ 前缀和日期部分
+    
+    Args:
+        input_file: 清理后的文件路径，如 outputs/cleaned_example_2025-03-18.txt
+    
+    Returns:
+        群名称，如 example
+    """
+    name = extract_original_filename(os.path.basename(input_file))
+    return re.sub(r'_\d{4}-\d{2}-\d{2}(=\d{4}-\d{2}-\d{2})?$', '', name)
 
 def extract_original_filename(cleaned_filename):
     """
@@ -222,7 +860,7 @@ def extract_original_filename(cleaned_filename):
     # # 如果没有匹配到日期格式，返回去除扩展名的文件名
     return os.path.splitext(name_without_prefix)[0]
 
-def summarize_chat_content(file_path, api_sources=None, custom_prompt=None):
+def summarize_chat_content(file_path, api_sources=None, custom_prompt=None, hedge=False):
     """
     对聊天内容文件进行总结，使用多个API源
     
@@ -230,6 +868,7 @@ def summarize_chat_content(file_path, api_sources=None, custom_prompt=None):
         file_path: 需要总结的文件路径
         api_sources: API源列表，默认为['siliconflow']
         custom_prompt: 自定义提示词
+        hedge: 是否只取最先返回的一个API源的总结（见 summarize_first）
     
     Returns:
         包含各API源总结结果的字典
@@ -253,21 +892,22 @@ def summarize_chat_content(file_path, api_sources=None, custom_prompt=None):
         missing_keys_str = ', '.join(missing_keys)
         raise ValueError(f"以下API源未设置密钥: {missing_keys_str}，请使用 'python api_config.py' 设置密钥")
     
+    if hedge:
+        for api in api_sources:
+            if api not in API_FUNCTIONS:
+                print(f"不支持的API源: {api}")
+        api, summary = summarize_first(content, [api for api in api_sources if api in API_FUNCTIONS], custom_prompt)
+        return {api: summary}
     
     with ThreadPoolExecutor(max_workers=len(api_sources)) as executor:
         future_to_api = {}
         
         for api in api_sources:
-            if api == 'siliconflow':
-                future = executor.submit(call_siliconflow_api, content, custom_prompt)
-            elif api == 'openai':
-                future = executor.submit(call_openai_api, content, custom_prompt)
-            elif api == 'anthropic':
-                future = executor.submit(call_anthropic_api, content, custom_prompt)
-            else:
+            if api not in API_FUNCTIONS:
                 print(f"不支持的API源: {api}")
                 continue
             
+            future = executor.submit(summarize_with_api, api, content, custom_prompt)
             future_to_api[future] = api
         
         for future in as_completed(future_to_api):
@@ -281,7 +921,7 @@ def summarize_chat_content(file_path, api_sources=None, custom_prompt=None):
     
     return results
 
-def generate_conclusion(input_file, output_dir='conclusion', api_sources=None, custom_prompt=None):
+def generate_conclusion(input_file, output_dir='conclusion', api_sources=None, custom_prompt=None, hedge=False):
     """
     生成聊天内容总结并保存到指定目录
     
@@ -290,22 +930,14 @@ def generate_conclusion(input_file, output_dir='conclusion', api_sources=None, c
         output_dir: 输出目录路径
         api_sources: API源列表
         custom_prompt: 自定义提示词
+        hedge: 是否只取最先返回的一个API源的总结
     
     Returns:
         输出文件路径
     """
-    # 确保输出目录存在
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # 提取文件名
-    file_name = os.path.basename(input_file)
-    original_name = extract_original_filename(file_name)
-    output_file = os.path.join(output_dir, f"conclusion_{original_name}.md")
-    
     # 调用API进行总结
     try:
-        summary_results = summarize_chat_content(input_file, api_sources, custom_prompt)
+        summary_results = summarize_chat_content(input_file, api_sources, custom_prompt, hedge)
     except ValueError as e:
         print(f"错误: {e}")
         return None
@@ -315,25 +947,458 @@ def generate_conclusion(input_file, output_dir='conclusion', api_sources=None, c
         print(f"错误: 未能从任何API源获取总结结果")
         return None
     
+    return write_conclusion(input_file, output_dir, summary_results)
+
+def conclusion_path(input_file, output_dir='conclusion'):
+    """
+    获取清理后的文件对应的总结文件路径
+    
+    Args:
+        input_file: 清理后的文件路径
+        output_dir: 输出目录路径
+    
+    Returns:
+        总结文件路径
+    """
+    original_name = extract_original_filename(os.path.basename(input_file))
+    return os.path.join(output_dir, f"conclusion_{original_name}.md")
+
+def conclusion_header(input_file):
+    """
+    生成总结文件的开头部分
+    
+    Args:
+        input_file: 被总结的文件路径
+    
+    Returns:
+        Markdown文本
+    """
+    file_name = os.path.basename(input_file)
+    header = f"# QQ聊天文字记录AI总结助手 by JyiDeng: https://github.com/JyiDeng/qq_chat_ai_conclusion\n\n"
+    # header += f"# 聊天记录总结: {original_name}\n\n"
+    header += f"*生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*\n\n"
+    header += f"*原始文件: {file_name}*\n\n"
+    return header
+
+def conclusion_section_title(api):
+    """生成总结文件中一个API源的小节标题"""
+    return f"## {api.capitalize()} 总结\n\n"
+
+def write_conclusion(input_file, output_dir, summary_results):
+    """
+    将各API源的总结结果写入Markdown总结文件
+    
+    Args:
+        input_file: 被总结的文件路径
+        output_dir: 输出目录路径
+        summary_results: {API源: 总结内容} 字典
+    
+    Returns:
+        输出文件路径
+    """
+    # 确保输出目录存在
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    output_file = conclusion_path(input_file, output_dir)
+    
     # 构建输出内容
-    output_content = f"# QQ聊天文字记录AI总结助手 by JyiDeng: https://github.com/JyiDeng/qq_chat_ai_conclusion\n\n"
-    # output_content += f"# 聊天记录总结: {original_name}\n\n"
-    output_content += f"*生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*\n\n"
-    output_content += f"*原始文件: {file_name}*\n\n"
+    output_content = conclusion_header(input_file)
     
     # 添加各API的总结内容
     for api, summary in summary_results.items():
-        output_content += f"## {api.capitalize()} 总结\n\n"
+        output_content += conclusion_section_title(api)
         output_content += f"{summary}\n\n"
     
     # 保存到文件
-    with open(output_file, 'w', encoding='utf-8') as f:
+    with METRICS.stage('write'), open(output_file, 'w', encoding='utf-8') as f:
         f.write(output_content)
     
     print(f"已生成总结文件: {output_file}")
     return output_file
 
-def process_all_files(input_dir='outputs', output_dir='conclusion', api_sources=None, custom_prompt=None):
+class StreamingConclusion:
+    """
+    边生成边写入的总结文件
+    
+    各API源的小节仍按选定的顺序排列：排在最前面的未完成小节直接追加到文件中，
+    后面的小节先缓存，等前面的小节完成后再写入并继续实时追加。全部完成后文件内容
+    与 write_conclusion 的结果相同。
+    """
+    
+    def __init__(self, input_file, output_dir, api_sources):
+        """
+        Args:
+            input_file: 被总结的文件路径
+            output_dir: 输出目录路径
+            api_sources: API源列表（决定小节顺序）
+        """
+        self.input_file = input_file
+        self.output_file = conclusion_path(input_file, output_dir)
+        self.output_dir = output_dir
+        self.api_sources = list(api_sources)
+        self.first_token_seconds = {}
+        self._buffers = {api: [] for api in self.api_sources}
+        self._finished = {}
+        self._current = 0
+        self._started_section = False
+        self._file = None
+        self._lock = threading.Lock()
+    
+    def sink(self, api):
+        """获取接收一个API源逐段文本的 StreamSink"""
+        return StreamSink(self, api)
+    
+    def _write(self, text):
+        if self._file is None:
+            if not os.path.exists(self.output_dir):
+                os.makedirs(self.output_dir)
+            self._file = open(self.output_file, 'w', encoding='utf-8')
+            self._file.write(conclusion_header(self.input_file))
+        self._file.write(text)
+        # 立即写入磁盘，让其他程序可以读到已生成的部分
+        self._file.flush()
+    
+    def _flush(self):
+        """把排在最前面的小节的已缓存内容写入文件，小节完成后继续处理下一个"""
+        while self._current < len(self.api_sources):
+            api = self.api_sources[self._current]
+            buffer = self._buffers[api]
+            if buffer:
+                if not self._started_section:
+                    self._write(conclusion_section_title(api))
+                    self._started_section = True
+                self._write(''.join(buffer))
+                buffer.clear()
+            
+            if api not in self._finished:
+                return
+            if self._started_section:
+                if self._finished[api] is not None:
+                    # 已写出部分内容后才失败，标明该小节不完整
+                    self._write(f"\n\n*（生成中断: {self._finished[api]}）*")
+                self._write("\n\n")
+            self._current += 1
+            self._started_section = False
+    
+    def append(self, api, text):
+        """
+        追加一个API源新生成的文本
+        
+        Args:
+            api: API源名称
+            text: 文本片段
+        """
+        with self._lock:
+            self._buffers[api].append(text)
+            if self.api_sources[self._current] == api:
+                self._flush()
+    
+    def finish(self, api, error=None):
+        """
+        标记一个API源已完成
+        
+        Args:
+            api: API源名称
+            error: 失败时的异常，成功时为None
+        """
+        with self._lock:
+            if error is not None and not (self.api_sources[self._current] == api and self._started_section):
+                # 还没有写入文件就失败了，与 write_conclusion 一样省略该小节
+                self._buffers[api].clear()
+            self._finished[api] = error
+            self._flush()
+    
+    def close(self):
+        """
+        关闭总结文件
+        
+        Returns:
+            输出文件路径；没有任何API源生成内容时返回None
+        """
+        with self._lock:
+            self._flush()
+            if self._file is None:
+                return None
+            self._file.close()
+            self._file = None
+        for api, seconds in self.first_token_seconds.items():
+            print(f"{api} 首个token用时 {seconds:.2f} 秒")
+        print(f"已生成总结文件: {self.output_file}")
+        return self.output_file
+
+class StreamSink:
+    """一个API源流式输出的接收端，记录首个token用时并把文本交给 StreamingConclusion"""
+    
+    def __init__(self, conclusion, api):
+        self.conclusion = conclusion
+        self.api = api
+        self._started = None
+    
+    def start(self):
+        """开始发送请求（用于计算首个token用时）"""
+        self._started = time.monotonic()
+    
+    def write(self, text):
+        """接收新生成的文本"""
+        if self.api not in self.conclusion.first_token_seconds and self._started is not None:
+            self.conclusion.first_token_seconds[self.api] = time.monotonic() - self._started
+        self.conclusion.append(self.api, text)
+
+def needs_conclusion(input_file, output_dir, api_sources, state, hedge=False):
+    """
+    判断清理后的文件是否需要（重新）生成总结
+    
+    文件内容与上次生成总结时相同、总结文件仍然存在且包含所有选定API源的结果时，不需要重新生成。
+    
+    Args:
+        input_file: 清理后的文件路径
+        output_dir: 总结输出目录
+        api_sources: API源列表
+        state: 增量处理状态
+        hedge: 是否只取一个API源的总结，此时总结文件包含任意一个选定API源的结果即可
+    
+    Returns:
+        是否需要生成总结
+    """
+    record = state['conclusions'].get(os.path.basename(input_file))
+    if not record:
+        return True
+    if record['sha256'] != file_digest(input_file):
+        return True
+    if record['conclusion'] != conclusion_path(input_file, output_dir) or not os.path.exists(record['conclusion']):
+        return True
+    if hedge:
+        return not set(api_sources) & set(record['apis'])
+    return not set(api_sources) <= set(record['apis'])
+
+def record_conclusion(state, input_file, digest, summary_results, output_file):
+    """
+    在增量处理状态中记录已生成总结的文件摘要和成功的API源
+    
+    Args:
+        state: 增量处理状态
+        input_file: 被总结的文件路径
+        digest: 开始总结时文件内容的SHA-256摘要
+        summary_results: {API源: 总结内容} 字典
+        output_file: 总结文件路径
+    """
+    state['conclusions'][os.path.basename(input_file)] = {
+        'sha256': digest,
+        'apis': sorted(summary_results),
+        'conclusion': output_file,
+        'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+def summarize_file_with_api(api, input_file, custom_prompt=None, sink=None):
+    """
+    读取文件并使用一个API源进行总结
+    
+    Args:
+        api: API源名称
+        input_file: 需要总结的文件路径
+        custom_prompt: 自定义提示词
+        sink: 流式输出时接收逐段文本的 StreamSink 对象
+    
+    Returns:
+        总结内容
+    """
+    with METRICS.stage('read'), open(input_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    with METRICS.group(group_label(input_file)):
+        return summarize_with_api(api, content, custom_prompt, sink)
+
+class ConclusionCollector:
+    """
+    收集并发任务返回的 (文件, API源) 总结结果，某个文件的所有API源都返回后立即写入它的总结文件
+    """
+    
+    def __init__(self, input_files, output_dir, api_sources, state=None, state_file=STATE_FILE, stream=False, hedge=False):
+        """
+        Args:
+            input_files: 需要总结的文件路径列表
+            output_dir: 输出目录路径
+            api_sources: API源列表
+            state: 增量处理状态，为None时不记录
+            state_file: 增量处理状态文件路径
+            stream: 是否边生成边写入总结文件（见 StreamingConclusion）
+            hedge: 每个文件只有一个任务，返回最先完成的API源的总结（见 summarize_file_first）
+        """
+        self.output_dir = output_dir
+        self.api_sources = api_sources
+        self.state = state
+        self.state_file = state_file
+        self.success_count = 0
+        # 增量处理时在开始前计算摘要，总结期间文件被修改时下次仍会重新总结
+        self._digests = {input_file: file_digest(input_file) for input_file in input_files} if state is not None else {}
+        self._remaining = {input_file: 1 if hedge else len(api_sources) for input_file in input_files}
+        self._results = {input_file: {} for input_file in input_files}
+        self.streams = {}
+        if stream:
+            self.streams = {input_file: StreamingConclusion(input_file, output_dir, api_sources) for input_file in input_files}
+    
+    def sink(self, input_file, api):
+        """获取流式输出时一个 (文件, API源) 任务的 StreamSink，不流式输出时返回None"""
+        if input_file not in self.streams:
+            return None
+        return self.streams[input_file].sink(api)
+    
+    def add(self, input_file, api, summary=None, error=None):
+        """
+        记录一个任务的结果
+        
+        Args:
+            input_file: 被总结的文件路径
+            api: API源名称
+            summary: 总结内容，失败时为None
+            error: 失败时的异常
+        """
+        file = os.path.basename(input_file)
+        METRICS.inc('summaries', api=api, result='error' if error is not None else 'ok')
+        if error is not None:
+            print(f"调用 {api} API总结 {file} 时出错：{error}")
+        else:
+            self._results[input_file][api] = summary
+        stream = self.streams.get(input_file)
+        if stream is not None:
+            stream.finish(api, error)
+        
+        self._remaining[input_file] -= 1
+        if self._remaining[input_file]:
+            return
+        
+        # 该文件的所有API源都已返回，按选定API源的顺序写入总结
+        results = self._results.pop(input_file)
+        summary_results = {name: results[name] for name in self.api_sources if name in results}
+        if not summary_results:
+            if stream is not None:
+                stream.close()
+            print(f"处理文件 {file} 时出错: 未能从任何API源获取总结结果")
+            return
+        
+        try:
+            if stream is not None:
+                output_file = stream.close()
+            else:
+                output_file = write_conclusion(input_file, self.output_dir, summary_results)
+        except OSError as e:
+            print(f"处理文件 {file} 时出错: {e}")
+            return
+        if self.state is not None:
+            record_conclusion(self.state, input_file, self._digests[input_file], summary_results, output_file)
+            save_state(self.state, self.state_file)
+        print(f"成功处理文件: {file} -> {os.path.basename(output_file)}")
+        self.success_count += 1
+
+def summarize_files(input_files, output_dir, api_sources, custom_prompt=None, state=None, state_file=STATE_FILE, engine='thread', stream=False, hedge=False):
+    """
+    并发总结多个文件
+    
+    所有 (文件, API源) 组合作为独立的任务同时排队，实际并发数和请求速率由每个API源的
+    限流器控制；某个文件的所有API源都返回后立即写入它的总结文件。
+    
+    Args:
+        input_files: 需要总结的文件路径列表
+        output_dir: 输出目录路径
+        api_sources: API源列表
+        custom_prompt: 自定义提示词
+        state: 增量处理状态，为None时不记录
+        state_file: 增量处理状态文件路径
+        engine: 'thread' 使用线程池，'async' 使用 asyncio（需要安装aiohttp）
+        stream: 是否使用流式响应，边生成边写入总结文件（仅支持线程池方式）
+        hedge: 每个文件只取最先返回的一个API源的总结（不支持流式输出）
+    
+    Returns:
+        成功生成总结的文件数
+    """
+    api_sources = [api for api in api_sources if api in API_FUNCTIONS]
+    if not api_sources:
+        print("错误: 没有可用的API源")
+        return 0
+    
+    if stream and engine == 'async':
+        print("错误: 流式输出暂不支持异步模式，请去掉 --engine async")
+        return 0
+    if stream and hedge:
+        print("错误: --hedge 模式不支持流式输出，请去掉 --stream")
+        return 0
+    
+    collector = ConclusionCollector(input_files, output_dir, api_sources, state, state_file, stream, hedge)
+    if engine == 'async':
+        asyncio.run(_summarize_files_async(collector, input_files, api_sources, custom_prompt, hedge))
+        return collector.success_count
+    
+    # 线程数按所有API源的并发上限之和设置，等待限流的任务不会占用请求名额
+    max_workers = sum(get_limiter(api, API_CONFIG[api]).concurrency for api in api_sources)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if hedge:
+            _summarize_files_first(executor, collector, input_files, api_sources, custom_prompt)
+            return collector.success_count
+        
+        future_to_job = {}
+        for input_file in input_files:
+            for api in api_sources:
+                future = executor.submit(summarize_file_with_api, api, input_file, custom_prompt, collector.sink(input_file, api))
+                future_to_job[future] = (input_file, api)
+        
+        for future in as_completed(future_to_job):
+            input_file, api = future_to_job[future]
+            try:
+                collector.add(input_file, api, summary=future.result())
+            except Exception as e:
+                collector.add(input_file, api, error=e)
+    
+    return collector.success_count
+
+def _summarize_files_first(executor, collector, input_files, api_sources, custom_prompt=None):
+    """summarize_files 的 --hedge 模式: 每个文件一个任务，记录最先返回的API源的总结"""
+    future_to_file = {
+        executor.submit(summarize_file_first, input_file, api_sources, custom_prompt): input_file
+        for input_file in input_files
+    }
+    for future in as_completed(future_to_file):
+        input_file = future_to_file[future]
+        try:
+            api, summary = future.result()
+            collector.add(input_file, api, summary=summary)
+        except Exception as e:
+            collector.add(input_file, '/'.join(api_sources), error=e)
+
+async def _summarize_files_async(collector, input_files, api_sources, custom_prompt=None, hedge=False):
+    """summarize_files 的异步实现，所有任务在一个事件循环中同时发出，中断时取消未完成的请求"""
+    async with AsyncClients(api_sources, API_CONFIG) as clients:
+        task_to_job = {}
+        for input_file in input_files:
+            if hedge:
+                # 每个文件一个任务，结果为 (最先返回的API源, 总结)
+                task = asyncio.ensure_future(summarize_file_first_async(clients, input_file, api_sources, custom_prompt))
+                task_to_job[task] = (input_file, None)
+                continue
+            for api in api_sources:
+                task = asyncio.ensure_future(summarize_file_async(clients, api, input_file, custom_prompt))
+                task_to_job[task] = (input_file, api)
+        
+        pending = set(task_to_job)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    input_file, api = task_to_job[task]
+                    if task.exception() is not None:
+                        collector.add(input_file, api or '/'.join(api_sources), error=task.exception())
+                    elif api is None:
+                        collector.add(input_file, *task.result())
+                    else:
+                        collector.add(input_file, api, summary=task.result())
+        finally:
+            # 中断（例如 Ctrl+C）时取消仍在等待的请求，不再继续发出新请求
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+def process_all_files(input_dir='outputs', output_dir='conclusion', api_sources=None, custom_prompt=None, incremental=False, state_file=STATE_FILE, engine='thread', stream=False, hedge=False):
     """
     处理指定目录下的所有cleaned_开头的文件
     
@@ -342,6 +1407,11 @@ def process_all_files(input_dir='outputs', output_dir='conclusion', api_sources=
         output_dir: 输出目录路径
         api_sources: API源列表
         custom_prompt: 自定义提示词
+        incremental: 是否增量处理，跳过内容未变化且已有总结的文件
+        state_file: 增量处理状态文件路径
+        engine: 并发方式，'thread' 使用线程池，'async' 使用 asyncio（需要安装aiohttp）
+        stream: 是否使用流式响应，边生成边写入总结文件
+        hedge: 每个文件只取最先返回的一个API源的总结
     """
     # 确保输出目录存在
     if not os.path.exists(output_dir):
@@ -354,6 +1424,14 @@ def process_all_files(input_dir='outputs', output_dir='conclusion', api_sources=
         print(f"在 {input_dir} 目录下未找到任何cleaned_开头的文件")
         return
     
+    state = None
+    if incremental:
+        state = load_state(state_file)
+        files = [f for f in files if needs_conclusion(os.path.join(input_dir, f), output_dir, api_sources or ['siliconflow'], state, hedge)]
+        if not files:
+            print("所有文件的总结都已是最新，无需调用API")
+            return
+    
     print(f"找到 {len(files)} 个文件需要处理:")
     for file in files:
         print(f"  - {file}")
@@ -373,24 +1451,21 @@ def process_all_files(input_dir='outputs', output_dir='conclusion', api_sources=
         print(f"错误: {e}")
         return
     
-    # 处理每个文件
-    success_count = 0
-    for file in files:
-        input_file = os.path.join(input_dir, file)
-        try:
-            output_file = generate_conclusion(input_file, output_dir, api_sources, custom_prompt)
-            if output_file:
-                print(f"成功处理文件: {file} -> {os.path.basename(output_file)}")
-                success_count += 1
-        except Exception as e:
-            print(f"处理文件 {file} 时出错: {e}")
+    # 所有文件和API源并发处理
+    input_files = [os.path.join(input_dir, file) for file in files]
+    success_count = summarize_files(input_files, output_dir, api_sources or ['siliconflow'], custom_prompt, state, state_file, engine, stream, hedge)
     
     print(f"总计: {success_count}/{len(files)} 个文件处理成功")
+    if SUMMARY_CACHE is not None and SUMMARY_CACHE.hits:
+        print(f"总结缓存命中 {SUMMARY_CACHE.hits} 次，未命中 {SUMMARY_CACHE.misses} 次")
 
 def main():
     """命令行入口函数"""
     global API_CONFIG
     global SYSTEM_PROMPT
+    global SUMMARY_CACHE
+    global CHUNK_TOKENS
+    global CHUNK_WORKERS
     
     parser = argparse.ArgumentParser(description='QQ聊天记录AI总结工具')
     parser.add_argument('-f', '--file', help='指定要处理的文件路径')
@@ -403,14 +1478,56 @@ def main():
     parser.add_argument('-c', '--config', action='store_true', help='配置API密钥')
     parser.add_argument('-m', '--model', help='指定要使用的SiliconFlow模型名称')
     parser.add_argument('-s', '--system-prompt', help='设置系统提示词，用于指导AI如何总结内容')
+    parser.add_argument('--incremental', action='store_true', help='增量处理，只总结新增或内容有变化的文件')
+    parser.add_argument('--state-file', default=STATE_FILE, help=f'增量处理状态文件路径，默认为{STATE_FILE}')
+    parser.add_argument('--chunk-tokens', type=int, default=CHUNK_TOKENS, help=f'每个请求中聊天内容的token预算，超过时分段总结后再合并，默认为{CHUNK_TOKENS}')
+    parser.add_argument('--workers', type=int, default=CHUNK_WORKERS, help=f'分段总结时每个API源并行请求的数量，默认为{CHUNK_WORKERS}')
+    parser.add_argument('--engine', default='thread', choices=['thread', 'async'], help='并发方式: thread 使用线程池（默认），async 使用asyncio，可同时保持大量请求（需要安装aiohttp）')
+    parser.add_argument('--stream', action='store_true', help='使用流式响应，边生成边写入总结文件，并记录首个token用时')
+    parser.add_argument('--hedge', action='store_true', help='只要一份总结: 先请求历史耗时最短的API源，超过其p95耗时仍未返回时追加请求下一个API源，取最先返回的结果')
+    parser.add_argument('--no-cache', action='store_true', help='不使用总结缓存，总是重新调用API')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help=f'总结缓存目录，默认为{CACHE_DIR}')
+    parser.add_argument('--db', nargs='?', const=MESSAGE_DB, help=f'直接总结消息数据库中的一段聊天记录（先用 message_store.py 导入），默认为{MESSAGE_DB}')
+    parser.add_argument('--group', help='使用 --db 时指定群名称或源文件名，数据库中只有一个群时可省略')
+    parser.add_argument('-t', '--date', help='使用 --db 时指定日期范围，格式为 "YYYY-MM-DD" 或 "YYYY-MM-DD=YYYY-MM-DD"')
+    parser.add_argument('--search', help='使用 --db 时只总结包含此关键词的消息')
+    parser.add_argument('--dry-run', action='store_true', help='只估算每个文件的请求数、token数、费用和耗时，不调用API')
+    parser.add_argument('--metrics-json', help='运行结束时将API请求延迟、状态码、重试和token用量等指标写入JSON报告')
+    parser.add_argument('--metrics-textfile', help='运行结束时将指标写入 Prometheus node-exporter 的 textfile（.prom 文件）')
+    parser.add_argument('--profile', nargs='?', const=PROFILE_DIR, help=f'分析各阶段的CPU耗时和内存分配，结果保存在此目录中并打印摘要，默认为{PROFILE_DIR}')
+    parser.add_argument('--profile-top', type=int, default=PROFILE_TOP, help=f'性能分析摘要中每一类列出的条目数，默认为{PROFILE_TOP}')
     
     args = parser.parse_args()
+    METRICS.write_at_exit(args.metrics_json, args.metrics_textfile, 'generate_conclusion')
+    atexit.register(LATENCY_HISTORY.save)
+    if args.profile:
+        start_profiler(args.profile, 'generate_conclusion', args.profile_top)
     
     # 如果用户选择配置API密钥
     if args.config:
         setup_api_keys()
         return
     
+    if args.chunk_tokens <= 0 or args.workers <= 0:
+        print("错误: --chunk-tokens 和 --workers 必须为正整数")
+        return
+    CHUNK_TOKENS = args.chunk_tokens
+    CHUNK_WORKERS = args.workers
+    if args.stream and args.engine == 'async':
+        print("错误: 流式输出暂不支持异步模式，请去掉 --engine async")
+        return
+    if args.stream and args.hedge:
+        print("错误: --hedge 模式不支持流式输出，请去掉 --stream")
+        return
+    if args.engine == 'async' and not AIOHTTP_AVAILABLE:
+        print("错误: 异步模式需要安装aiohttp，请运行: pip install aiohttp")
+        return
+    # 每个API源的连接池按并发请求数设置
+    configure_clients(max(API_CONFIG[api]['concurrency'] for api in args.api))
+    
+    # 总结缓存
+    SUMMARY_CACHE = None if args.no_cache else SummaryCache(args.cache_dir)
+    
     # 如果用户指定了系统提示词
     if args.system_prompt:
         SYSTEM_PROMPT = args.system_prompt
@@ -420,6 +1537,34 @@ def main():
     if args.model and 'siliconflow' in API_CONFIG:
         API_CONFIG['siliconflow']['model'] = args.model
     
+    if (args.search or args.group) and not args.db:
+        print("错误: --search 和 --group 只能与 --db 一起使用")
+        return
+    
+    if args.db:
+        # 从数据库中提取并清理，结果保存在 --input-dir 中，再按单个文件总结
+        try:
+            args.file = clean_chat_log_from_store(args.db, args.group, date_range=args.date, keyword=args.search, output_dir=args.input_dir)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"错误: {e}")
+            return
+    
+    if args.dry_run:
+        # 只做估算，不需要API密钥
+        if args.file:
+            if not os.path.exists(args.file):
+                print(f"错误: 文件 {args.file} 不存在")
+                return
+            input_files = [args.file]
+        else:
+            input_files = [os.path.join(args.input_dir, f) for f in sorted(os.listdir(args.input_dir))
+                           if f.startswith('cleaned_') and os.path.isfile(os.path.join(args.input_dir, f))]
+            if not input_files:
+                print(f"在 {args.input_dir} 目录下未找到任何cleaned_开头的文件")
+                return
+        dry_run(input_files, args.api, args.prompt)
+        return
+    
     # 检查API环境变量是否设置
     missing_keys = []
     for api in args.api:
@@ -449,9 +1594,12 @@ def main():
         if not os.path.exists(args.file):
             print(f"错误: 文件 {args.file} 不存在")
             return
-        generate_conclusion(args.file, args.output_dir, args.api, args.prompt)
+        if args.engine == 'async' or args.stream:
+            summarize_files([args.file], args.output_dir, args.api, args.prompt, engine=args.engine, stream=args.stream, hedge=args.hedge)
+        else:
+            generate_conclusion(args.file, args.output_dir, args.api, args.prompt, hedge=args.hedge)
     else:
-        process_all_files(args.input_dir, args.output_dir, args.api, args.prompt)
+        process_all_files(args.input_dir, args.output_dir, args.api, args.prompt, incremental=args.incremental, state_file=args.state_file, engine=args.engine, stream=args.stream, hedge=args.hedge)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
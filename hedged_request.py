@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from metrics import METRICS, summarize_samples
+
+# 各API源请求延迟历史的默认保存路径
+LATENCY_FILE = ".latency_history.json"
+
+# 每个API源（模型）保留的最近请求数
+HISTORY_SIZE = 200
+
+# 采样数少于此值时不使用历史延迟，改用 api_keys.ini 中的延迟估计
+MIN_SAMPLES = 10
+
+class HedgeCancelled(Exception):
+    """其他API源已经返回总结，本API源的请求不再发出"""
+
+class LatencyHistory:
+    """
+    各API源成功请求的耗时历史，保存在JSON文件中供之后的运行使用
+
+    文件格式为 {API源: {模型: [最近 HISTORY_SIZE 次请求的秒数]}}，同一API源换用模型后分别统计。
+    """
+
+    def __init__(self, path=LATENCY_FILE, size=HISTORY_SIZE):
+        """
+        Args:
+            path: 历史文件路径
+            size: 每个API源（模型）保留的最近请求数
+        """
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._changed = False
+        self._history = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._history = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"警告: 无法读取延迟历史 '{path}'，将重新开始记录: {e}")
+                self._history = {}
+
+    def record(self, api, model, seconds):
+        """记录一次成功请求的耗时"""
+        with self._lock:
+            samples = self._history.setdefault(api, {}).setdefault(model, [])
+            samples.append(round(seconds, 3))
+            del samples[:-self.size]
+            self._changed = True
+
+    def percentile(self, api, model, p):
+        """
+        获取历史耗时的百分位数
+
+        Args:
+            api: API源名称
+            model: 模型名称
+            p: 百分位，如 50、95
+
+        Returns:
+            秒数，采样数少于 MIN_SAMPLES 时为None
+        """
+        with self._lock:
+            samples = list(self._history.get(api, {}).get(model, []))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return summarize_samples(samples).get(f"p{p}")
+
+    def save(self):
+        """保存历史（先写临时文件再替换），没有新记录时不写入"""
+        with self._lock:
+            if not self._changed:
+                return
+            tmp_file = f"{self.path}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._history, f, ensure_ascii=False)
+            os.replace(tmp_file, self.path)
+            self._changed = False
+
+def first_response(run, candidates, delay, verbose=True):
+    """
+    按顺序向候选API源发出请求，取最先成功的结果（hedged request）
+
+    先只请求第一个候选；等待 delay(候选) 秒仍未返回，或者返回失败时，再请求下一个候选，
+    已发出的请求继续等待。任何一个成功后设置取消标志，其余任务在发出下一次请求前停止
+    （已经发出的HTTP请求无法中断，其结果被丢弃）。
+
+    Args:
+        run: 任务函数 run(候选, cancelled)，cancelled 为 threading.Event，设置后应尽快抛出 HedgeCancelled
+        candidates: 候选API源列表，按预计耗时从快到慢排列
+        delay: 函数 delay(候选)，返回请求下一个候选前等待该候选的秒数
+        verbose: 是否打印追加请求的信息
+
+    Returns:
+        (候选, 结果)
+
+    Raises:
+        ValueError: 所有候选都失败
+    """
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max(1, len(candidates)))
+    remaining = list(candidates)
+    future_to_name = {}
+    pending = set()
+    errors = []
+    deadline = 0.0
+    # 上一个请求失败时立即请求下一个候选
+    failed = False
+    try:
+        while remaining or pending:
+            if remaining and (not pending or failed or time.monotonic() >= deadline):
+                name = remaining.pop(0)
+                if future_to_name:
+                    reason = 'error' if failed else 'slow'
+                    METRICS.inc('hedged_requests', api=name, reason=reason)
+                    if verbose and reason == 'slow':
+                        print(f"{', '.join(future_to_name[f] for f in pending)} 超过预计耗时仍未返回，同时请求 {name}")
+                failed = False
+                future = executor.submit(run, name, cancelled)
+                future_to_name[future] = name
+                pending.add(future)
+                deadline = time.monotonic() + delay(name)
+                continue
+
+            timeout = max(0.0, deadline - time.monotonic()) if remaining else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = future_to_name[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"调用 {name} API时出错：{e}")
+                    errors.append(f"{name}: {e}")
+                    failed = True
+                    continue
+                METRICS.inc('first_responses', api=name, requested=str(len(future_to_name)))
+                return name, result
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    raise ValueError(f"所有API源都未能返回总结（{'; '.join(errors)}）")
+
+async def first_response_async(run, candidates, delay, verbose=True):
+    """
+    first_response 的异步版本，取得结果后取消其余仍在进行的请求
+
+    Args:
+        run: 协程函数 run(候选)
+        candidates: 候选API源列表，按预计耗时从快到慢排列
+        delay: 函数 delay(候选)，返回请求下一个候选前等待该候选的秒数
+        verbose: 是否打印追加请求的信息
+
+    Returns:
+        (候选, 结果)
+
+    Raises:
+        ValueError: 所有候选都失败
+    """
+    loop = asyncio.get_running_loop()
+    remaining = list(candidates)
+    task_to_name = {}
+    pending = set()
+    errors = []
+    deadline = 0.0
+    # 上一个请求失败时立即请求下一个候选
+    failed = False
+    try:
+        while remaining or pending:
+            if remaining and (not pending or failed or loop.time() >= deadline):
+                name = remaining.pop(0)
+                if task_to_name:
+                    reason = 'error' if failed else 'slow'
+                    METRICS.inc('hedged_requests', api=name, reason=reason)
+                    if verbose and reason == 'slow':
+                        print(f"{', '.join(task_to_name[t] for t in pending)} 超过预计耗时仍未返回，同时请求 {name}")
+                failed = False
+                task = asyncio.ensure_future(run(name))
+                task_to_name[task] = name
+                pending.add(task)
+                deadline = loop.time() + delay(name)
+                continue
+
+            timeout = max(0.0, deadline - loop.time()) if remaining else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = task_to_name[task]
+                if task.exception() is not None:
+                    print(f"调用 {name} API时出错：{task.exception()}")
+                    errors.append(f"{name}: {task.exception()}")
+                    failed = True
+                    continue
+                METRICS.inc('first_responses', api=name, requested=str(len(task_to_name)))
+                return name, task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    raise ValueError(f"所有API源都未能返回总结（{'; '.join(errors)}）")
@@ -0,0 +1,461 @@
+import os
+import json
+import math
+import time
+import queue
+import atexit
+import argparse
+import threading
+from contextlib import ExitStack
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from date_index import load_date_index
+from filter_engine import load_filter_engine
+from message_store import MESSAGE_DB
+from process_chat_logs import (
+    build_output_path, clean_chat_log, clean_chat_log_from_store, get_last_message_date_from_file,
+    parse_date_range, query_store, store_output_path,
+)
+from provider_client import configure_clients
+from summary_cache import CACHE_DIR, SummaryCache
+from metrics import METRICS
+import generate_conclusion
+from generate_conclusion import API_FUNCTIONS, summarize_chat_content, write_conclusion
+
+# 等待执行的任务数上限，队列已满时新任务返回429
+QUEUE_SIZE = 32
+
+# 同时执行任务的线程数（每个总结任务内部还会按API源并发请求，受各API源的限流器控制）
+WORKERS = 4
+
+# 保留多少个已结束的任务供查询结果，超出时丢弃最早结束的
+JOB_HISTORY = 1000
+
+# 请求中 wait 参数（等待任务结束的秒数）的上限
+MAX_WAIT = 300
+
+# 各类任务接受的参数
+CLEAN_PARAMS = {'file', 'group', 'date', 'search', 'exclude_senders', 'dedup'}
+SUMMARIZE_PARAMS = CLEAN_PARAMS | {'input', 'apis', 'prompt', 'hedge'}
+
+class JobError(Exception):
+    """任务参数无效，返回400"""
+
+class QueueFull(Exception):
+    """任务队列已满，返回429"""
+
+class Job:
+    """一个清理或总结任务及其状态: queued → running → done/failed"""
+
+    def __init__(self, job_id, kind, params, key):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.key = key
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # 合并到此任务的相同请求数（不含第一个）
+        self.coalesced = 0
+        self.done = threading.Event()
+
+    def to_dict(self):
+        info = {
+            "id": self.id, "kind": self.kind, "status": self.status, "params": self.params,
+            "created": datetime.fromtimestamp(self.created).strftime('%Y-%m-%d %H:%M:%S'),
+            "coalesced": self.coalesced,
+        }
+        if self.started is not None:
+            info["queued_seconds"] = round(self.started - self.created, 3)
+        if self.finished is not None:
+            info["run_seconds"] = round(self.finished - self.started, 3)
+        if self.status == 'done':
+            info["result"] = self.result
+        elif self.status == 'failed':
+            info["error"] = self.error
+        return info
+
+class JobQueue:
+    """
+    有界任务队列和工作线程池
+
+    参数完全相同的任务在排队或执行期间只执行一次，之后的请求直接得到同一个任务。
+    """
+
+    def __init__(self, runners, workers=WORKERS, queue_size=QUEUE_SIZE, history=JOB_HISTORY):
+        """
+        Args:
+            runners: {任务类型: 执行函数 run(params)}，返回值作为任务结果（需可序列化为JSON）
+            workers: 工作线程数
+            queue_size: 等待执行的任务数上限
+            history: 保留的已结束任务数
+        """
+        self.runners = runners
+        self.workers = workers
+        self.history = history
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._in_flight = {}
+        self._finished = []
+        self._next_id = 0
+        # 最近任务的平均执行时间，用于估计429响应中的 retry-after
+        self._average_seconds = 1.0
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, kind, params):
+        """
+        提交任务，与排队或执行中的任务参数相同时直接返回该任务
+
+        Returns:
+            (任务, 是否为合并的已有任务)
+
+        Raises:
+            QueueFull: 队列已满
+        """
+        key = (kind, json.dumps(params, sort_keys=True, ensure_ascii=False))
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None:
+                job.coalesced += 1
+                METRICS.inc('jobs', kind=kind, result='coalesced')
+                return job, True
+            self._next_id += 1
+            job = Job(f"{kind}-{self._next_id}", kind, params, key)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                METRICS.inc('jobs', kind=kind, result='rejected')
+                raise QueueFull()
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+        METRICS.inc('jobs', kind=kind, result='queued')
+        return job, False
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def retry_after(self):
+        """按排队的任务数和平均执行时间估计队列空出位置的秒数"""
+        return max(1, math.ceil(self._average_seconds * self._queue.qsize() / self.workers))
+
+    def status(self):
+        with self._lock:
+            running = sum(1 for job in self._in_flight.values() if job.status == 'running')
+        return {"queued": self._queue.qsize(), "queue_size": self._queue.maxsize,
+                "running": running, "workers": self.workers}
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.started = time.time()
+            job.status = 'running'
+            try:
+                job.result = self.runners[job.kind](job.params)
+                job.status = 'done'
+            except Exception as e:
+                print(f"任务 {job.id} 失败：{e}")
+                job.error = str(e)
+                job.status = 'failed'
+            job.finished = time.time()
+            seconds = job.finished - job.started
+            METRICS.inc('jobs', kind=job.kind, result=job.status)
+            METRICS.observe('job_duration', seconds, kind=job.kind)
+            with self._lock:
+                self._average_seconds = 0.8 * self._average_seconds + 0.2 * seconds
+                del self._in_flight[job.key]
+                self._finished.append(job.id)
+                while len(self._finished) > self.history:
+                    del self._jobs[self._finished.pop(0)]
+            job.done.set()
+
+class PathLocks:
+    """按文件路径加锁：参数不同但写同一个清理结果（和总结文件）的任务依次执行，不会读到其他任务写了一半或覆盖的内容"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def get(self, path):
+        key = os.path.realpath(path)
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+def _inside(path, directory):
+    """路径是否在目录之内（解析符号链接后）"""
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    return os.path.commonpath([path, directory]) == directory
+
+class JobService:
+    """清理和总结任务的执行函数，只允许读取指定目录中的文件"""
+
+    def __init__(self, input_dir='inputs', clean_dir='outputs', output_dir='conclusion', db_path=MESSAGE_DB,
+                 filter_file='filter_keywords.txt', api_sources=None):
+        """
+        Args:
+            input_dir: 聊天记录所在的目录，clean 任务的 file 和 summarize 任务的 input 必须在此目录中
+            clean_dir: 清理结果目录，所有任务的清理结果都写入此目录，summarize 任务的 file 必须在此目录中
+            output_dir: 总结输出目录
+            db_path: 消息数据库路径（见 message_store.py），按群名称提取聊天记录时使用
+            filter_file: 过滤关键词配置文件路径
+            api_sources: 未指定 apis 时使用的API源列表
+        """
+        self.input_dir = input_dir
+        self.clean_dir = clean_dir
+        self.output_dir = output_dir
+        self.db_path = db_path
+        self.filter_file = filter_file
+        self.api_sources = api_sources or ['siliconflow']
+        self._path_locks = PathLocks()
+
+    def validate(self, kind, params):
+        """
+        检查任务参数
+
+        Raises:
+            JobError: 参数无效
+        """
+        if not isinstance(params, dict):
+            raise JobError("请求体应为JSON对象")
+        allowed = CLEAN_PARAMS if kind == 'clean' else SUMMARIZE_PARAMS
+        unknown = set(params) - allowed
+        if unknown:
+            raise JobError(f"未知的参数: {', '.join(sorted(unknown))}")
+        sources = [name for name in ('file', 'input', 'group') if params.get(name)]
+        if len(sources) != 1:
+            raise JobError(f"需要且只能指定 {'、'.join(name for name in ('file', 'input', 'group') if name in allowed)} 中的一个")
+        if params.get('file') and kind == 'clean':
+            self._check_path(params['file'], self.input_dir)
+        elif params.get('file'):
+            self._check_path(params['file'], self.clean_dir)
+        elif params.get('input'):
+            self._check_path(params['input'], self.input_dir)
+        if params.get('search') and not params.get('group'):
+            # 与命令行相同，关键词检索只用于消息数据库
+            raise JobError("search 只能与 group 一起使用")
+        if params.get('date'):
+            try:
+                parse_date_range(params['date'])
+            except ValueError:
+                raise JobError(f"日期范围格式应为 YYYY-MM-DD 或 YYYY-MM-DD=YYYY-MM-DD，实际为 {params['date']}")
+        senders = params.get('exclude_senders')
+        if senders is not None and (not isinstance(senders, list) or not all(isinstance(sender, str) for sender in senders)):
+            raise JobError("exclude_senders 应为昵称或QQ号的列表")
+        apis = params.get('apis')
+        if apis is not None and (not isinstance(apis, list) or not apis or any(api not in API_FUNCTIONS for api in apis)):
+            raise JobError(f"apis 应为API源列表，可用: {', '.join(API_FUNCTIONS)}")
+
+    def _check_path(self, path, directory):
+        if not isinstance(path, str) or not _inside(path, directory):
+            raise JobError(f"文件必须位于 {directory} 目录中: {path}")
+        if not os.path.isfile(path):
+            raise JobError(f"文件不存在: {path}")
+
+    def _clean_file(self, params, locks):
+        """
+        按参数清理聊天记录，清理结果写入 clean_dir
+
+        Args:
+            params: 任务参数
+            locks: ExitStack，写入前锁定清理结果的路径，直到任务结束才释放
+
+        Returns:
+            清理结果的文件路径
+        """
+        exclude_senders = set(params.get('exclude_senders') or [])
+        dedup = bool(params.get('dedup'))
+        if params.get('group'):
+            # 先确定输出路径并加锁再写入；之后按确定的日期范围提取，避免期间导入了新消息时内容与文件名不一致
+            group_name, start_date, end_date, _ = query_store(self.db_path, params['group'], params.get('date'), params.get('search'))
+            output_file = store_output_path(group_name, start_date, end_date, params.get('search'), self.clean_dir)
+            locks.enter_context(self._path_locks.get(output_file))
+            date_range = f"{start_date.strftime('%Y-%m-%d')}={end_date.strftime('%Y-%m-%d')}"
+            return clean_chat_log_from_store(self.db_path, params['group'], output_file, filter_file=self.filter_file, date_range=date_range,
+                                             keyword=params.get('search'), exclude_senders=exclude_senders, dedup=dedup)
+        input_file = params.get('input') or params['file']
+        # 与 clean_chat_log 相同，未指定日期时使用最后一条消息的日期
+        index = load_date_index(input_file)
+        if params.get('date') or index is not None:
+            start_date, end_date = parse_date_range(params.get('date'), index=index)
+        else:
+            start_date = end_date = get_last_message_date_from_file(input_file)
+        output_file = build_output_path(input_file, start_date, end_date, self.clean_dir)
+        locks.enter_context(self._path_locks.get(output_file))
+        date_range = f"{start_date.strftime('%Y-%m-%d')}={end_date.strftime('%Y-%m-%d')}"
+        clean_chat_log(input_file, output_file, filter_file=self.filter_file, date_range=date_range,
+                       exclude_senders=exclude_senders, dedup=dedup)
+        return output_file
+
+    def clean(self, params):
+        """clean 任务: 清理聊天记录文件或从消息数据库提取一段聊天记录"""
+        with ExitStack() as locks:
+            return {"output_file": self._clean_file(params, locks)}
+
+    def summarize(self, params):
+        """
+        summarize 任务: 总结清理结果（或先清理聊天记录），写入总结文件并返回各API源的总结
+
+        总结文件名由清理结果的文件名决定，从清理到写完总结一直锁定清理结果的路径。
+        """
+        with ExitStack() as locks:
+            if params.get('file'):
+                input_file = params['file']
+                locks.enter_context(self._path_locks.get(input_file))
+            else:
+                input_file = self._clean_file(params, locks)
+            summaries = summarize_chat_content(input_file, params.get('apis') or self.api_sources, params.get('prompt'), bool(params.get('hedge')))
+            if not summaries:
+                raise ValueError("未能从任何API源获取总结结果")
+            conclusion = write_conclusion(input_file, self.output_dir, summaries)
+        return {"input_file": input_file, "conclusion": conclusion, "summaries": summaries}
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # 不在每个请求后打印访问日志
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        jobs = self.server.jobs
+        if url.path == '/health':
+            self._send_json(200, jobs.status())
+        elif url.path == '/metrics':
+            self._send_text(200, METRICS.prometheus('job_server'), 'text/plain; version=0.0.4')
+        elif url.path.startswith('/jobs/'):
+            job = jobs.get(url.path[len('/jobs/'):])
+            if job is None:
+                self._send_json(404, {"error": "任务不存在或已过期"})
+                return
+            self._wait(job, url)
+            self._send_json(200, job.to_dict())
+        else:
+            self._send_json(404, {"error": f"未知的路径 {url.path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        kind = url.path.strip('/')
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length)
+        if kind not in self.server.jobs.runners:
+            self._send_json(404, {"error": f"未知的路径 {url.path}，可用: /clean、/summarize"})
+            return
+        try:
+            params = json.loads(body or b'{}')
+        except ValueError as e:
+            self._send_json(400, {"error": f"无效的JSON: {e}"})
+            return
+        try:
+            self.server.service.validate(kind, params)
+        except JobError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            job, coalesced = self.server.jobs.submit(kind, params)
+        except QueueFull:
+            retry_after = self.server.jobs.retry_after()
+            self._send_json(429, {"error": "任务队列已满，请稍后重试", "retry_after": retry_after}, {'retry-after': str(retry_after)})
+            return
+        self._wait(job, url)
+        status = 200 if job.done.is_set() else 202
+        self._send_json(status, job.to_dict(), {'location': f"/jobs/{job.id}"})
+
+    def _wait(self, job, url):
+        """请求中带有 wait=秒数 时，等待任务结束（最多 MAX_WAIT 秒）"""
+        try:
+            wait = float(parse_qs(url.query).get('wait', ['0'])[0])
+        except ValueError:
+            wait = 0
+        if wait > 0:
+            job.done.wait(min(wait, MAX_WAIT))
+
+    def _send_json(self, status, payload, headers=None):
+        self._send_text(status, json.dumps(payload, ensure_ascii=False), 'application/json', headers)
+
+    def _send_text(self, status, text, content_type, headers=None):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', content_type)
+        self.send_header('content-length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+def create_server(service, host='127.0.0.1', port=8780, workers=WORKERS, queue_size=QUEUE_SIZE):
+    """
+    创建任务服务
+
+    Args:
+        service: JobService 对象
+        host: 监听地址
+        port: 监听端口，0表示自动选择空闲端口
+        workers: 工作线程数
+        queue_size: 等待执行的任务数上限
+
+    Returns:
+        ThreadingHTTPServer 对象，调用 serve_forever 开始服务
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    server.jobs = JobQueue({'clean': service.clean, 'summarize': service.summarize}, workers, queue_size)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='本地HTTP任务服务，在常驻进程中执行清理和总结任务，供聊天机器人等程序调用')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址，默认为127.0.0.1')
+    parser.add_argument('--port', type=int, default=8780, help='监听端口，默认为8780')
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS, help=f'同时执行任务的线程数，默认为{WORKERS}')
+    parser.add_argument('-q', '--queue-size', type=int, default=QUEUE_SIZE, help=f'等待执行的任务数上限，队列已满时返回429，默认为{QUEUE_SIZE}')
+    parser.add_argument('-a', '--api', nargs='+', default=['siliconflow'],
+                        choices=['siliconflow', 'openai', 'anthropic'],
+                        help='总结任务未指定 apis 时使用的API源，可多选')
+    parser.add_argument('-m', '--model', help='指定要使用的SiliconFlow模型名称')
+    parser.add_argument('-k', '--keywords', default='filter_keywords.txt', help='过滤关键词配置文件路径')
+    parser.add_argument('--input-dir', default='inputs', help='聊天记录目录，只能清理此目录中的文件，默认为inputs')
+    parser.add_argument('--clean-dir', default='outputs', help='清理结果目录，只能总结此目录中的文件，默认为outputs')
+    parser.add_argument('-o', '--output-dir', default='conclusion', help='总结文件输出目录，默认为conclusion')
+    parser.add_argument('--db', default=MESSAGE_DB, help=f'按群名称提取聊天记录时使用的消息数据库，默认为{MESSAGE_DB}')
+    parser.add_argument('--no-cache', action='store_true', help='不使用总结缓存，总是重新调用API')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help=f'总结缓存目录，默认为{CACHE_DIR}')
+
+    args = parser.parse_args()
+    if args.workers <= 0 or args.queue_size <= 0:
+        print("错误: --workers 和 --queue-size 必须大于0")
+        return
+    generate_conclusion.SUMMARY_CACHE = None if args.no_cache else SummaryCache(args.cache_dir)
+    if args.model and 'siliconflow' in generate_conclusion.API_CONFIG:
+        generate_conclusion.API_CONFIG['siliconflow']['model'] = args.model
+    configure_clients(max(config['concurrency'] for config in generate_conclusion.API_CONFIG.values()))
+    atexit.register(generate_conclusion.LATENCY_HISTORY.save)
+    # 预先编译过滤规则，第一个任务不需要等待
+    load_filter_engine(args.keywords)
+
+    service = JobService(args.input_dir, args.clean_dir, args.output_dir, args.db, args.keywords, args.api)
+    try:
+        server = create_server(service, args.host, args.port, args.workers, args.queue_size)
+    except OSError as e:
+        print(f"错误: 无法监听 {args.host}:{args.port}: {e}")
+        return
+    host, port = server.server_address[:2]
+    print(f"任务服务已启动: http://{host}:{port}（POST /clean、POST /summarize、GET /jobs/任务ID），按 Ctrl+C 停止")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print("任务服务已停止")
+
+if __name__ == "__main__":
+    main()
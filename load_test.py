@@ -0,0 +1,191 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+from contextlib import redirect_stdout
+from datetime import timedelta
+
+from mock_provider import MockProvider, add_mock_arguments, mock_config_from_args
+from synthetic_export import generate_export, parse_size
+from process_chat_logs import clean_chat_log
+from provider_client import configure_clients
+from async_engine import AIOHTTP_AVAILABLE
+from metrics import summarize_samples
+import generate_conclusion
+
+# 合成聊天记录的起始日期和天数（与 benchmark.py 相同）
+from benchmark import START_DATE, DAYS
+
+def prepare_inputs(input_dir, files, size, seed=0):
+    """
+    生成 files 个合成聊天记录并清理，作为 process_all_files 的输入
+
+    Args:
+        input_dir: 清理后文件的保存目录
+        files: 文件数量
+        size: 每个原始聊天记录的大小（字节）
+        seed: 随机种子，第 i 个文件使用 seed + i
+    """
+    end_date = START_DATE + timedelta(days=DAYS - 1)
+    date_range = f"{START_DATE:%Y-%m-%d}={end_date:%Y-%m-%d}"
+    raw_file = os.path.join(input_dir, 'raw.tmp')
+    with redirect_stdout(io.StringIO()):
+        for i in range(files):
+            generate_export(raw_file, size, seed + i, DAYS, START_DATE)
+            clean_chat_log(raw_file, os.path.join(input_dir, f"cleaned_loadtest{i}_{date_range}.txt"), date_range=date_range, use_index=False)
+    os.remove(raw_file)
+
+def run_load_test(provider, api_sources, input_dir, output_dir, concurrency=4, engine='thread', stream=False, verbose=False):
+    """
+    将各API源的 api_url 指向模拟服务，运行一次 process_all_files 并统计结果
+
+    Args:
+        provider: 正在运行的 MockProvider
+        api_sources: API源列表
+        input_dir: 清理后文件所在目录
+        output_dir: 总结文件输出目录
+        concurrency: 每个API源的并发请求数
+        engine: 'thread' 或 'async'
+        stream: 是否使用流式响应
+        verbose: 是否显示 process_all_files 的输出
+
+    Returns:
+        结果字典
+    """
+    for api in api_sources:
+        generate_conclusion.API_CONFIG[api].update(
+            api_url=provider.url(api), api_key='mock', concurrency=concurrency, rpm=0, tpm=0,
+            max_request_tokens=0, max_request_cost=0,
+        )
+    configure_clients(concurrency)
+    # 每次都实际发出请求
+    generate_conclusion.SUMMARY_CACHE = None
+
+    # 记录每个 (文件, API源) 任务从开始到返回的耗时，包括分段、重试和限流等待
+    job_latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def record(start, error):
+        with lock:
+            job_latencies.append(time.perf_counter() - start)
+            if error is not None:
+                failures.append(repr(error))
+
+    summarize_file = generate_conclusion.summarize_file_with_api
+    summarize_file_async = generate_conclusion.summarize_file_async
+
+    def timed_summarize_file(*args, **kwargs):
+        start, error = time.perf_counter(), None
+        try:
+            return summarize_file(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            record(start, error)
+
+    async def timed_summarize_file_async(*args, **kwargs):
+        start, error = time.perf_counter(), None
+        try:
+            return await summarize_file_async(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            record(start, error)
+
+    generate_conclusion.summarize_file_with_api = timed_summarize_file
+    generate_conclusion.summarize_file_async = timed_summarize_file_async
+    start = time.perf_counter()
+    try:
+        output = sys.stdout if verbose else io.StringIO()
+        with redirect_stdout(output):
+            generate_conclusion.process_all_files(input_dir, output_dir, api_sources, engine=engine, stream=stream)
+    finally:
+        elapsed = time.perf_counter() - start
+        generate_conclusion.summarize_file_with_api = summarize_file
+        generate_conclusion.summarize_file_async = summarize_file_async
+
+    requests_count = sum(provider.statuses.values())
+    return {
+        'seconds': round(elapsed, 3),
+        'jobs': len(job_latencies),
+        'failed_jobs': len(failures),
+        'jobs_per_s': round(len(job_latencies) / elapsed, 3) if elapsed else None,
+        'requests': requests_count,
+        'requests_per_s': round(requests_count / elapsed, 3) if elapsed else None,
+        'statuses': {str(status): count for status, count in provider.statuses.items()},
+        'job_latency': summarize_samples(job_latencies),
+        'request_latency': summarize_samples(provider.latencies),
+        'errors': failures[:10],
+    }
+
+def format_latency(name, summary):
+    """生成延迟统计的说明文字"""
+    if not summary['count']:
+        return f"{name}: 无"
+    return (f"{name}: {summary['count']} 个，平均 {summary['mean']:.3f} s，p50 {summary['p50']:.3f} s，"
+            f"p95 {summary['p95']:.3f} s，p99 {summary['p99']:.3f} s，最长 {summary['max']:.3f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description='使用本地模拟服务对 generate_conclusion 进行压力测试，统计吞吐量和延迟分位数')
+    parser.add_argument('-a', '--api', nargs='+', default=['siliconflow'], choices=['siliconflow', 'openai', 'anthropic'], help='要测试的API源，默认为siliconflow')
+    parser.add_argument('-n', '--files', type=int, default=20, help='合成的聊天记录文件数量，默认为20')
+    parser.add_argument('--file-size', default='200KB', help='每个原始聊天记录的大小，默认为200KB')
+    parser.add_argument('--concurrency', type=int, default=8, help='每个API源的并发请求数，默认为8')
+    parser.add_argument('--engine', default='thread', choices=['thread', 'async'], help='并发方式，默认为thread')
+    parser.add_argument('--stream', action='store_true', help='使用流式响应')
+    parser.add_argument('-o', '--output', help='将结果保存为JSON文件')
+    parser.add_argument('-v', '--verbose', action='store_true', help='显示总结过程的输出')
+    add_mock_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.files <= 0 or args.concurrency <= 0:
+        print("错误: --files 和 --concurrency 必须为正整数")
+        return 1
+    if args.engine == 'async' and not AIOHTTP_AVAILABLE:
+        print("错误: 异步模式需要安装aiohttp，请运行: pip install aiohttp")
+        return 1
+    try:
+        size = parse_size(args.file_size)
+        config = mock_config_from_args(args)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return 1
+
+    work_dir = tempfile.mkdtemp(prefix='load_test_')
+    input_dir = os.path.join(work_dir, 'outputs')
+    output_dir = os.path.join(work_dir, 'conclusion')
+    os.makedirs(input_dir)
+    try:
+        print(f"生成 {args.files} 个测试文件...")
+        prepare_inputs(input_dir, args.files, size, args.seed or 0)
+        with MockProvider(config) as provider:
+            print(f"模拟服务: {provider.base_url}，延迟分布 {config.latency.spec}")
+            result = run_load_test(provider, args.api, input_dir, output_dir, args.concurrency, args.engine, args.stream, args.verbose)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"耗时 {result['seconds']:.2f} 秒，完成 {result['jobs']} 个任务（失败 {result['failed_jobs']} 个），{result['jobs_per_s']} 个/秒")
+    print(f"请求 {result['requests']} 次，{result['requests_per_s']} 次/秒，状态码: {result['statuses']}")
+    print(format_latency("任务延迟", result['job_latency']))
+    print(format_latency("请求延迟", result['request_latency']))
+    for error in result['errors']:
+        print(f"  失败: {error}")
+
+    if args.output:
+        result['config'] = vars(args)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存至: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+import re
+import bisect
+from array import array
+from datetime import datetime, timedelta
+
+from date_index import load_date_index
+
+# 消息头（如 2025-03-18 10:08:26 昵称(QQ号)），与 process_chat_logs.clean_content 删除的消息头一致
+HEADER_PATTERN = re.compile(r'^(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2}) ([^\n]+)$', re.MULTILINE)
+
+# 发送者的QQ号写在昵称后的括号中；部分导出使用 <邮箱> 的形式，此时QQ号记为0
+SENDER_PATTERN = re.compile(r'^(.*?)\s*(?:\((\d+)\)|<[^>]*>)?\s*$')
+
+_EPOCH = datetime(1970, 1, 1)
+
+# 每一天0点的时间戳缓存: {(年, 月, 日): 秒数}
+_DAY_SECONDS = {}
+
+def _day_seconds(year, month, day):
+    """获取某一天0点距1970-01-01的秒数（不涉及时区，按聊天记录中的时间计算）"""
+    key = (year, month, day)
+    seconds = _DAY_SECONDS.get(key)
+    if seconds is None:
+        seconds = _DAY_SECONDS[key] = (datetime(year, month, day) - _EPOCH).days * 86400
+    return seconds
+
+def to_timestamp(date):
+    """将 datetime 转换为 MessageLog 中使用的时间戳（秒）"""
+    return int((date - _EPOCH).total_seconds())
+
+def from_timestamp(timestamp):
+    """将 MessageLog 中的时间戳（秒）转换为 datetime"""
+    return _EPOCH + timedelta(seconds=timestamp)
+
+def parse_sender(sender):
+    """
+    拆分消息头中的发送者
+
+    Args:
+        sender: 消息头中时间之后的部分，如 "Q群管家(11111111111)"
+
+    Returns:
+        (昵称, QQ号): QQ号未知时为0
+    """
+    match = SENDER_PATTERN.match(sender)
+    return match.group(1), int(match.group(2) or 0)
+
+def parse_header(line):
+    """
+    解析一行消息头
+
+    Args:
+        line: 文本行
+
+    Returns:
+        (时间戳, 昵称, QQ号)；不是消息头时返回None
+    """
+    match = HEADER_PATTERN.match(line.rstrip('\n'))
+    if not match:
+        return None
+    year, month, day, hour, minute, second = map(int, match.groups()[:6])
+    name, qq = parse_sender(match.group(7))
+    return _day_seconds(year, month, day) + hour * 3600 + minute * 60 + second, name, qq
+
+class Message:
+    """MessageLog 中一条消息的只读视图"""
+
+    __slots__ = ('timestamp', 'sender', 'qq', 'body')
+
+    def __init__(self, timestamp, sender, qq, body):
+        self.timestamp = timestamp
+        self.sender = sender
+        self.qq = qq
+        self.body = body
+
+    @property
+    def time(self):
+        """消息时间（datetime对象）"""
+        return from_timestamp(self.timestamp)
+
+    def __repr__(self):
+        return f"Message({self.time:%Y-%m-%d %H:%M:%S}, {self.sender!r}, {self.qq}, {self.body[:20]!r})"
+
+class MessageLog:
+    """
+    解析后的聊天记录
+
+    每条消息的时间戳、发送者、QQ号和在原文中的位置分别存放在紧凑的数组中，
+    发送者昵称只保存一份（字符串驻留表），消息正文不复制，按位置从原文中截取。
+    每条消息约占44字节，数百万条消息也只需一百多MB内存（另加原文本身）。
+    """
+
+    def __init__(self, text, preamble_end=0):
+        """
+        Args:
+            text: 聊天记录原文（换行符为 \\n）
+            preamble_end: 第一条消息之前的内容（文件头）的结束位置
+        """
+        self.text = text
+        self.preamble_end = preamble_end
+        self.timestamps = array('q')
+        self.senders = array('I')
+        self.qq_numbers = array('q')
+        self.starts = array('Q')
+        self.body_starts = array('Q')
+        self.ends = array('Q')
+        self.names = []
+        self._name_ids = {}
+        self._sorted = True
+
+    @classmethod
+    def parse(cls, text):
+        """
+        解析聊天记录文本
+
+        Args:
+            text: 聊天记录原文
+
+        Returns:
+            MessageLog 对象
+        """
+        matches = HEADER_PATTERN.finditer(text)
+        log = cls(text)
+        previous = None
+        for match in matches:
+            start = match.start()
+            if previous is None:
+                log.preamble_end = start
+            else:
+                log.ends.append(start)
+            year, month, day, hour, minute, second = map(int, match.groups()[:6])
+            name, qq = parse_sender(match.group(7))
+            timestamp = _day_seconds(year, month, day) + hour * 3600 + minute * 60 + second
+            body_start = match.end() + 1 if match.end() < len(text) else match.end()
+            log._append(timestamp, name, qq, start, body_start)
+            previous = timestamp
+        if previous is None:
+            log.preamble_end = len(text)
+        else:
+            log.ends.append(len(text))
+        return log
+
+    @classmethod
+    def parse_file(cls, input_file, start_date=None, end_date=None, use_index=True):
+        """
+        解析聊天记录文件，指定日期范围时通过日期索引只读取范围内的内容
+
+        Args:
+            input_file: 聊天记录文件路径
+            start_date: 开始日期，为None时解析整个文件
+            end_date: 结束日期
+            use_index: 是否使用日期索引（见 date_index.py）
+
+        Returns:
+            MessageLog 对象
+        """
+        index = load_date_index(input_file) if use_index and start_date is not None else None
+        if index is not None:
+            return cls.parse(index.read(start_date, end_date))
+
+        with open(input_file, 'r', encoding='utf-8') as f:
+            log = cls.parse(f.read())
+        if start_date is None:
+            return log
+        return log.select(log.between(start_date, end_date))
+
+    def _append(self, timestamp, name, qq, start, body_start):
+        sender = self._name_ids.get(name)
+        if sender is None:
+            sender = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            self._sorted = False
+        self.timestamps.append(timestamp)
+        self.senders.append(sender)
+        self.qq_numbers.append(qq)
+        self.starts.append(start)
+        self.body_starts.append(body_start)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, i):
+        return Message(self.timestamps[i], self.names[self.senders[i]], self.qq_numbers[i], self.body(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def body(self, i):
+        """第 i 条消息的正文（不含消息头）"""
+        return self.text[self.body_starts[i]:self.ends[i]]
+
+    def sender_id(self, name):
+        """获取昵称在驻留表中的编号，不存在时返回None"""
+        return self._name_ids.get(name)
+
+    def between(self, start_date, end_date):
+        """
+        获取日期范围内的消息，与 process_chat_logs.filter_by_date 的日期判断一致
+
+        Args:
+            start_date: 开始日期
+            end_date: 结束日期（包含当天）
+
+        Returns:
+            消息下标序列（按原顺序）
+        """
+        low = to_timestamp(start_date)
+        high = to_timestamp(end_date) + 86400
+        if self._sorted:
+            return range(bisect.bisect_left(self.timestamps, low), bisect.bisect_left(self.timestamps, high))
+        return [i for i, timestamp in enumerate(self.timestamps) if low <= timestamp < high]
+
+    def exclude_senders(self, senders, indices=None):
+        """
+        排除指定发送者的消息
+
+        Args:
+            senders: 发送者的昵称或QQ号（字符串）集合
+            indices: 只在这些消息中筛选，默认为全部消息
+
+        Returns:
+            保留的消息下标列表
+        """
+        sender_ids = {self._name_ids[name] for name in senders if name in self._name_ids}
+        qq_numbers = {int(sender) for sender in senders if sender.isdigit()}
+        if indices is None:
+            indices = range(len(self))
+        names, qqs = self.senders, self.qq_numbers
+        return [i for i in indices if names[i] not in sender_ids and qqs[i] not in qq_numbers]
+
+    def select(self, indices):
+        """
+        获取部分消息组成的 MessageLog（共用原文和发送者驻留表，不复制正文）
+
+        Args:
+            indices: 消息下标序列
+
+        Returns:
+            MessageLog 对象
+        """
+        log = MessageLog(self.text, self.preamble_end)
+        log.names = self.names
+        log._name_ids = self._name_ids
+        for i in indices:
+            log.timestamps.append(self.timestamps[i])
+            log.senders.append(self.senders[i])
+            log.qq_numbers.append(self.qq_numbers[i])
+            log.starts.append(self.starts[i])
+            log.body_starts.append(self.body_starts[i])
+            log.ends.append(self.ends[i])
+        log._sorted = all(a <= b for a, b in zip(log.timestamps, log.timestamps[1:]))
+        return log
+
+    def to_text(self, indices=None):
+        """
+        将消息还原为聊天记录原文（含文件头和消息头），可直接交给清理规则处理
+
+        Args:
+            indices: 消息下标序列，默认为全部消息
+
+        Returns:
+            文本内容
+        """
+        if indices is None:
+            indices = range(len(self))
+        pieces = [self.text[:self.preamble_end]]
+        begin = stop = None
+        for i in indices:
+            if self.starts[i] != stop:
+                # 原文中不相邻时另起一段，相邻的消息合并为一次截取
+                if begin is not None:
+                    pieces.append(self.text[begin:stop])
+                begin = self.starts[i]
+            stop = self.ends[i]
+        if begin is not None:
+            pieces.append(self.text[begin:stop])
+        return ''.join(pieces)
@@ -0,0 +1,337 @@
+import os
+import re
+import sqlite3
+import argparse
+from datetime import datetime
+
+from date_index import tail_hash
+from message_parser import HEADER_PATTERN, MessageLog, from_timestamp, to_timestamp
+
+# 消息数据库的默认路径
+MESSAGE_DB = "chat_history.db"
+
+# 导入时每累计这么多行（在消息边界处）解析并写入一批，避免把整个文件读入内存
+INGEST_BATCH_LINES = 200000
+
+# 文件头中的群名称，如 "消息对象:xx26HIJK大学计算机考研群"
+GROUP_NAME_PATTERN = re.compile(r'^消息对象:(.*)$', re.MULTILINE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    id INTEGER PRIMARY KEY,
+    source TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    tail_hash TEXT,
+    resume_offset INTEGER NOT NULL DEFAULT 0,
+    resume_id INTEGER NOT NULL DEFAULT 0,
+    updated TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    qq INTEGER NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_group_time_sender ON messages (group_id, timestamp, sender);
+"""
+
+# 全文索引与 messages 表同步（外部内容表，正文不重复存储）
+FTS_SCHEMA = """
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, body) VALUES (new.id, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, body) VALUES ('delete', old.id, old.body);
+END;
+"""
+
+class MessageStore:
+    """
+    保存解析后聊天记录的SQLite数据库
+
+    消息按 (群, 时间, 发送者) 建立索引，正文建立 FTS5 全文索引（trigram 分词，支持中文子串检索），
+    按日期或关键词提取一段聊天记录时不需要重新读取和清理原始导出文件。
+    """
+
+    def __init__(self, db_path=MESSAGE_DB):
+        """
+        Args:
+            db_path: 数据库文件路径，不存在时自动创建
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.fts = self._create_fts()
+
+    def _create_fts(self):
+        """创建全文索引，返回使用的分词器；SQLite不支持FTS5时返回None，关键词检索改用LIKE"""
+        row = self.conn.execute("SELECT sql FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        if row is not None:
+            return 'trigram' if 'trigram' in row[0] else 'unicode61'
+
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                self.conn.execute(f"CREATE VIRTUAL TABLE messages_fts USING fts5(body, content='messages', content_rowid='id', tokenize='{tokenizer}')")
+            except sqlite3.OperationalError:
+                continue
+            self.conn.executescript(FTS_SCHEMA)
+            # 已有消息（例如数据库由不支持FTS5的环境创建）补建索引
+            self.conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+            self.conn.commit()
+            return tokenizer
+        return None
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def groups(self):
+        """
+        获取已导入的群
+
+        Returns:
+            [(群编号, 群名称, 源文件, 消息数), ...] 列表
+        """
+        return self.conn.execute(
+            "SELECT g.id, g.name, g.source, (SELECT count(*) FROM messages m WHERE m.group_id = g.id) "
+            "FROM groups g ORDER BY g.id"
+        ).fetchall()
+
+    def find_group(self, group=None):
+        """
+        按群名称或源文件名查找群
+
+        Args:
+            group: 群名称、源文件名（可不含扩展名）；为None时数据库中只能有一个群
+
+        Returns:
+            (群编号, 群名称)
+
+        Raises:
+            ValueError: 找不到群，或未指定群时数据库中有多个群
+        """
+        groups = self.groups()
+        if group is None:
+            matched = groups
+        else:
+            matched = [row for row in groups if group in (row[1], os.path.basename(row[2]), os.path.splitext(os.path.basename(row[2]))[0])]
+
+        if len(matched) == 1:
+            return matched[0][0], matched[0][1]
+        names = ', '.join(row[1] for row in groups) or '无'
+        if not matched:
+            raise ValueError(f"数据库中找不到群 '{group}'，已导入的群: {names}")
+        raise ValueError(f"数据库中有多个群，请使用 --group 指定: {names}")
+
+    def ingest(self, input_file, verbose=False):
+        """
+        将聊天记录导出文件导入数据库
+
+        按文件大小和末尾内容的哈希判断文件是否只是追加了内容：是则从上次最后一条消息开始
+        重新导入（最后一条消息可能被追加了正文）；否则删除该文件已导入的消息后重新导入。
+        整个导入在一个事务中完成，中途失败时数据库保持原样，重复导入同一文件不会产生重复消息。
+
+        Args:
+            input_file: 聊天记录文件路径
+            verbose: 是否显示详细信息
+
+        Returns:
+            新导入的消息数量
+        """
+        if not os.path.exists(input_file):
+            raise FileNotFoundError(f"找不到输入文件: {input_file}")
+
+        source = os.path.abspath(input_file)
+        size = os.path.getsize(input_file)
+        row = self.conn.execute("SELECT id, size, tail_hash, resume_offset, resume_id, name FROM groups WHERE source = ?", (source,)).fetchone()
+
+        with self.conn:
+            if row is not None and row[1] <= size and tail_hash(input_file, row[1]) == row[2]:
+                group_id, _, _, start, resume_id, name = row
+                if row[1] == size:
+                    if verbose:
+                        print(f"'{input_file}' 没有新消息，跳过")
+                    return 0
+                self.conn.execute("DELETE FROM messages WHERE group_id = ? AND id >= ?", (group_id, resume_id))
+            else:
+                start = 0
+                name = os.path.splitext(os.path.basename(input_file))[0]
+                if row is None:
+                    group_id = self.conn.execute("INSERT INTO groups (source, name) VALUES (?, ?)", (source, name)).lastrowid
+                else:
+                    group_id = row[0]
+                    self.conn.execute("DELETE FROM messages WHERE group_id = ?", (group_id,))
+
+            count = 0
+            resume_offset = start
+            for text, header_offsets in self._read_batches(input_file, start, size):
+                log = MessageLog.parse(text)
+                if start == 0 and count == 0:
+                    match = GROUP_NAME_PATTERN.search(text, 0, log.preamble_end)
+                    if match and match.group(1).strip():
+                        name = match.group(1).strip()
+                self.conn.executemany(
+                    "INSERT INTO messages (group_id, timestamp, sender, qq, body) VALUES (?, ?, ?, ?, ?)",
+                    ((group_id, log.timestamps[i], log.names[log.senders[i]], log.qq_numbers[i], log.body(i)) for i in range(len(log)))
+                )
+                count += len(log)
+                if header_offsets:
+                    resume_offset = header_offsets[-1]
+
+            last = self.conn.execute("SELECT max(id) FROM messages WHERE group_id = ?", (group_id,)).fetchone()[0]
+            self.conn.execute(
+                "UPDATE groups SET name = ?, size = ?, tail_hash = ?, resume_offset = ?, resume_id = ?, updated = ? WHERE id = ?",
+                (name, size, tail_hash(input_file, size), resume_offset, last if last is not None else 0,
+                 datetime.now().strftime('%Y-%m-%d %H:%M:%S'), group_id)
+            )
+
+        if verbose:
+            print(f"已导入 '{input_file}' -> 群 '{name}': {count} 条消息")
+        return count
+
+    def _read_batches(self, input_file, start, stop):
+        """
+        从字节偏移 start 读取到 stop，按消息边界分批返回
+
+        Yields:
+            (文本, 消息头的字节偏移列表): 文本的换行符统一为 \\n
+        """
+        lines = []
+        header_offsets = []
+        position = start
+        with open(input_file, 'rb') as f:
+            f.seek(start)
+            for raw in f:
+                if position + len(raw) > stop:
+                    # 统计文件大小之后才写入的内容，下次导入时会从最后一条消息重新读取
+                    break
+                line = raw.decode('utf-8')
+                if line.endswith('\r\n'):
+                    line = line[:-2] + '\n'
+                if HEADER_PATTERN.match(line.rstrip('\n')):
+                    if len(lines) >= INGEST_BATCH_LINES:
+                        yield ''.join(lines), header_offsets
+                        lines = []
+                        header_offsets = []
+                    header_offsets.append(position)
+                lines.append(line)
+                position += len(raw)
+        if lines:
+            yield ''.join(lines), header_offsets
+
+    def last_date(self, group_id):
+        """获取群中最后一条消息的日期（datetime对象），没有消息时为None"""
+        timestamp = self.conn.execute("SELECT max(timestamp) FROM messages WHERE group_id = ?", (group_id,)).fetchone()[0]
+        if timestamp is None:
+            return None
+        return datetime.combine(from_timestamp(timestamp).date(), datetime.min.time())
+
+    def query(self, group_id, start_date=None, end_date=None, keyword=None):
+        """
+        提取一段聊天记录
+
+        Args:
+            group_id: 群编号
+            start_date: 开始日期，为None时不限制
+            end_date: 结束日期（包含当天），为None时不限制
+            keyword: 正文中需要包含的关键词，为None时不限制
+
+        Returns:
+            [(时间戳, 发送者, QQ号, 正文), ...] 列表，按在导出文件中的顺序排列
+        """
+        conditions = ["m.group_id = ?"]
+        params = [group_id]
+        if start_date is not None:
+            conditions.append("m.timestamp >= ?")
+            params.append(to_timestamp(start_date))
+        if end_date is not None:
+            conditions.append("m.timestamp < ?")
+            params.append(to_timestamp(end_date) + 86400)
+
+        tables = "messages m"
+        if keyword:
+            if self.fts == 'trigram' and len(keyword) >= 3:
+                # trigram 分词按连续3个字符建立索引，更短的关键词无法使用全文索引
+                tables = "messages_fts f JOIN messages m ON m.id = f.rowid"
+                conditions.append("messages_fts MATCH ?")
+                params.append('"' + keyword.replace('"', '""') + '"')
+            else:
+                conditions.append("m.body LIKE ? ESCAPE '\\'")
+                params.append('%' + re.sub(r'([%_\\])', r'\\\1', keyword) + '%')
+
+        return self.conn.execute(
+            f"SELECT m.timestamp, m.sender, m.qq, m.body FROM {tables} WHERE {' AND '.join(conditions)} ORDER BY m.id",
+            params
+        ).fetchall()
+
+def export_text(rows):
+    """
+    将查询结果还原为QQ导出格式的聊天记录，可直接交给清理规则处理
+
+    Args:
+        rows: MessageStore.query 的返回值
+
+    Returns:
+        聊天记录文本
+    """
+    pieces = []
+    for timestamp, sender, qq, body in rows:
+        pieces.append(f"{from_timestamp(timestamp):%Y-%m-%d %H:%M:%S} {sender}({qq})\n" if qq else f"{from_timestamp(timestamp):%Y-%m-%d %H:%M:%S} {sender}\n")
+        pieces.append(body if body.endswith('\n') else body + '\n')
+    return ''.join(pieces)
+
+def ingest_directory(store, directory='inputs/', verbose=False):
+    """
+    导入目录下的所有聊天记录文件
+
+    Args:
+        store: MessageStore 对象
+        directory: 目录路径
+        verbose: 是否显示详细信息
+
+    Returns:
+        新导入的消息数量
+    """
+    count = 0
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.txt') and not filename.startswith('cleaned_'):
+            count += store.ingest(os.path.join(directory, filename), verbose=verbose)
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='将QQ聊天记录导入SQLite数据库')
+    parser.add_argument('-f', '--file', help='指定要导入的聊天记录文件')
+    parser.add_argument('-d', '--directory', default='inputs/', help='导入指定目录下的所有聊天记录文件，默认为inputs/')
+    parser.add_argument('--db', default=MESSAGE_DB, help=f'数据库文件路径，默认为{MESSAGE_DB}')
+    parser.add_argument('-l', '--list', action='store_true', help='列出数据库中已导入的群')
+    parser.add_argument('-v', '--verbose', action='store_true', help='显示详细处理信息')
+
+    args = parser.parse_args()
+
+    with MessageStore(args.db) as store:
+        if args.list:
+            for _, name, source, count in store.groups():
+                print(f"{name}: {count} 条消息 ({source})")
+            return
+
+        if args.file:
+            count = store.ingest(args.file, verbose=args.verbose)
+        elif os.path.exists(args.directory):
+            count = ingest_directory(store, args.directory, verbose=args.verbose)
+        else:
+            print(f"警告: 目录不存在: {args.directory}")
+            return
+        print(f"导入完成! 新导入了 {count} 条消息")
+
+if __name__ == "__main__":
+    main()
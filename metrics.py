@@ -0,0 +1,346 @@
+import os
+import json
+import math
+import time
+import random
+import atexit
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+
+# Prometheus 指标名前缀
+METRIC_PREFIX = 'qq_summary'
+
+# 延迟直方图的分桶上限（秒）
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# 每个延迟指标保留的采样数上限（蓄水池抽样，用于估计分位数），长时间运行时内存不再增长
+RESERVOIR_SIZE = 1024
+
+# 当前正在处理的群（聊天记录文件），API用量按群统计
+_current_group = contextvars.ContextVar('metrics_group', default='')
+
+class _StageTimer:
+    """Metrics.stage 返回的计时器"""
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.metrics.profiler
+        if profiler is not None:
+            profiler.stage_started(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.add_stage(self.name, time.perf_counter() - self.start)
+        profiler = self.metrics.profiler
+        if profiler is not None:
+            profiler.stage_finished(self.name)
+
+class _Latency:
+    """
+    一个延迟指标的统计: 直方图各分桶的计数、总和、次数、最大值，以及用于估计分位数的蓄水池抽样
+
+    占用的内存和生成报告的耗时都与采样总数无关。
+    """
+
+    __slots__ = ('buckets', 'sum', 'count', 'max', 'reservoir')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+        self.reservoir = []
+
+    def add(self, seconds):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.sum += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+        if len(self.reservoir) < RESERVOIR_SIZE:
+            self.reservoir.append(seconds)
+        else:
+            # 每个采样以相同的概率 RESERVOIR_SIZE / count 留在蓄水池中
+            slot = random.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.reservoir[slot] = seconds
+
+    def cumulative_buckets(self):
+        """各分桶上限（不含 +Inf）的累计计数"""
+        counts = []
+        total = 0
+        for count in self.buckets:
+            total += count
+            counts.append(total)
+        return counts
+
+    def summary(self):
+        """count、mean、max 为精确值，p50/p95/p99 由蓄水池抽样估计（采样数不超过 RESERVOIR_SIZE 时也是精确值）"""
+        summary = summarize_samples(self.reservoir)
+        if self.count:
+            summary.update(count=self.count, mean=round(self.sum / self.count, 4), max=round(self.max, 4))
+        return summary
+
+class Metrics:
+    """
+    一次运行中的计时和计数
+
+    包括各处理阶段的累计耗时、带标签的计数器（请求数、token数、费用等）和延迟采样，
+    运行结束时可以写出JSON报告和 Prometheus node-exporter 的 textfile。线程安全。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.samples = {}
+        # --profile 时为 profiler.StageProfiler，在每个阶段开始和结束时被调用
+        self.profiler = None
+
+    def stage(self, name):
+        """
+        计时一个处理阶段，同名阶段的耗时和次数累加
+
+        用法: with METRICS.stage('keyword_rules'): ...
+        """
+        return _StageTimer(self, name)
+
+    def add_stage(self, name, seconds, count=1):
+        """累加一个处理阶段的耗时"""
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = [0, 0.0]
+            stage[0] += count
+            stage[1] += seconds
+
+    def reset_stages(self):
+        """清空阶段耗时，返回清空前的 {阶段: [次数, 秒数]}（用于在子进程中分别统计每个任务）"""
+        with self._lock:
+            stages, self.stages = self.stages, {}
+        return stages
+
+    def merge_stages(self, stages):
+        """合并子进程返回的阶段耗时"""
+        for name, (count, seconds) in stages.items():
+            self.add_stage(name, seconds, count)
+
+    def inc(self, name, value=1, **labels):
+        """
+        增加计数器
+
+        Args:
+            name: 指标名称，如 'api_requests'
+            value: 增加的值
+            **labels: 标签，如 api='openai', status='200'
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """记录一次延迟采样（只保留分桶计数和有限的抽样，见 _Latency）"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            latency = self.samples.get(key)
+            if latency is None:
+                latency = self.samples[key] = _Latency()
+            latency.add(seconds)
+
+    @contextmanager
+    def group(self, name):
+        """在此范围内发出的API请求的用量计入群 name"""
+        token = _current_group.set(name)
+        try:
+            yield
+        finally:
+            _current_group.reset(token)
+
+    def record_usage(self, api, input_tokens, output_tokens, cost=0.0, cache_read=0, cache_write=0):
+        """
+        记录API响应中的token用量和按配置价格计算的费用，计入当前的群
+
+        Args:
+            api: API源名称
+            input_tokens: 输入token数（包括命中和写入提示词缓存的部分）
+            output_tokens: 输出token数
+            cost: 费用
+            cache_read: 输入中命中提示词缓存的token数
+            cache_write: 输入中写入提示词缓存的token数
+        """
+        group = _current_group.get()
+        self.inc('api_tokens', input_tokens, api=api, group=group, type='input')
+        self.inc('api_tokens', output_tokens, api=api, group=group, type='output')
+        if cache_read:
+            self.inc('api_tokens', cache_read, api=api, group=group, type='cache_read')
+        if cache_write:
+            self.inc('api_tokens', cache_write, api=api, group=group, type='cache_write')
+        if cost:
+            self.inc('api_cost', cost, api=api, group=group)
+
+    def report(self, script=None):
+        """
+        生成JSON运行报告
+
+        Args:
+            script: 脚本名称
+
+        Returns:
+            报告字典
+        """
+        with self._lock:
+            stages = {name: {'count': count, 'seconds': round(seconds, 6)} for name, (count, seconds) in self.stages.items()}
+            counters = [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in self.counters.items()]
+            samples = [{'name': name, 'labels': dict(labels), **latency.summary()} for (name, labels), latency in self.samples.items()]
+        return {
+            'script': script,
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'duration_seconds': round(time.time() - self.started, 3),
+            'stages': stages,
+            'counters': counters,
+            'latencies': samples,
+        }
+
+    def prometheus(self, script=None):
+        """
+        生成 Prometheus 文本格式的指标
+
+        Args:
+            script: 脚本名称，作为运行时长等指标的标签
+
+        Returns:
+            文本内容
+        """
+        lines = []
+        run_labels = _format_labels((('script', script or ''),))
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+
+        family('run_timestamp_seconds', 'gauge', 'Unix time the run started.')
+        lines.append(f"{METRIC_PREFIX}_run_timestamp_seconds{run_labels} {self.started:.3f}")
+        family('run_duration_seconds', 'gauge', 'Duration of the run.')
+        lines.append(f"{METRIC_PREFIX}_run_duration_seconds{run_labels} {time.time() - self.started:.3f}")
+
+        with self._lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+            samples = [(key, latency.cumulative_buckets(), latency.sum, latency.count) for key, latency in sorted(self.samples.items())]
+
+        if stages:
+            family('stage_seconds_total', 'counter', 'Time spent in each processing stage.')
+            for name, (count, seconds) in stages:
+                lines.append(f"{METRIC_PREFIX}_stage_seconds_total{_format_labels((('stage', name),))} {seconds:.6f}")
+            family('stage_calls_total', 'counter', 'Number of times each processing stage ran.')
+            for name, (count, seconds) in stages:
+                lines.append(f"{METRIC_PREFIX}_stage_calls_total{_format_labels((('stage', name),))} {count}")
+
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                family(f"{name}_total", 'counter', f"{name.replace('_', ' ')} counter.")
+                declared.add(name)
+            lines.append(f"{METRIC_PREFIX}_{name}_total{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), buckets, total, count in samples:
+            if name not in declared:
+                family(f"{name}_seconds", 'histogram', f"{name.replace('_', ' ')} in seconds.")
+                declared.add(name)
+            for bound, cumulative in zip(LATENCY_BUCKETS + (math.inf,), buckets + [count]):
+                le = '+Inf' if bound == math.inf else str(bound)
+                lines.append(f"{METRIC_PREFIX}_{name}_seconds_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{METRIC_PREFIX}_{name}_seconds_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{METRIC_PREFIX}_{name}_seconds_count{_format_labels(labels)} {count}")
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path=None, textfile_path=None, script=None):
+        """
+        写出JSON报告和/或 Prometheus textfile
+
+        textfile 先写入临时文件再替换，node-exporter 不会读到写了一半的文件。
+
+        Args:
+            json_path: JSON报告路径，为None时不写出
+            textfile_path: Prometheus textfile 路径（应以 .prom 结尾），为None时不写出
+            script: 脚本名称
+        """
+        if json_path:
+            _write_atomic(json_path, json.dumps(self.report(script), ensure_ascii=False, indent=2))
+        if textfile_path:
+            _write_atomic(textfile_path, self.prometheus(script))
+
+    def write_at_exit(self, json_path=None, textfile_path=None, script=None):
+        """在程序退出时（包括出错退出）写出报告"""
+        if json_path or textfile_path:
+            atexit.register(self.write, json_path, textfile_path, script)
+
+def propagate_group(fn):
+    """
+    包装在线程池中执行的函数，使其发出的请求仍计入调用方当前的群
+
+    线程池中的线程不继承调用方的 contextvars，需要显式传递。
+    """
+    group = _current_group.get()
+
+    def wrapper(*args, **kwargs):
+        token = _current_group.set(group)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_group.reset(token)
+    return wrapper
+
+def summarize_samples(values):
+    """计算延迟采样的 count、mean、p50、p95、p99、max"""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def percentile(p):
+        return round(ordered[max(1, math.ceil(p / 100 * len(ordered))) - 1], 4)
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 4),
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': round(ordered[-1], 4),
+    }
+
+def _escape(value):
+    """转义 Prometheus 标签值中的反斜杠、双引号和换行符"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+def _format_value(value):
+    return str(value) if isinstance(value, int) else f"{value:.6f}"
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+# 整个进程共用的指标
+METRICS = Metrics()
@@ -0,0 +1,563 @@
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from email import policy
+from email.parser import BytesParser
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from token_estimator import estimate_tokens
+
+# 模拟的接口路径: SiliconFlow/OpenAI 格式和 Anthropic 格式
+CHAT_COMPLETIONS_PATH = '/v1/chat/completions'
+MESSAGES_PATH = '/v1/messages'
+
+# 模拟的批处理接口路径: OpenAI 格式（上传文件后创建批次）和 Anthropic 格式
+FILES_PATH = '/v1/files'
+BATCHES_PATH = '/v1/batches'
+MESSAGE_BATCHES_PATH = '/v1/messages/batches'
+
+# 模拟总结的内容由以下片段循环拼接
+SUMMARY_TEXT = "## 模拟话题\n这是本地模拟服务生成的总结内容，用于测试并发、限流和重试。链接 https://example.com 原样保留。\n"
+
+# 模拟 SiliconFlow/OpenAI 格式的自动前缀缓存时，按此字符数的整数倍缓存前缀
+CACHE_BLOCK_CHARS = 256
+
+# 模拟服务最多记住的缓存前缀数，超出时丢弃最早的
+CACHE_PREFIXES = 10000
+
+class LatencyDistribution:
+    """
+    首个token之前的延迟分布
+
+    格式为 "类型:参数"：
+        fixed:1.0            固定1秒
+        uniform:0.5:2.0      0.5到2秒均匀分布
+        lognormal:1.0:0.5    中位数1秒、对数标准差0.5的对数正态分布（长尾）
+        exponential:1.0      平均1秒的指数分布
+    """
+
+    def __init__(self, spec='fixed:0'):
+        kind, _, params = spec.partition(':')
+        try:
+            values = [float(value) for value in params.split(':')] if params else []
+        except ValueError:
+            raise ValueError(f"无法解析的延迟分布: {spec}")
+        expected = {'fixed': 1, 'uniform': 2, 'lognormal': 2, 'exponential': 1}
+        if kind not in expected or len(values) != expected[kind] or any(value < 0 for value in values):
+            raise ValueError(f"无法解析的延迟分布: {spec}（可用: fixed:秒、uniform:最小:最大、lognormal:中位数:sigma、exponential:平均）")
+        self.spec = spec
+        self.kind = kind
+        self.values = values
+
+    def sample(self, rng):
+        """按分布取一个延迟秒数"""
+        if self.kind == 'fixed':
+            return self.values[0]
+        if self.kind == 'uniform':
+            return rng.uniform(*self.values)
+        if self.kind == 'lognormal':
+            median, sigma = self.values
+            return median * math.exp(rng.gauss(0, sigma)) if median else 0.0
+        mean = self.values[0]
+        return rng.expovariate(1 / mean) if mean else 0.0
+
+class MockConfig:
+    """模拟服务的行为设置"""
+
+    def __init__(self, latency='fixed:0', output_tokens=300, output_tps=0, rpm=0, tpm=0,
+                 error_rates=None, timeout_rate=0.0, hang_seconds=5.0, seed=None, batch_seconds=0.0, prefill_tps=0):
+        """
+        Args:
+            latency: 首个token之前的延迟分布（见 LatencyDistribution）
+            output_tokens: 每次生成的token数（不超过请求的 max_tokens）
+            output_tps: 每秒生成的token数，0表示生成不耗时
+            rpm: 每分钟最多请求数，超出时返回429，0表示不限制
+            tpm: 每分钟最多token数（输入加 max_tokens），超出时返回429，0表示不限制
+            error_rates: 随机注入错误的概率 {状态码: 概率}，如 {429: 0.05, 500: 0.02}
+            timeout_rate: 随机挂起请求的概率，挂起 hang_seconds 秒后不返回响应直接断开连接
+            hang_seconds: 挂起请求的秒数
+            seed: 随机种子，为None时每次运行不同
+            batch_seconds: 批次提交后多少秒处理完成
+            prefill_tps: 每秒处理的输入token数（命中提示词缓存的部分不计），0表示处理输入不耗时
+        """
+        self.latency = latency if isinstance(latency, LatencyDistribution) else LatencyDistribution(latency)
+        self.output_tokens = output_tokens
+        self.output_tps = output_tps
+        self.rpm = rpm
+        self.tpm = tpm
+        self.error_rates = dict(error_rates or {})
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.seed = seed
+        self.batch_seconds = batch_seconds
+        self.prefill_tps = prefill_tps
+
+class MockProvider:
+    """
+    本地模拟的LLM服务，实现 SiliconFlow/OpenAI（choices[0].message.content）和
+    Anthropic（content[0].text）两种接口格式及各自的流式响应和批处理接口
+
+    可用 with 语句在后台线程中运行，也可以通过 serve_forever 在前台运行。
+    """
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        """
+        Args:
+            config: MockConfig 对象，默认为无延迟、无错误
+            host: 监听地址
+            port: 监听端口，0表示自动选择空闲端口
+        """
+        self.config = config or MockConfig()
+        self.rng = random.Random(self.config.seed)
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.provider = self
+        self.lock = threading.Lock()
+        self._requests = deque()
+        self._tokens = deque()
+        self.statuses = Counter()
+        self.latencies = []
+        # 批处理接口上传的文件 {文件ID: 内容} 和批次 {批次ID: 批次信息}
+        self.files = {}
+        self.batches = {}
+        self._next_id = 0
+        self._batch_lock = threading.Lock()
+        # 提示词缓存中的前缀（按插入顺序，超出 CACHE_PREFIXES 时丢弃最早的）
+        self._prefixes = {}
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, api):
+        """获取模拟某个API源时应使用的 api_url"""
+        return self.base_url + (MESSAGES_PATH if api == 'anthropic' else CHAT_COMPLETIONS_PATH)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def decide(self, tokens):
+        """
+        决定一个请求的处理方式
+
+        Args:
+            tokens: 请求占用的token数（输入加 max_tokens）
+
+        Returns:
+            ('timeout', None)、('error', 状态码) 或 ('ok', 首个token前的延迟秒数)
+        """
+        with self.lock:
+            roll = self.rng.random()
+            if roll < self.config.timeout_rate:
+                return 'timeout', None
+            roll -= self.config.timeout_rate
+            for status, rate in self.config.error_rates.items():
+                if roll < rate:
+                    return 'error', status
+                roll -= rate
+
+            now = time.monotonic()
+            while self._requests and now - self._requests[0] >= 60:
+                self._requests.popleft()
+            while self._tokens and now - self._tokens[0][0] >= 60:
+                self._tokens.popleft()
+            if self.config.rpm and len(self._requests) >= self.config.rpm:
+                return 'error', 429
+            if self.config.tpm and sum(used for _, used in self._tokens) + tokens > self.config.tpm:
+                return 'error', 429
+            self._requests.append(now)
+            self._tokens.append((now, tokens))
+            return 'ok', self.config.latency.sample(self.rng)
+
+    def new_id(self, prefix):
+        with self.lock:
+            self._next_id += 1
+            return f"{prefix}_{self._next_id}"
+
+    def complete(self, request, anthropic):
+        """
+        处理批次中的一个请求（不模拟延迟，挂起按超时错误处理）
+
+        Returns:
+            (状态码, 响应体)
+        """
+        max_tokens, input_tokens = _request_tokens(request, self.config.output_tokens)
+        action, value = self.decide(input_tokens + max_tokens)
+        if action != 'ok':
+            status = value if action == 'error' else 504
+            self.record(status, 0)
+            return status, {"message": f"mock error {status}", "error": {"type": "mock_error", "message": f"mock error {status}"}}
+        text = _summary_text(min(max_tokens, self.config.output_tokens))
+        self.record(200, 0)
+        return 200, _completion(anthropic, request.get('model'), text, (input_tokens, estimate_tokens(text), 0, 0))
+
+    def batch_info(self, batch_id):
+        """
+        获取批次信息，提交 batch_seconds 秒后第一次查询时处理批次中的所有请求
+
+        Returns:
+            批次信息，不存在时为None
+        """
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        anthropic = batch.get('type') == 'message_batch'
+        with self._batch_lock:
+            if batch['_lines'] is None or time.monotonic() - batch['_created'] < self.config.batch_seconds:
+                return {key: value for key, value in batch.items() if not key.startswith('_')}
+            lines, batch['_lines'] = batch['_lines'], None
+            results = []
+            for line in lines:
+                if anthropic:
+                    status, body = self.complete(line['params'], True)
+                    result = {"type": "succeeded", "message": body} if status == 200 else {"type": "errored", "error": body}
+                    results.append({"custom_id": line['custom_id'], "result": result})
+                else:
+                    status, body = self.complete(line['body'], False)
+                    results.append({"id": self.new_id('batch_req'), "custom_id": line['custom_id'],
+                                    "response": {"status_code": status, "body": body}, "error": None})
+            output = ''.join(json.dumps(result, ensure_ascii=False) + '\n' for result in results)
+            if anthropic:
+                self.files[f"results_{batch_id}"] = output
+                batch.update(processing_status='ended', results_url=f"{self.base_url}{MESSAGE_BATCHES_PATH}/{batch_id}/results")
+            else:
+                output_file_id = self.new_id('file')
+                self.files[output_file_id] = output
+                batch.update(status='completed', output_file_id=output_file_id)
+        return {key: value for key, value in batch.items() if not key.startswith('_')}
+
+    def prompt_cache(self, text, breakpoints, write):
+        """
+        模拟提示词前缀缓存：查找已缓存的最长前缀，并缓存本次请求的所有前缀
+
+        Args:
+            text: 请求中提示词的完整文本
+            breakpoints: 可以缓存的前缀长度（字符数），从短到长
+            write: 是否统计写入缓存的token数（Anthropic 写入缓存单独计费）
+
+        Returns:
+            (命中缓存的token数, 写入缓存的token数)
+        """
+        keys = [hash(text[:end]) for end in breakpoints]
+        with self.lock:
+            hit = max((end for end, key in zip(breakpoints, keys) if key in self._prefixes), default=0)
+            for key in keys:
+                self._prefixes.pop(key, None)
+                self._prefixes[key] = True
+            while len(self._prefixes) > CACHE_PREFIXES:
+                del self._prefixes[next(iter(self._prefixes))]
+        read = estimate_tokens(text[:hit]) if hit else 0
+        written = 0
+        if write and breakpoints and breakpoints[-1] > hit:
+            written = estimate_tokens(text[:breakpoints[-1]]) - read
+        return read, written
+
+    def record(self, status, seconds):
+        """记录一个请求的结果"""
+        with self.lock:
+            self.statuses[status] += 1
+            if status == 200:
+                self.latencies.append(seconds)
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # 不在每个请求后打印访问日志
+        pass
+
+    def do_GET(self):
+        provider = self.server.provider
+        path = self.path
+        if path.startswith(MESSAGE_BATCHES_PATH + '/') and path.endswith('/results'):
+            batch_id = path[len(MESSAGE_BATCHES_PATH) + 1:-len('/results')]
+            output = provider.files.get(f"results_{batch_id}")
+            if output is None:
+                self._send_json(404, {"message": f"unknown batch {batch_id}"})
+            else:
+                self._send_text(200, output, 'application/x-jsonl')
+        elif path.startswith(MESSAGE_BATCHES_PATH + '/') or path.startswith(BATCHES_PATH + '/'):
+            batch_id = path.rsplit('/', 1)[1]
+            info = provider.batch_info(batch_id)
+            if info is None:
+                self._send_json(404, {"message": f"unknown batch {batch_id}"})
+            else:
+                self._send_json(200, info)
+        elif path.startswith(FILES_PATH + '/') and path.endswith('/content'):
+            file_id = path[len(FILES_PATH) + 1:-len('/content')]
+            if file_id not in provider.files:
+                self._send_json(404, {"message": f"unknown file {file_id}"})
+            else:
+                self._send_text(200, provider.files[file_id], 'application/jsonl')
+        else:
+            self._send_json(404, {"message": f"unknown path {path}"})
+
+    def _handle_batch(self, body):
+        """处理批处理接口的POST请求: 上传文件、创建批次"""
+        provider = self.server.provider
+        if self.path == FILES_PATH:
+            # multipart/form-data，file 字段为JSONL内容
+            message = BytesParser(policy=policy.HTTP).parsebytes(
+                f"content-type: {self.headers.get('content-type')}\r\n\r\n".encode('utf-8') + body)
+            for part in message.iter_parts():
+                if part.get_param('name', header='content-disposition') == 'file':
+                    file_id = provider.new_id('file')
+                    provider.files[file_id] = part.get_payload(decode=True).decode('utf-8')
+                    self._send_json(200, {"id": file_id, "object": "file", "purpose": "batch"})
+                    return
+            self._send_json(400, {"message": "missing file field"})
+            return
+
+        request = json.loads(body or b'{}')
+        if self.path == MESSAGE_BATCHES_PATH:
+            batch_id = provider.new_id('msgbatch')
+            provider.batches[batch_id] = {"id": batch_id, "type": "message_batch", "processing_status": "in_progress",
+                                          "_lines": request.get('requests', []), "_created": time.monotonic()}
+        else:
+            lines = [json.loads(line) for line in provider.files.get(request.get('input_file_id'), '').splitlines() if line.strip()]
+            batch_id = provider.new_id('batch')
+            provider.batches[batch_id] = {"id": batch_id, "object": "batch", "status": "in_progress",
+                                          "input_file_id": request.get('input_file_id'), "_lines": lines, "_created": time.monotonic()}
+        self._send_json(200, provider.batch_info(batch_id))
+
+    def do_POST(self):
+        start = time.monotonic()
+        provider = self.server.provider
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length)
+        if self.path in (FILES_PATH, BATCHES_PATH, MESSAGE_BATCHES_PATH):
+            try:
+                self._handle_batch(body)
+            except (ValueError, UnicodeDecodeError) as e:
+                self._send_json(400, {"message": f"invalid batch request: {e}"})
+            return
+        try:
+            request = json.loads(body or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {"message": "invalid JSON body"})
+            provider.record(400, time.monotonic() - start)
+            return
+
+        anthropic = self.path == MESSAGES_PATH
+        if not anthropic and self.path != CHAT_COMPLETIONS_PATH:
+            self._send_json(404, {"message": f"unknown path {self.path}"})
+            provider.record(404, time.monotonic() - start)
+            return
+
+        max_tokens, input_tokens = _request_tokens(request, provider.config.output_tokens)
+        action, value = provider.decide(input_tokens + max_tokens)
+
+        if action == 'timeout':
+            time.sleep(provider.config.hang_seconds)
+            provider.record('timeout', time.monotonic() - start)
+            self.close_connection = True
+            return
+        if action == 'error':
+            headers = {'retry-after': '1'} if value == 429 else {}
+            self._send_json(value, {"message": f"mock error {value}", "error": {"type": "mock_error", "message": f"mock error {value}"}}, headers)
+            provider.record(value, time.monotonic() - start)
+            return
+
+        # 命中提示词缓存的输入不再计入处理输入的耗时
+        prompt, breakpoints = _cache_breakpoints(request, anthropic)
+        cache_read, cache_write = provider.prompt_cache(prompt, breakpoints, write=anthropic)
+        cache_read = min(cache_read, input_tokens)
+        cache_write = min(cache_write, input_tokens - cache_read)
+        if provider.config.prefill_tps:
+            value += (input_tokens - cache_read) / provider.config.prefill_tps
+
+        time.sleep(value)
+        text = _summary_text(min(max_tokens, provider.config.output_tokens))
+        usage = (input_tokens, estimate_tokens(text), cache_read, cache_write)
+        if request.get('stream'):
+            self._stream(anthropic, text, provider.config.output_tps, usage, request.get('stream_options'))
+        else:
+            if provider.config.output_tps:
+                time.sleep(usage[1] / provider.config.output_tps)
+            self._send_json(200, _completion(anthropic, request.get('model'), text, usage))
+        provider.record(200, time.monotonic() - start)
+
+    def _send_json(self, status, payload, headers=None):
+        self._send_text(status, json.dumps(payload, ensure_ascii=False), 'application/json', headers)
+
+    def _send_text(self, status, text, content_type, headers=None):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', content_type)
+        self.send_header('content-length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, anthropic, text, output_tps, usage, stream_options=None):
+        """以SSE事件流逐段发送生成的文本（分块传输编码），token用量的位置与真实服务相同"""
+        self.send_response(200)
+        self.send_header('content-type', 'text/event-stream')
+        self.send_header('transfer-encoding', 'chunked')
+        self.end_headers()
+
+        pieces = [text[i:i + 8] for i in range(0, len(text), 8)]
+        if anthropic:
+            self._send_event('message_start', {"type": "message_start", "message": {"usage": dict(_anthropic_usage(usage), output_tokens=1)}})
+            for piece in pieces:
+                self._pace(piece, output_tps)
+                self._send_event('content_block_delta', {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}})
+            self._send_event('message_delta', {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": usage[1]}})
+            self._send_event('message_stop', {"type": "message_stop"})
+        else:
+            for piece in pieces:
+                self._pace(piece, output_tps)
+                self._send_event(None, {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": piece}}]})
+            if (stream_options or {}).get('include_usage'):
+                self._send_event(None, {"object": "chat.completion.chunk", "choices": [], "usage": _openai_usage(usage)})
+            self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b'')
+
+    def _pace(self, piece, output_tps):
+        if output_tps:
+            time.sleep(estimate_tokens(piece) / output_tps)
+
+    def _send_event(self, event, payload):
+        data = f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        if event:
+            data = f"event: {event}\n{data}"
+        self._write_chunk(data.encode('utf-8'))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+def _request_tokens(request, output_tokens):
+    """请求的最大输出token数和输入token数"""
+    max_tokens = int(request.get('max_tokens') or output_tokens)
+    prompt = json.dumps(request.get('messages', []), ensure_ascii=False) + str(request.get('system', ''))
+    return max_tokens, estimate_tokens(prompt)
+
+def _prompt_blocks(request):
+    """按顺序列出请求中的文本块 (文本, 是否带 cache_control)"""
+    sources = [request.get('system') or []] + [message.get('content', '') for message in request.get('messages', [])]
+    for content in sources:
+        if isinstance(content, str):
+            yield content, False
+        else:
+            for block in content:
+                yield block.get('text', ''), 'cache_control' in block
+
+def _cache_breakpoints(request, anthropic):
+    """
+    拼接请求中的提示词文本，并找出可以缓存的前缀位置
+
+    Anthropic 格式只缓存到带 cache_control 的内容块末尾；SiliconFlow/OpenAI 格式自动缓存，
+    按 CACHE_BLOCK_CHARS 的整数倍缓存前缀。
+
+    Returns:
+        (提示词文本, 可以缓存的前缀长度列表)
+    """
+    text = ''
+    breakpoints = []
+    for block, cached in _prompt_blocks(request):
+        text += block
+        if anthropic and cached:
+            breakpoints.append(len(text))
+    if not anthropic:
+        breakpoints = list(range(CACHE_BLOCK_CHARS, len(text) + 1, CACHE_BLOCK_CHARS))
+    return text, breakpoints
+
+def _summary_text(tokens):
+    """生成约 tokens 个token的模拟总结"""
+    unit = estimate_tokens(SUMMARY_TEXT)
+    return SUMMARY_TEXT * max(1, tokens // unit)
+
+def _openai_usage(usage):
+    return {"prompt_tokens": usage[0], "completion_tokens": usage[1], "total_tokens": usage[0] + usage[1],
+            "prompt_tokens_details": {"cached_tokens": usage[2]}}
+
+def _anthropic_usage(usage):
+    # Anthropic 的 input_tokens 不含命中和写入缓存的部分
+    return {"input_tokens": usage[0] - usage[2] - usage[3], "output_tokens": usage[1],
+            "cache_read_input_tokens": usage[2], "cache_creation_input_tokens": usage[3]}
+
+def _completion(anthropic, model, text, usage):
+    """构造非流式响应，usage 为 (输入token数, 输出token数, 命中缓存的token数, 写入缓存的token数)"""
+    if anthropic:
+        return {"type": "message", "role": "assistant", "model": model, "content": [{"type": "text", "text": text}],
+                "usage": _anthropic_usage(usage)}
+    return {"object": "chat.completion", "model": model, "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": _openai_usage(usage)}
+
+def parse_error_rate(spec):
+    """解析 "状态码:概率" 形式的错误注入设置"""
+    status, _, rate = spec.partition(':')
+    try:
+        return int(status), float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"格式应为 状态码:概率，如 429:0.05，实际为 {spec}")
+
+def add_mock_arguments(parser):
+    """添加模拟服务行为相关的命令行参数（mock_provider.py 和 load_test.py 共用）"""
+    parser.add_argument('--latency', default='fixed:0', help='首个token之前的延迟分布，如 fixed:1、uniform:0.5:2、lognormal:1:0.5、exponential:1，默认为fixed:0')
+    parser.add_argument('--output-tokens', type=int, default=300, help='每次生成的token数，默认为300')
+    parser.add_argument('--output-tps', type=float, default=0, help='每秒生成的token数，0表示生成不耗时，默认为0')
+    parser.add_argument('--mock-rpm', type=int, default=0, help='模拟服务每分钟最多请求数，超出时返回429，默认不限制')
+    parser.add_argument('--mock-tpm', type=int, default=0, help='模拟服务每分钟最多token数，超出时返回429，默认不限制')
+    parser.add_argument('--error-rate', type=parse_error_rate, action='append', default=[], help='随机返回错误状态码的概率，可多次指定，如 --error-rate 429:0.05 --error-rate 503:0.02')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='随机挂起请求（不返回响应直接断开）的概率，默认为0')
+    parser.add_argument('--hang-seconds', type=float, default=5.0, help='挂起请求的秒数，默认为5')
+    parser.add_argument('--seed', type=int, help='随机种子')
+    parser.add_argument('--prefill-tps', type=float, default=0, help='每秒处理的输入token数（命中提示词缓存的部分不计），0表示处理输入不耗时，默认为0')
+    parser.add_argument('--batch-seconds', type=float, default=0.0, help='批处理接口中批次提交后多少秒处理完成，默认为0')
+
+def mock_config_from_args(args):
+    """根据 add_mock_arguments 添加的参数创建 MockConfig"""
+    return MockConfig(
+        latency=args.latency, output_tokens=args.output_tokens, output_tps=args.output_tps,
+        rpm=args.mock_rpm, tpm=args.mock_tpm, error_rates=dict(args.error_rate),
+        timeout_rate=args.timeout_rate, hang_seconds=args.hang_seconds, seed=args.seed,
+        batch_seconds=args.batch_seconds, prefill_tps=args.prefill_tps,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的LLM服务，用于离线测试延迟、并发、限流和重试')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址，默认为127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口，默认为8765')
+    add_mock_arguments(parser)
+
+    args = parser.parse_args()
+
+    try:
+        provider = MockProvider(mock_config_from_args(args), args.host, args.port)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return
+
+    print("模拟服务已启动，在 api_keys.ini 中将 api_url 设置为:")
+    print(f"  SiliconFlow/OpenAI: {provider.url('openai')}")
+    print(f"  Anthropic:          {provider.url('anthropic')}")
+    try:
+        provider.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"共处理 {sum(provider.statuses.values())} 个请求: {dict(provider.statuses)}")
+
+if __name__ == "__main__":
+    main()
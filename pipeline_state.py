@@ -0,0 +1,62 @@
+import os
+import json
+import hashlib
+
+# 增量处理状态文件的默认路径
+STATE_FILE = ".pipeline_state.json"
+
+def load_state(state_file=STATE_FILE):
+    """
+    加载增量处理状态
+
+    状态文件记录:
+    - sources: 每个聊天记录文件上次处理到的位置 {文件路径: {offset, tail_hash, last_date, updated}}
+    - conclusions: 已生成总结的清理结果 {清理后的文件名: {sha256, apis, conclusion, updated}}
+
+    Args:
+        state_file: 状态文件路径
+
+    Returns:
+        状态字典
+    """
+    state = {}
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"警告: 无法读取状态文件 '{state_file}'，将重新开始记录: {e}")
+            state = {}
+
+    state.setdefault('sources', {})
+    state.setdefault('conclusions', {})
+    return state
+
+def save_state(state, state_file=STATE_FILE):
+    """
+    保存增量处理状态（先写临时文件再替换，避免中途退出时损坏状态文件）
+
+    Args:
+        state: 状态字典
+        state_file: 状态文件路径
+    """
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, state_file)
+
+def file_digest(path):
+    """
+    计算文件内容的SHA-256摘要，用于判断清理结果是否变化
+
+    Args:
+        path: 文件路径
+
+    Returns:
+        十六进制摘要字符串
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,7 +1,31 @@
 from datetime import datetime, timedelta
 import re
+import io
 import os
 import argparse
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from filter_engine import FilterEngine, load_filter_engine, set_rule_timeout, get_rule_timeout
+from date_index import load_date_index, tail_hash
+from message_parser import MessageLog, parse_header, from_timestamp
+from message_store import MESSAGE_DB, MessageStore, export_text
+from dedup import dedup_content, dedup_file, format_dedup_stats
+from pipeline_state import STATE_FILE, load_state, save_state
+from metrics import METRICS
+from profiler import PROFILE_DIR, PROFILE_TOP, start_profiler
+
+# 并行清理时，每个进程平均分到的分片数（分片多一些便于各进程负载均衡）
+SHARDS_PER_JOB = 4
+# 分片大小的下限和上限（字节），小文件不切分，超大文件的分片不会占用过多内存
+SHARD_MIN_BYTES = 1 << 20
+SHARD_MAX_BYTES = 64 << 20
+# 流式处理时每批清理的消息字符数，按批应用清理规则，避免逐条消息调用的开销
+STREAM_BATCH_CHARS = 1 << 20
+
+# 消息头（如 2025-03-18 10:08:26 昵称(QQ号)），并行清理时只在消息头所在行切分文件
+MESSAGE_HEADER = re.compile(rb'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
 
 def get_last_message_date(content):
     """
@@ -25,18 +49,22 @@ def get_last_message_date(content):
     # 如果没有找到日期，返回当前日期
     return datetime.now()
 
-def parse_date_range(date_str, content=None):
+def parse_date_range(date_str, content=None, index=None):
     """
     解析日期范围字符串
     
     Args:
         date_str: 日期范围字符串，格式为 "YYYY-MM-DD" 或 "YYYY-MM-DD=YYYY-MM-DD"
         content: 聊天记录内容，用于获取最后一条消息的日期
+        index: 聊天记录的日期索引（DateIndex），提供时直接使用其中记录的最后日期
     
     Returns:
         (start_date, end_date): 开始日期和结束日期的元组
     """
     if not date_str:
+        if index is not None:
+            last_date = index.last_date or datetime.now()
+            return last_date, last_date
         # 如果没有指定日期且提供了内容，使用最后一条消息的日期
         if content:
             last_date = get_last_message_date(content)
@@ -99,6 +127,44 @@ def filter_by_date(content, start_date, end_date):
     
     return '\n'.join(filtered_lines)
 
+def filter_senders(content, exclude_senders):
+    """
+    移除指定发送者的消息（整条消息，包括消息头和正文）
+    
+    Args:
+        content: 聊天记录内容
+        exclude_senders: 需要排除的发送者昵称或QQ号集合
+    
+    Returns:
+        筛选后的内容
+    """
+    log = MessageLog.parse(content)
+    return log.to_text(log.exclude_senders(exclude_senders))
+
+def exclude_sender_blocks(texts, exclude_senders):
+    """
+    逐块移除指定发送者的消息，结果与 filter_senders 相同
+    
+    iter_message_blocks 在任何以日期开头的行处切分，消息正文中以日期开头的行也会
+    成为单独的块；只有完整匹配消息头（HEADER_PATTERN）的块才开始一条新消息，
+    其余的块属于上一条消息，随上一条消息一起保留或移除。
+    
+    Args:
+        texts: 按顺序排列的消息块原文
+        exclude_senders: 需要排除的发送者昵称或QQ号集合
+    
+    Yields:
+        保留的消息块原文
+    """
+    excluded = False
+    for text in texts:
+        header = parse_header(text.split('\n', 1)[0])
+        if header is not None:
+            _, name, qq = header
+            excluded = name in exclude_senders or str(qq) in exclude_senders
+        if not excluded:
+            yield text
+
 def load_filter_keywords(filter_file='filter_keywords.txt'):
     """
     从配置文件中加载需要过滤的关键词
@@ -109,20 +175,123 @@ def load_filter_keywords(filter_file='filter_keywords.txt'):
     Returns:
         包含所有过滤关键词的列表
     """
-    if not os.path.exists(filter_file):
-        print(f"警告: 过滤配置文件 '{filter_file}' 不存在，将使用默认过滤规则")
-        return []
+    return load_filter_engine(filter_file).keywords
+
+def get_last_message_date_from_file(input_file):
+    """
+    逐行扫描文件，获取最后一条消息的日期，不将整个文件读入内存
+    
+    Args:
+        input_file: 聊天记录文件路径
     
-    keywords = []
-    with open(filter_file, 'r', encoding='utf-8') as f:
+    Returns:
+        最后一条消息的日期（datetime对象）或当前日期
+    """
+    last_match = None
+    with open(input_file, 'r', encoding='utf-8') as f:
         for line in f:
-            line = line.strip()
-            if line and not line.startswith('#'):
-                keywords.append(line)
+            date_matches = re.findall(r'(\d{4})-(\d{2})-(\d{2})', line)
+            if date_matches:
+                last_match = date_matches[-1]
     
-    return keywords
+    if last_match:
+        year, month, day = map(int, last_match)
+        return datetime(year, month, day)
+    
+    return datetime.now()
+
+def build_output_path(input_file, start_date, end_date, output_dir=None):
+    """
+    根据输入文件名和日期范围生成默认输出文件路径
+    
+    Args:
+        input_file: 输入文件路径
+        start_date: 开始日期
+        end_date: 结束日期
+        output_dir: 输出目录，默认为输入文件所在目录旁的 outputs 目录
+    
+    Returns:
+        输出文件路径，格式为 outputs/cleaned_原文件名_日期范围.txt
+    """
+    base_name = os.path.basename(input_file)
+    
+    # 创建输出目录（如果不存在）
+    if output_dir is None:
+        output_dir = os.path.join(os.path.dirname(input_file), "../outputs")
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    # 修改输出文件名格式：根据日期范围命名
+    filename, ext = os.path.splitext(base_name)
+    
+    # 根据日期范围生成文件名部分
+    if start_date == end_date:
+        date_suffix = start_date.strftime('%Y-%m-%d')
+    else:
+        date_suffix = f"{start_date.strftime('%Y-%m-%d')}={end_date.strftime('%Y-%m-%d')}"
+    
+    return os.path.join(output_dir, f"cleaned_{filename}_{date_suffix}{ext}")
+
+def strip_headers(content):
+    """
+    移除文件头部的元信息和每条消息的日期时间行，剩下的文本即过滤规则作用的内容
+    
+    Args:
+        content: 聊天记录文本
+    
+    Returns:
+        处理后的文本
+    """
+    # 移除文件头部的元信息
+    content = re.sub(r'消息记录（此消息记录为文本格式，不支持重新导入）\n+', '', content)
+    content = re.sub(r'={64,}\n消息分组:.*\n={64,}\n消息对象:.*\n={64,}\n+', '', content)
+    
+    # 移除日期时间行 (匹配格式如 2025-03-18 10:08:26)
+    return re.sub(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} [^\n]+\n', '', content)
+
+def clean_content(content, filter_engine):
+    """
+    对一段聊天记录文本应用清理规则（不包括最后的空行清理）
+    
+    整体处理和流式处理共用此函数：整体处理时传入日期筛选后的全部内容，
+    流式处理时按批（若干条完整的消息）传入。
+    
+    Args:
+        content: 日期筛选后的聊天记录文本
+        filter_engine: 预编译的自定义过滤规则（见 filter_engine.load_filter_engine）
+    
+    Returns:
+        清理后的文本
+    """
+    with METRICS.stage('strip_headers'):
+        content = strip_headers(content)
+    
+    with METRICS.stage('keyword_rules'):
+        # 应用自定义过滤规则（所有规则一次扫描，逐行应用）
+        content = filter_engine.apply_lines(content)
+    
+    with METRICS.stage('strip_markup'):
+        # 基本过滤规则（保持原有功能）
+        content = content.replace('[图片]', '')
+        
+        # 替换多个连续空行为单个空行
+        content = re.sub(r'\n{3,}', '\n\n', content)
+        
+        # 移除每行开头的QQ号格式 (12345678)
+        content = re.sub(r'\([0-9]+\)', '', content)
+        
+        # 移除@用户名 格式
+        content = re.sub(r'@[^ ]+ @[^ ]+ ', '', content)
+        content = re.sub(r'@[^ ]+ ', '', content)
+        
+        # 移除QQ表情代码
+        content = re.sub(r'\[表情\]', '', content)
+        content = re.sub(r'\[流泪\][^\n]*', '', content)
+        content = re.sub(r'\[[^\]]+\]', '', content)  # 移除所有方括号包围的表情
+    
+    return content
 
-def clean_chat_log(input_file, output_file=None, verbose=False, filter_file='filter_keywords.txt', date_range=None):
+def clean_chat_log(input_file, output_file=None, verbose=False, filter_file='filter_keywords.txt', date_range=None, use_index=True, exclude_senders=None, dedup=False):
     """
     清理QQ聊天记录:
     1. 根据日期范围筛选内容
@@ -138,110 +307,680 @@ def clean_chat_log(input_file, output_file=None, verbose=False, filter_file='fil
         verbose: 是否显示详细信息
         filter_file: 过滤关键词配置文件路径
         date_range: 日期范围字符串，格式为 "YYYY-MM-DD" 或 "YYYY-MM-DD=YYYY-MM-DD"
+        use_index: 是否使用日期索引，只读取日期范围内的内容（见 date_index.py）
+        exclude_senders: 需要排除的发送者昵称或QQ号集合，例如群管家等机器人
+        dedup: 是否合并重复和相似的消息（见 dedup.py）
     
     Returns:
-        处理后的文本内容
+        处理后的文本内容（超大文件使用 clean_chat_log_stream，只写出文件，不返回内容）
     """
     if not os.path.exists(input_file):
         raise FileNotFoundError(f"找不到输入文件: {input_file}")
     
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read()
+    index = load_date_index(input_file) if use_index else None
+    if index is not None:
+        # 通过日期索引直接定位，只读取日期范围内的内容
+        original_lines = index.line_count
+        start_date, end_date = parse_date_range(date_range, index=index)
+        with METRICS.stage('read'):
+            content = index.read(start_date, end_date)
+    else:
+        with METRICS.stage('read'):
+            with open(input_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+        
+        # 记录原始行数
+        original_lines = content.count('\n') + 1
+        
+        # 解析日期范围
+        start_date, end_date = parse_date_range(date_range, content)
+        
+        # 根据日期范围筛选内容
+        with METRICS.stage('date_filter'):
+            content = filter_by_date(content, start_date, end_date)
     
-    # 记录原始行数
-    original_lines = content.count('\n') + 1
+    if exclude_senders:
+        with METRICS.stage('sender_filter'):
+            content = filter_senders(content, exclude_senders)
     
-    # 解析日期范围
-    start_date, end_date = parse_date_range(date_range, content)
+    if output_file is None:
+        output_file = build_output_path(input_file, start_date, end_date)
     
-    # 根据日期范围筛选内容
-    content = filter_by_date(content, start_date, end_date)
+    filter_engine = load_filter_engine(filter_file)
+    content, processed_lines = write_cleaned_content(content, filter_engine, output_file, dedup)
     
-    if output_file is None:
-        dir_name = os.path.dirname(input_file)
-        base_name = os.path.basename(input_file)
-        
-        # 创建输出目录（如果不存在）
-        output_dir = os.path.join(dir_name, "../outputs")
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
-        # 修改输出文件名格式：根据日期范围命名
-        filename, ext = os.path.splitext(base_name)
-        
-        # 根据日期范围生成文件名部分
-        if start_date == end_date:
-            date_suffix = start_date.strftime('%Y-%m-%d')
-        else:
-            date_suffix = f"{start_date.strftime('%Y-%m-%d')}={end_date.strftime('%Y-%m-%d')}"
+    print_clean_summary(input_file, output_file, verbose, original_lines, processed_lines, filter_engine, start_date, end_date)
+    
+    return content
+
+def write_cleaned_content(content, filter_engine, output_file, dedup=False):
+    """
+    清理日期筛选后的内容并写入输出文件
+    
+    Args:
+        content: 日期筛选后的聊天记录文本
+        filter_engine: 预编译的自定义过滤规则
+        output_file: 输出文件路径
+        dedup: 是否合并重复和相似的消息
+    
+    Returns:
+        (清理后的文本, 行数)
+    """
+    content = clean_content(content, filter_engine)
+    
+    with METRICS.stage('strip_blank_lines'):
+        # 清理剩余的空行
+        content = re.sub(r'^\s*$\n', '', content, flags=re.MULTILINE)
         
-        output_file = os.path.join(output_dir, f"cleaned_{filename}_{date_suffix}{ext}")
+        # 移除开头和结尾的空行
+        content = content.strip()
     
-    # 移除文件头部的元信息
-    content = re.sub(r'消息记录（此消息记录为文本格式，不支持重新导入）\n+', '', content)
-    content = re.sub(r'={64,}\n消息分组:.*\n={64,}\n消息对象:.*\n={64,}\n+', '', content)
+    if dedup:
+        with METRICS.stage('dedup'):
+            content, stats = dedup_content(content)
+        print(f"去重: {format_dedup_stats(stats)}")
     
-    # 移除日期时间行 (匹配格式如 2025-03-18 10:08:26)
-    content = re.sub(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} [^\n]+\n', '', content)
+    # 计算处理后的行数
+    processed_lines = content.count('\n') + 1
     
-    # 应用自定义过滤规则
-    filter_keywords = load_filter_keywords(filter_file)
-    for keyword in filter_keywords:
-        try:
-            # 尝试按正则表达式处理
-            if keyword.startswith('\\'):
-                content = re.sub(r'' + keyword, '', content)
-            else:
-                # 普通文本替换
-                content = content.replace(keyword, '')
-        except re.error:
-            # 如果正则表达式无效，按普通文本处理
-            content = content.replace(keyword, '')
+    with METRICS.stage('write'):
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(content)
     
-    # 基本过滤规则（保持原有功能）
-    content = content.replace('[图片]', '')
+    return content, processed_lines
+
+def clean_chat_log_from_store(db_path=MESSAGE_DB, group=None, output_file=None, verbose=False, filter_file='filter_keywords.txt', date_range=None, keyword=None, exclude_senders=None, output_dir='outputs', dedup=False):
+    """
+    从消息数据库（见 message_store.py）中提取一段聊天记录并清理，不需要重新读取原始导出文件
     
-    # 替换多个连续空行为单个空行
-    content = re.sub(r'\n{3,}', '\n\n', content)
+    Args:
+        db_path: 数据库文件路径
+        group: 群名称或源文件名，数据库中只有一个群时可以为None
+        output_file: 输出文件路径，如果为None则在 output_dir 中自动生成"cleaned_"前缀的文件名
+        verbose: 是否显示详细信息
+        filter_file: 过滤关键词配置文件路径
+        date_range: 日期范围字符串；未指定时，指定了关键词则检索全部日期，否则使用最后一条消息的日期
+        keyword: 只保留正文包含此关键词的消息
+        exclude_senders: 需要排除的发送者昵称或QQ号集合
+        output_dir: 自动生成输出文件名时的输出目录
+        dedup: 是否合并重复和相似的消息
     
-    # 移除每行开头的QQ号格式 (12345678)
-    content = re.sub(r'\([0-9]+\)', '', content)
+    Returns:
+        输出文件路径
+    """
+    group_name, start_date, end_date, rows = query_store(db_path, group, date_range, keyword)
     
-    # 移除@用户名 格式
-    content = re.sub(r'@[^ ]+ @[^ ]+ ', '', content)
-    content = re.sub(r'@[^ ]+ ', '', content)
+    content = export_text(rows)
+    if exclude_senders:
+        content = filter_senders(content, exclude_senders)
+    original_lines = content.count('\n') + 1
     
-    # 移除QQ表情代码
-    content = re.sub(r'\[表情\]', '', content)
-    content = re.sub(r'\[流泪\][^\n]*', '', content)
-    content = re.sub(r'\[[^\]]+\]', '', content)  # 移除所有方括号包围的表情
+    if output_file is None:
+        output_file = store_output_path(group_name, start_date, end_date, keyword, output_dir)
     
-    # 清理剩余的空行
-    content = re.sub(r'^\s*$\n', '', content, flags=re.MULTILINE)
+    filter_engine = load_filter_engine(filter_file)
+    _, processed_lines = write_cleaned_content(content, filter_engine, output_file, dedup)
     
-    # 移除开头和结尾的空行
-    content = content.strip()
+    print_clean_summary(f"{db_path}:{group_name}", output_file, verbose, original_lines, processed_lines, filter_engine, start_date, end_date)
     
-    # 计算处理后的行数
-    processed_lines = content.count('\n') + 1
+    return output_file
+
+def query_store(db_path=MESSAGE_DB, group=None, date_range=None, keyword=None):
+    """
+    从消息数据库中查询一段聊天记录（参数含义与 clean_chat_log_from_store 相同）
+    
+    Returns:
+        (群名称, 开始日期, 结束日期, 消息行列表)
+    """
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"找不到消息数据库: {db_path}，请先运行 python message_store.py 导入聊天记录")
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(content)
+    with MessageStore(db_path) as store:
+        group_id, group_name = store.find_group(group)
+        if date_range:
+            start_date, end_date = parse_date_range(date_range)
+        elif keyword:
+            start_date, end_date = None, None
+        else:
+            last_date = store.last_date(group_id) or datetime.now()
+            start_date, end_date = last_date, last_date
+        with METRICS.stage('db_query'):
+            rows = store.query(group_id, start_date, end_date, keyword)
+    
+    if start_date is None:
+        # 按关键词检索全部日期时，以检索结果的日期范围命名
+        if rows:
+            timestamps = [row[0] for row in rows]
+            start_date, end_date = (datetime.combine(from_timestamp(timestamp).date(), datetime.min.time()) for timestamp in (min(timestamps), max(timestamps)))
+        else:
+            start_date = end_date = datetime.now()
     
+    return group_name, start_date, end_date, rows
+
+def store_output_path(group_name, start_date, end_date, keyword=None, output_dir='outputs'):
+    """
+    生成从消息数据库提取的聊天记录的输出文件路径（不存在时创建输出目录）
+    
+    Returns:
+        输出文件路径，格式为 output_dir/cleaned_群名称[_关键词]_日期范围.txt
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    if start_date == end_date:
+        date_suffix = start_date.strftime('%Y-%m-%d')
+    else:
+        date_suffix = f"{start_date.strftime('%Y-%m-%d')}={end_date.strftime('%Y-%m-%d')}"
+    name = f"{group_name}_{keyword}" if keyword else group_name
+    file_name = re.sub(r'[\\/:*?"<>|\s]+', '_', name)
+    return os.path.join(output_dir, f"cleaned_{file_name}_{date_suffix}.txt")
+
+def print_clean_summary(input_file, output_file, verbose, original_lines, processed_lines, filter_engine, start_date, end_date):
+    """输出清理结果统计信息，并计入运行指标"""
+    METRICS.inc('cleaned_files')
+    METRICS.inc('clean_input_lines', original_lines)
+    METRICS.inc('clean_output_lines', processed_lines)
     if verbose:
         print(f"已清理聊天记录 '{input_file}' -> '{output_file}'")
         print(f"  - 原始行数: {original_lines}")
         print(f"  - 处理后行数: {processed_lines}")
         print(f"  - 减少了 {original_lines - processed_lines} 行 ({100 * (original_lines - processed_lines) / original_lines:.1f}%)")
-        if filter_keywords:
-            print(f"  - 应用了 {len(filter_keywords)} 个自定义过滤规则")
+        if filter_engine:
+            print(f"  - 应用了 {len(filter_engine)} 个自定义过滤规则")
         print(f"  - 日期范围: {start_date.strftime('%Y-%m-%d')} 到 {end_date.strftime('%Y-%m-%d')}")
     else:
         print(f"已清理聊天记录并保存至: {output_file}")
+
+def iter_message_blocks(lines):
+    """
+    将逐行输入按消息头（以日期开头的行）切分为消息块
     
-    return content
+    Args:
+        lines: 可迭代的文本行（保留行尾换行符）
+    
+    Yields:
+        (date, text): 消息日期（第一条消息之前的内容为None）和消息块原文
+    """
+    current_date = None
+    block = []
+    for line in lines:
+        date = extract_date_from_line(line)
+        if date:
+            if block:
+                yield current_date, ''.join(block)
+            current_date = date
+            block = [line]
+        else:
+            block.append(line)
+    
+    if block:
+        yield current_date, ''.join(block)
 
-def process_all_chat_logs(directory='inputs/', verbose=False, filter_file='filter_keywords.txt', date_range=None):
+def filter_message_blocks(blocks, start_date, end_date):
+    """
+    按日期范围筛选消息块，结果与 filter_by_date 拼接后的内容一致
+    
+    filter_by_date 用换行符连接保留的行，因此当最后一个保留的消息块之后
+    还有被丢弃的内容时，需要去掉它末尾的换行符。
+    
+    Args:
+        blocks: iter_message_blocks 生成的 (date, text) 序列
+        start_date: 开始日期
+        end_date: 结束日期
+    
+    Yields:
+        日期范围内的消息块原文
+    """
+    pending = None
+    dropped_after_pending = False
+    for date, text in blocks:
+        if date and start_date <= date <= end_date:
+            if pending is not None:
+                yield pending
+            pending = text
+            dropped_after_pending = False
+        else:
+            dropped_after_pending = True
+    
+    if pending is not None:
+        if dropped_after_pending and pending.endswith('\n'):
+            pending = pending[:-1]
+        yield pending
+
+def batch_message_blocks(texts, max_chars=STREAM_BATCH_CHARS):
+    """
+    把逐条的消息块合并为约 max_chars 个字符的批次，批次只在消息之间切开
+    
+    Args:
+        texts: 按顺序排列的消息块原文
+        max_chars: 每批的字符数（单条消息更长时单独成为一批）
+    
+    Yields:
+        每批消息拼接后的文本
+    """
+    batch = []
+    size = 0
+    for text in texts:
+        batch.append(text)
+        size += len(text)
+        if size >= max_chars:
+            yield ''.join(batch)
+            batch, size = [], 0
+    if batch:
+        yield ''.join(batch)
+
+def write_cleaned_lines(texts, f):
+    """
+    按片段写出清理后的文本：丢弃空白行，并去除整体首尾的空白
+    
+    等价于整体处理时最后的 re.sub(r'^\s*$\n', ...) 与 strip()，
+    但只需缓存一个片段的内容，每个片段只写一次文件。
+    
+    Args:
+        texts: 清理后的文本片段序列
+        f: 已打开的输出文件
+    
+    Returns:
+        写出的行数
+    """
+    buffer = ''
+    # 最后一个保留的行，之后是否还有内容决定它末尾的空白是否去除
+    pending = None
+    written = 0
+    
+    def write(lines):
+        nonlocal pending, written
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return
+        if pending is None:
+            lines[0] = lines[0].lstrip()
+        else:
+            lines.insert(0, pending)
+        pending = lines.pop()
+        if lines:
+            f.write('\n'.join(lines))
+            f.write('\n')
+            written += len(lines)
+    
+    for text in texts:
+        buffer += text
+        *complete, buffer = buffer.split('\n')
+        write(complete)
+    write([buffer])
+    
+    if pending is not None:
+        f.write(pending.rstrip())
+    
+    return written + 1
+
+def clean_chat_log_stream(input_file, output_file=None, verbose=False, filter_file='filter_keywords.txt', date_range=None, use_index=True, exclude_senders=None, dedup=False):
+    """
+    流式清理QQ聊天记录，适用于GB级别的导出文件
+    
+    逐行读取文件，依次经过以下生成器阶段，并增量写出结果:
+    切分消息 → 日期筛选 → 排除发送者 → 合并为批次 → 移除文件头/消息头 → 自定义过滤 → 移除表情/@/QQ号 → 清理空行
+    内存占用只与批次大小（STREAM_BATCH_CHARS）和单条消息的大小有关。清理规则按批应用，
+    跨越批次接缝的匹配（例如行尾的@用户名吞掉下一批的第一条消息）不会发生
+    （与并行清理的分片相同），其余结果与 clean_chat_log 相同。
+    
+    Args:
+        input_file: 输入文件路径
+        output_file: 输出文件路径，如果为None则自动生成"cleaned_"前缀的文件名
+        verbose: 是否显示详细信息
+        filter_file: 过滤关键词配置文件路径
+        date_range: 日期范围字符串，格式为 "YYYY-MM-DD" 或 "YYYY-MM-DD=YYYY-MM-DD"
+        use_index: 是否使用日期索引，只读取日期范围内的内容（见 date_index.py）
+        exclude_senders: 需要排除的发送者昵称或QQ号集合
+        dedup: 是否合并重复和相似的消息（在写出清理结果后对输出文件进行，只占用与输出大小相关的内存）
+    
+    Returns:
+        输出文件路径
+    """
+    if not os.path.exists(input_file):
+        raise FileNotFoundError(f"找不到输入文件: {input_file}")
+    
+    index = load_date_index(input_file) if use_index else None
+    
+    # 解析日期范围（未指定且没有索引时需要先扫描一遍文件获取最后的日期）
+    if date_range or index is not None:
+        start_date, end_date = parse_date_range(date_range, index=index)
+    else:
+        last_date = get_last_message_date_from_file(input_file)
+        start_date, end_date = last_date, last_date
+    
+    if output_file is None:
+        output_file = build_output_path(input_file, start_date, end_date)
+    
+    filter_engine = load_filter_engine(filter_file)
+    
+    original_lines = 1
+    
+    def read_lines():
+        nonlocal original_lines
+        with open(input_file, 'r', encoding='utf-8') as fin:
+            for line in fin:
+                if line.endswith('\n'):
+                    original_lines += 1
+                yield line
+    
+    if index is not None:
+        # 通过日期索引直接定位，只读取日期范围内的内容
+        original_lines = index.line_count
+        lines = index.iter_lines(start_date, end_date)
+    else:
+        lines = read_lines()
+    
+    with open(output_file, 'w', encoding='utf-8') as fout:
+        blocks = iter_message_blocks(lines)
+        texts = filter_message_blocks(blocks, start_date, end_date)
+        if exclude_senders:
+            texts = exclude_sender_blocks(texts, exclude_senders)
+        texts = (clean_content(text, filter_engine) for text in batch_message_blocks(texts))
+        processed_lines = write_cleaned_lines(texts, fout)
+    
+    if dedup:
+        with METRICS.stage('dedup'):
+            processed_lines, stats = dedup_file(output_file)
+        print(f"去重: {format_dedup_stats(stats)}")
+    
+    print_clean_summary(input_file, output_file, verbose, original_lines, processed_lines, filter_engine, start_date, end_date)
+    
+    return output_file
+
+def split_at_message_headers(input_file, spans, shard_size):
+    """
+    将文件中的字节区间切分为大小约为 shard_size 的分片，切分点都在消息头所在行的开头
+    
+    Args:
+        input_file: 聊天记录文件路径
+        spans: 字节区间 [(begin, end), ...] 列表
+        shard_size: 分片的目标大小（字节）
+    
+    Returns:
+        分片的字节区间列表，按文件中的顺序排列
+    """
+    shards = []
+    with open(input_file, 'rb') as f:
+        for begin, stop in spans:
+            while stop - begin > shard_size:
+                f.seek(begin + shard_size)
+                # 跳过被切断的行，从下一行开始查找消息头
+                f.readline()
+                boundary = None
+                while f.tell() < stop:
+                    position = f.tell()
+                    line = f.readline()
+                    if not line:
+                        break
+                    if MESSAGE_HEADER.match(line):
+                        boundary = position
+                        break
+                if boundary is None:
+                    break
+                shards.append((begin, boundary))
+                begin = boundary
+            shards.append((begin, stop))
+    return shards
+
+def plan_clean_shards(input_file, date_range=None, use_index=True, jobs=1, filter_file='filter_keywords.txt', exclude_senders=None):
+    """
+    确定一个文件的日期范围，并把需要清理的内容切分为可以并行清理的分片
+    
+    有日期索引时只切分日期范围内的内容；没有索引时切分整个文件，由各分片自行按日期筛选。
+    
+    Args:
+        input_file: 输入文件路径
+        date_range: 日期范围字符串，格式为 "YYYY-MM-DD" 或 "YYYY-MM-DD=YYYY-MM-DD"
+        use_index: 是否使用日期索引
+        jobs: 并行进程数，决定分片的数量
+        filter_file: 过滤关键词配置文件路径，为None时不使用自定义过滤规则
+        exclude_senders: 需要排除的发送者昵称或QQ号集合
+    
+    Returns:
+        清理计划字典: input_file、start_date、end_date、original_lines（没有索引时为None，
+        由各分片统计）和 tasks（_clean_shard 的参数列表）
+    """
+    if not os.path.exists(input_file):
+        raise FileNotFoundError(f"找不到输入文件: {input_file}")
+    
+    index = load_date_index(input_file) if use_index else None
+    if index is not None:
+        start_date, end_date = parse_date_range(date_range, index=index)
+        spans, reaches_end = index.spans(start_date, end_date)
+        window = None
+        original_lines = index.line_count
+    else:
+        if date_range:
+            start_date, end_date = parse_date_range(date_range)
+        else:
+            last_date = get_last_message_date_from_file(input_file)
+            start_date, end_date = last_date, last_date
+        size = os.path.getsize(input_file)
+        spans = [(0, size)] if size else []
+        reaches_end = True
+        window = (start_date, end_date)
+        original_lines = None
+    
+    total = sum(stop - begin for begin, stop in spans)
+    shard_size = min(max(total // (jobs * SHARDS_PER_JOB), SHARD_MIN_BYTES), SHARD_MAX_BYTES)
+    shards = split_at_message_headers(input_file, spans, shard_size)
+    
+    tasks = [(input_file, begin, stop, filter_file, window, exclude_senders, False) for begin, stop in shards]
+    if tasks and not reaches_end:
+        # 与 filter_by_date 一致，日期范围之后还有内容时去掉末尾的换行符
+        tasks[-1] = tasks[-1][:-1] + (True,)
+    
+    return {
+        'input_file': input_file,
+        'start_date': start_date,
+        'end_date': end_date,
+        'original_lines': original_lines,
+        'tasks': tasks,
+    }
+
+def _clean_shard(task):
+    """
+    在子进程中清理一个分片
+    
+    Args:
+        task: plan_clean_shards 生成的 (文件路径, 起始偏移, 结束偏移, 过滤规则文件, 日期范围, 排除的发送者, 是否去掉末尾换行符)
+    
+    Returns:
+        (清理后的文本, 分片中的换行符数量, 各阶段耗时): 阶段耗时由主进程合并到运行指标中
+    """
+    input_file, begin, stop, filter_file, window, exclude_senders, trim_newline = task
+    # 子进程会被复用（fork 时还会继承主进程的指标），只返回本分片的阶段耗时
+    METRICS.reset_stages()
+    with METRICS.stage('read'), open(input_file, 'rb') as f:
+        f.seek(begin)
+        text = f.read(stop - begin).decode('utf-8')
+    # 换行符统一为 \n（与以文本模式读取文件时一致）
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    newlines = text.count('\n')
+    
+    if window is not None:
+        start_date, end_date = window
+        with METRICS.stage('date_filter'):
+            text = ''.join(block for date, block in iter_message_blocks(io.StringIO(text)) if date and start_date <= date <= end_date)
+    if exclude_senders:
+        with METRICS.stage('sender_filter'):
+            text = filter_senders(text, exclude_senders)
+    if trim_newline and text.endswith('\n'):
+        text = text[:-1]
+    
+    # 过滤规则按文件修改时间缓存，每个进程只编译一次
+    filter_engine = load_filter_engine(filter_file) if filter_file else FilterEngine([])
+    text = clean_content(text, filter_engine)
+    return text, newlines, METRICS.reset_stages()
+
+def _ordered_results(pool, fn, tasks, window):
+    """
+    按顺序返回进程池执行各任务的结果，最多同时提交 window 个任务，避免结果堆积在内存中
+    
+    Args:
+        pool: 进程池
+        fn: 任务函数
+        tasks: 任务参数序列
+        window: 同时提交的任务数上限
+    
+    Yields:
+        各任务的返回值，与 tasks 的顺序相同
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(fn, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def clean_chat_logs_parallel(input_files, jobs, verbose=False, filter_file='filter_keywords.txt', date_range=None, use_index=True, output_files=None, exclude_senders=None, dedup=False):
+    """
+    使用多个进程清理聊天记录，适用于多核机器上的大量或超大的导出文件
+    
+    多个文件分配到同一个进程池中并行处理，单个大文件在消息头处切分为多个分片，
+    所有核心都参与清理。各分片的结果按原顺序拼接并增量写出，分片接缝处的空行
+    与整体处理时一样被清理。清理规则按分片应用，跨越分片接缝的匹配不会发生
+    （与流式处理相同，见 clean_chat_log_stream），其余结果与 clean_chat_log 相同。
+    
+    Args:
+        input_files: 输入文件路径列表
+        jobs: 并行进程数
+        verbose: 是否显示详细信息
+        filter_file: 过滤关键词配置文件路径
+        date_range: 日期范围字符串，格式为 "YYYY-MM-DD" 或 "YYYY-MM-DD=YYYY-MM-DD"
+        use_index: 是否使用日期索引
+        output_files: 与 input_files 对应的输出文件路径列表，为None时自动生成"cleaned_"前缀的文件名
+        exclude_senders: 需要排除的发送者昵称或QQ号集合
+        dedup: 是否合并重复和相似的消息（在写出清理结果后对输出文件进行）
+    
+    Returns:
+        输出文件路径列表
+    """
+    # 在主进程中加载一次，过滤配置文件不存在时只提示一次
+    filter_engine = load_filter_engine(filter_file)
+    shard_filter_file = filter_file if os.path.exists(filter_file) else None
+    
+    output_paths = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=set_rule_timeout, initargs=(get_rule_timeout(),)) as pool:
+        planner = partial(plan_clean_shards, date_range=date_range, use_index=use_index, jobs=jobs, filter_file=shard_filter_file, exclude_senders=exclude_senders)
+        plans = list(pool.map(planner, input_files))
+        
+        tasks = (task for plan in plans for task in plan['tasks'])
+        results = _ordered_results(pool, _clean_shard, tasks, jobs * SHARDS_PER_JOB)
+        
+        for i, plan in enumerate(plans):
+            input_file = plan['input_file']
+            start_date, end_date = plan['start_date'], plan['end_date']
+            output_file = output_files[i] if output_files and output_files[i] else build_output_path(input_file, start_date, end_date)
+            
+            newlines = 0
+            
+            def texts():
+                nonlocal newlines
+                for _ in plan['tasks']:
+                    text, count, stages = next(results)
+                    newlines += count
+                    METRICS.merge_stages(stages)
+                    yield text
+            
+            with open(output_file, 'w', encoding='utf-8') as fout:
+                processed_lines = write_cleaned_lines(texts(), fout)
+            
+            if dedup:
+                with METRICS.stage('dedup'):
+                    processed_lines, stats = dedup_file(output_file)
+                print(f"去重: {format_dedup_stats(stats)}")
+            
+            original_lines = plan['original_lines'] if plan['original_lines'] is not None else newlines + 1
+            print_clean_summary(input_file, output_file, verbose, original_lines, processed_lines, filter_engine, start_date, end_date)
+            output_paths.append(output_file)
+    
+    return output_paths
+
+def clean_chat_log_incremental(input_file, state, verbose=False, filter_file='filter_keywords.txt', stream=False, exclude_senders=None, dedup=False):
+    """
+    增量清理聊天记录：只重新清理上次处理之后新追加的消息所涉及的日期
+    
+    每个涉及的日期单独输出一个 cleaned_原文件名_日期.txt 文件（当天已有的输出会被更新）。
+    首次处理某个文件（或文件被重新导出、不再是追加关系）时，与常规模式一样只处理最后一天。
+    
+    Args:
+        input_file: 输入文件路径
+        state: 增量处理状态（见 pipeline_state.load_state），处理后会更新其中的记录
+        verbose: 是否显示详细信息
+        filter_file: 过滤关键词配置文件路径
+        stream: 是否使用流式处理
+        exclude_senders: 需要排除的发送者昵称或QQ号集合
+        dedup: 是否合并重复和相似的消息
+    
+    Returns:
+        本次清理输出的文件路径列表，每个日期一个，没有新消息时为空列表
+    """
+    if not os.path.exists(input_file):
+        raise FileNotFoundError(f"找不到输入文件: {input_file}")
+    
+    clean = clean_chat_log_stream if stream else clean_chat_log
+    index = load_date_index(input_file)
+    if index is None:
+        print(f"警告: 无法为 '{input_file}' 建立日期索引，将按常规方式处理且不记录增量状态")
+        last_date = get_last_message_date_from_file(input_file)
+        output_file = build_output_path(input_file, last_date, last_date)
+        clean(input_file, output_file, verbose=verbose, filter_file=filter_file, date_range=last_date.strftime('%Y-%m-%d'), use_index=False, exclude_senders=exclude_senders, dedup=dedup)
+        return [output_file]
+    
+    key = os.path.normpath(input_file)
+    record = state['sources'].get(key)
+    if record and record['offset'] <= index.size and tail_hash(input_file, record['offset']) == record['tail_hash']:
+        if record['offset'] == index.size:
+            print(f"'{input_file}' 没有新消息，跳过")
+            return []
+        dates = index.dates_since(record['offset'])
+    else:
+        start_date, _ = parse_date_range(None, index=index)
+        dates = [start_date]
+    
+    output_files = []
+    for date in dates:
+        output_file = build_output_path(input_file, date, date)
+        clean(input_file, output_file, verbose=verbose, filter_file=filter_file, date_range=date.strftime('%Y-%m-%d'), exclude_senders=exclude_senders, dedup=dedup)
+        output_files.append(output_file)
+    
+    state['sources'][key] = {
+        'offset': index.size,
+        'tail_hash': tail_hash(input_file, index.size),
+        'last_date': dates[-1].strftime('%Y-%m-%d') if dates else None,
+        'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    
+    if verbose:
+        print(f"  - 增量处理了 {len(dates)} 天的消息")
+    
+    return output_files
+
+def _clean_incremental_job(input_file, record, verbose=False, filter_file='filter_keywords.txt', stream=False, exclude_senders=None, dedup=False):
+    """
+    在子进程中增量清理一个文件
+    
+    Args:
+        input_file: 输入文件路径
+        record: 该文件在增量处理状态中的记录，首次处理时为None
+        verbose: 是否显示详细信息
+        filter_file: 过滤关键词配置文件路径
+        stream: 是否使用流式处理
+        exclude_senders: 需要排除的发送者昵称或QQ号集合
+        dedup: 是否合并重复和相似的消息
+    
+    Returns:
+        更新后的记录
+    """
+    key = os.path.normpath(input_file)
+    state = {'sources': {key: record} if record else {}, 'conclusions': {}}
+    clean_chat_log_incremental(input_file, state, verbose=verbose, filter_file=filter_file, stream=stream, exclude_senders=exclude_senders, dedup=dedup)
+    return state['sources'].get(key)
+
+def process_all_chat_logs(directory='inputs/', verbose=False, filter_file='filter_keywords.txt', date_range=None, stream=False, use_index=True, incremental=False, state_file=STATE_FILE, jobs=1, exclude_senders=None, dedup=False):
     """
     处理指定目录下的所有聊天记录文件
     
@@ -250,6 +989,13 @@ def process_all_chat_logs(directory='inputs/', verbose=False, filter_file='filte
         verbose: 是否显示详细信息
         filter_file: 过滤关键词配置文件路径
         date_range: 日期范围字符串
+        stream: 是否使用流式处理（非增量的多进程清理已按分片增量写出，忽略此参数）
+        use_index: 是否使用日期索引
+        incremental: 是否增量处理（忽略date_range，见 clean_chat_log_incremental）
+        state_file: 增量处理状态文件路径
+        jobs: 并行进程数，大于1时使用多进程清理（见 clean_chat_logs_parallel）
+        exclude_senders: 需要排除的发送者昵称或QQ号集合
+        dedup: 是否合并重复和相似的消息
     
     Returns:
         处理的文件数量
@@ -258,12 +1004,39 @@ def process_all_chat_logs(directory='inputs/', verbose=False, filter_file='filte
         print(f"警告: 目录不存在: {directory}")
         return 0
     
+    state = load_state(state_file) if incremental else None
+    
+    input_paths = [os.path.join(directory, filename) for filename in os.listdir(directory)
+                   if filename.endswith('.txt') and not filename.startswith('cleaned_')]
+    
+    if jobs > 1 and incremental:
+        # 各文件在子进程中增量清理，每完成一个文件就合并并保存状态
+        with ProcessPoolExecutor(max_workers=jobs, initializer=set_rule_timeout, initargs=(get_rule_timeout(),)) as pool:
+            futures = {
+                pool.submit(_clean_incremental_job, input_path, state['sources'].get(os.path.normpath(input_path)), verbose, filter_file, stream, exclude_senders, dedup): input_path
+                for input_path in input_paths
+            }
+            for future in as_completed(futures):
+                record = future.result()
+                if record is not None:
+                    state['sources'][os.path.normpath(futures[future])] = record
+                save_state(state, state_file)
+        return len(input_paths)
+    
+    if jobs > 1:
+        clean_chat_logs_parallel(input_paths, jobs, verbose=verbose, filter_file=filter_file, date_range=date_range, use_index=use_index, exclude_senders=exclude_senders, dedup=dedup)
+        return len(input_paths)
+    
+    clean = clean_chat_log_stream if stream else clean_chat_log
     count = 0
-    for filename in os.listdir(directory):
-        if filename.endswith('.txt') and not filename.startswith('cleaned_'):
-            input_path = os.path.join(directory, filename)
-            clean_chat_log(input_path, verbose=verbose, filter_file=filter_file, date_range=date_range)
-            count += 1
+    for input_path in input_paths:
+        if incremental:
+            clean_chat_log_incremental(input_path, state, verbose=verbose, filter_file=filter_file, stream=stream, exclude_senders=exclude_senders, dedup=dedup)
+            # 每处理完一个文件就保存状态，中途退出后重新运行不会重复处理
+            save_state(state, state_file)
+        else:
+            clean(input_path, verbose=verbose, filter_file=filter_file, date_range=date_range, use_index=use_index, exclude_senders=exclude_senders, dedup=dedup)
+        count += 1
     
     return count
 
@@ -275,17 +1048,75 @@ def main():
     parser.add_argument('-v', '--verbose', action='store_true', help='显示详细处理信息')
     parser.add_argument('-k', '--keywords', default='filter_keywords.txt', help='指定过滤关键词配置文件路径')
     parser.add_argument('-t', '--date', help='指定日期范围，格式为 "YYYY-MM-DD" 或 "YYYY-MM-DD=YYYY-MM-DD"')
+    parser.add_argument('--stream', action='store_true', help='流式逐行处理，适用于超大的聊天记录文件')
+    parser.add_argument('--no-index', action='store_true', help='不使用日期索引，每次都读取整个文件')
+    parser.add_argument('--incremental', action='store_true', help='增量处理，只清理上次运行后新增消息所在的日期（忽略 -t 和 -o）')
+    parser.add_argument('--state-file', default=STATE_FILE, help=f'增量处理状态文件路径，默认为{STATE_FILE}')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='并行清理的进程数，多个文件和单个大文件都会分配到各进程，0 表示使用全部CPU核心，默认为1')
+    parser.add_argument('-x', '--exclude-sender', nargs='+', default=[], help='排除指定发送者（昵称或QQ号）的消息，例如群管家等机器人，可指定多个')
+    parser.add_argument('--db', nargs='?', const=MESSAGE_DB, help=f'从消息数据库中提取聊天记录（先用 message_store.py 导入），默认为{MESSAGE_DB}')
+    parser.add_argument('--group', help='使用 --db 时指定群名称或源文件名，数据库中只有一个群时可省略')
+    parser.add_argument('--search', help='使用 --db 时只保留包含此关键词的消息，未指定 -t 时检索全部日期')
+    parser.add_argument('--dedup', action='store_true', help='合并连续重复的消息（标注次数）和相似的消息（如改了几个字的广告），减少总结时的token数')
+    parser.add_argument('--rule-timeout', type=float, default=0, help='每条过滤规则的执行时间上限（秒），超过时跳过并停用该规则，避免一条回溯严重的规则拖住整个清理，默认为0（不限制）')
+    parser.add_argument('--metrics-json', help='运行结束时将各阶段耗时等指标写入JSON报告')
+    parser.add_argument('--metrics-textfile', help='运行结束时将指标写入 Prometheus node-exporter 的 textfile（.prom 文件）')
+    parser.add_argument('--profile', nargs='?', const=PROFILE_DIR, help=f'分析各阶段的CPU耗时、内存分配和每条过滤规则的耗时，结果保存在此目录中并打印摘要，默认为{PROFILE_DIR}')
+    parser.add_argument('--profile-top', type=int, default=PROFILE_TOP, help=f'性能分析摘要中每一类列出的条目数，默认为{PROFILE_TOP}')
     
     args = parser.parse_args()
+    METRICS.write_at_exit(args.metrics_json, args.metrics_textfile, 'process_chat_logs')
+    if args.profile:
+        start_profiler(args.profile, 'process_chat_logs', args.profile_top)
+    exclude_senders = set(args.exclude_sender)
+    
+    if (args.search or args.group) and not args.db:
+        print("错误: --search 和 --group 只能与 --db 一起使用")
+        return
+    if args.jobs < 0:
+        print("错误: --jobs 不能为负数")
+        return
+    if args.rule_timeout < 0:
+        print("错误: --rule-timeout 不能为负数")
+        return
+    set_rule_timeout(args.rule_timeout)
+    jobs = args.jobs or os.cpu_count() or 1
+    if args.profile and jobs > 1:
+        # 子进程中的耗时和内存分配无法统计
+        print("提示: --profile 时使用单进程清理，忽略 -j")
+        jobs = 1
+    if args.stream and jobs > 1 and not args.incremental and not args.db:
+        # 多进程清理按分片读取并边处理边写出，内存占用与分片大小有关，不需要逐行处理
+        print("提示: 多进程清理已按分片增量写出，忽略 --stream")
+
+    if args.db:
+        try:
+            clean_chat_log_from_store(args.db, args.group, args.output, verbose=args.verbose, filter_file=args.keywords, date_range=args.date, keyword=args.search, exclude_senders=exclude_senders, dedup=args.dedup)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"错误: {e}")
+            return
+        print("处理完成!")
+        return
+    
+    if args.incremental and (args.date or args.output):
+        print("提示: 增量处理按新增消息的日期输出，忽略 -t 和 -o 参数")
     
     if args.file:
-        clean_chat_log(args.file, args.output, verbose=args.verbose, filter_file=args.keywords, date_range=args.date)
+        if args.incremental:
+            state = load_state(args.state_file)
+            clean_chat_log_incremental(args.file, state, verbose=args.verbose, filter_file=args.keywords, stream=args.stream, exclude_senders=exclude_senders, dedup=args.dedup)
+            save_state(state, args.state_file)
+        elif jobs > 1:
+            clean_chat_logs_parallel([args.file], jobs, verbose=args.verbose, filter_file=args.keywords, date_range=args.date, use_index=not args.no_index, output_files=[args.output], exclude_senders=exclude_senders, dedup=args.dedup)
+        else:
+            clean = clean_chat_log_stream if args.stream else clean_chat_log
+            clean(args.file, args.output, verbose=args.verbose, filter_file=args.keywords, date_range=args.date, use_index=not args.no_index, exclude_senders=exclude_senders, dedup=args.dedup)
         print("处理完成!")
     elif args.directory:
-        count = process_all_chat_logs(args.directory, verbose=args.verbose, filter_file=args.keywords, date_range=args.date)
+        count = process_all_chat_logs(args.directory, verbose=args.verbose, filter_file=args.keywords, date_range=args.date, stream=args.stream, use_index=not args.no_index, incremental=args.incremental, state_file=args.state_file, jobs=jobs, exclude_senders=exclude_senders, dedup=args.dedup)
         print(f"处理完成! 共处理了 {count} 个聊天记录文件")
     else:
-        count = process_all_chat_logs(verbose=args.verbose, filter_file=args.keywords, date_range=args.date)
+        count = process_all_chat_logs(verbose=args.verbose, filter_file=args.keywords, date_range=args.date, stream=args.stream, use_index=not args.no_index, incremental=args.incremental, state_file=args.state_file, jobs=jobs, exclude_senders=exclude_senders, dedup=args.dedup)
         print(f"处理完成! 共处理了 {count} 个聊天记录文件")
 
 if __name__ == "__main__":
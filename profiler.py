@@ -0,0 +1,254 @@
+import os
+import io
+import atexit
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+import filter_engine
+from metrics import METRICS
+
+# 默认的性能分析结果目录，每次运行在其中新建一个子目录
+PROFILE_DIR = 'profiles'
+
+# 摘要中每一类列出的条目数
+PROFILE_TOP = 15
+
+# 每个阶段前几次执行时比较执行前后的内存快照，统计分配内存的位置（快照较慢，不对每次执行都比较）
+SNAPSHOT_CALLS = 3
+
+# 内存快照中忽略的分配位置
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+class StageProfiler:
+    """
+    按处理阶段（metrics.Metrics.stage）分别收集 cProfile 统计和 tracemalloc 内存分配
+
+    - CPU: 每个阶段一个 cProfile，阶段之外的时间计入整体统计；各线程分别统计后合并
+    - 内存: 主线程中每个阶段的内存峰值增量，以及前 SNAPSHOT_CALLS 次执行时新分配内存最多的代码行
+    - 过滤规则: filter_keywords.txt 中每条规则的耗时和删除的字符数（见 filter_engine.profile_rules）
+
+    结束时在输出目录中写入 run.prof（全部）、stage-<阶段>.prof、memory.snapshot 和 summary.txt，
+    .prof 文件可以用 python -m pstats 或 snakeviz 等工具查看。
+    """
+
+    def __init__(self, directory, script, top=PROFILE_TOP):
+        """
+        Args:
+            directory: 结果目录，在其中新建 <脚本>-<时间> 子目录
+            script: 脚本名称
+            top: 摘要中每一类列出的条目数
+        """
+        self.directory = os.path.join(directory, f"{script}-{datetime.now():%Y%m%d-%H%M%S}")
+        self.script = script
+        self.top = top
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._main = threading.main_thread()
+        self._run = cProfile.Profile()
+        # {阶段: [各线程的 cProfile]}
+        self._profiles = {}
+        # 主线程中正在执行的阶段: [[阶段, 执行前的内存, 峰值增量, 执行前的快照]]
+        self._frames = []
+        # {阶段: 最大的内存峰值增量}
+        self._memory_peaks = {}
+        # {阶段: 已比较快照的次数}
+        self._snapshot_calls = {}
+        # {(阶段, 文件, 行号): 新分配的字节数}
+        self._allocations = {}
+        self._peak = 0
+        self._finished = False
+
+    def start(self):
+        """开始分析"""
+        tracemalloc.start()
+        filter_engine.profile_rules()
+        self._stack().append(self._run)
+        self._run.enable()
+        METRICS.profiler = self
+
+    def _stack(self):
+        """当前线程正在执行的 cProfile 栈，主线程的栈底是整体统计"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+            self._local.profiles = {}
+        return stack
+
+    def _fold_peak(self):
+        """把当前的内存峰值计入正在执行的各阶段，然后重新开始记录峰值"""
+        current, peak = tracemalloc.get_traced_memory()
+        self._peak = max(self._peak, peak)
+        for frame in self._frames:
+            frame[2] = max(frame[2], peak - frame[1])
+        tracemalloc.reset_peak()
+        return current
+
+    def stage_started(self, name):
+        """阶段开始: 主线程中记录执行前的内存，然后切换到该阶段的 cProfile"""
+        stack = self._stack()
+        if stack and stack[-1] is not None:
+            stack[-1].disable()
+
+        if threading.current_thread() is self._main and tracemalloc.is_tracing():
+            snapshot = None
+            if self._snapshot_calls.get(name, 0) < SNAPSHOT_CALLS:
+                self._snapshot_calls[name] = self._snapshot_calls.get(name, 0) + 1
+                snapshot = tracemalloc.take_snapshot()
+            # 快照本身占用的内存计入执行前的内存，不算作阶段的峰值增量
+            self._frames.append([name, self._fold_peak(), 0, snapshot])
+
+        profile = self._local.profiles.get(name)
+        if profile is None:
+            profile = self._local.profiles[name] = cProfile.Profile()
+            with self._lock:
+                self._profiles.setdefault(name, []).append(profile)
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12 起同一时间只能有一个 cProfile 在运行，其他线程的阶段不单独统计
+            profile = None
+        stack.append(profile)
+
+    def stage_finished(self, name):
+        """阶段结束: 主线程中记录内存峰值增量和新分配内存的位置，然后切换回外层的 cProfile"""
+        stack = self._stack()
+        if len(stack) <= (1 if threading.current_thread() is self._main else 0):
+            # 开始分析之前就已经在执行的阶段
+            return
+        profile = stack.pop()
+        if profile is not None:
+            profile.disable()
+
+        if threading.current_thread() is self._main and self._frames and self._frames[-1][0] == name:
+            self._fold_peak()
+            _, _, peak, snapshot = self._frames.pop()
+            self._memory_peaks[name] = max(self._memory_peaks.get(name, 0), peak)
+            if snapshot is not None:
+                after = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+                for diff in after.compare_to(snapshot.filter_traces(_SNAPSHOT_FILTERS), 'lineno'):
+                    if diff.size_diff > 0:
+                        frame = diff.traceback[0]
+                        key = (name, frame.filename, frame.lineno)
+                        self._allocations[key] = self._allocations.get(key, 0) + diff.size_diff
+
+        if stack and stack[-1] is not None:
+            stack[-1].enable()
+
+    def finish(self):
+        """
+        停止分析，写出结果文件并打印摘要
+
+        Returns:
+            摘要文本
+        """
+        if self._finished:
+            return None
+        self._finished = True
+        METRICS.profiler = None
+        self._run.disable()
+        rules = filter_engine.profile_rules(False)
+        snapshot = None
+        if tracemalloc.is_tracing():
+            self._fold_peak()
+            snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+            tracemalloc.stop()
+
+        os.makedirs(self.directory, exist_ok=True)
+        total = pstats.Stats(self._run)
+        for name, profiles in sorted(self._profiles.items()):
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(os.path.join(self.directory, f"stage-{name}.prof"))
+            total.add(stats)
+        total.dump_stats(os.path.join(self.directory, 'run.prof'))
+        if snapshot is not None:
+            snapshot.dump(os.path.join(self.directory, 'memory.snapshot'))
+
+        summary = self.summary(total, rules, snapshot)
+        with open(os.path.join(self.directory, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write(summary)
+        print(summary, end='')
+        return summary
+
+    def summary(self, stats, rules, snapshot=None):
+        """
+        生成性能分析摘要: 各阶段耗时和内存、最耗时的函数、最耗时的过滤规则、分配内存最多的位置
+
+        Args:
+            stats: 合并后的 pstats.Stats
+            rules: 过滤规则耗时统计 {规则: [执行次数, 秒数, 删除的字符数]}
+            snapshot: 结束时的内存快照
+
+        Returns:
+            摘要文本
+        """
+        top = self.top
+        out = io.StringIO()
+        out.write(f"\n===== 性能分析: {self.script}（结果保存在 {self.directory}）=====\n")
+        out.write(f"内存峰值: {_format_bytes(self._peak)}（tracemalloc 统计的Python对象，不含解释器本身）\n")
+
+        if METRICS.stages:
+            out.write("\n各阶段（耗时为实际经过的时间，内存为主线程中单次执行的峰值增量）:\n")
+            for name, (count, seconds) in sorted(METRICS.stages.items(), key=lambda item: -item[1][1]):
+                memory = self._memory_peaks.get(name)
+                memory = _format_bytes(memory) if memory is not None else '-'
+                out.write(f"  {name:<20} {count:>8} 次 {seconds:10.3f} s {memory:>12}\n")
+
+        functions = sorted(stats.stats.items(), key=lambda item: -item[1][2])[:top]
+        if functions:
+            out.write(f"\n最耗时的函数（按自身耗时，前{top}）:\n")
+            for (filename, lineno, func), (_, calls, tottime, cumtime, _) in functions:
+                location = f"{_short_path(filename)}:{lineno}({func})" if lineno else func
+                out.write(f"  {tottime:9.3f} s 自身 {cumtime:9.3f} s 累计 {calls:>10} 次  {location}\n")
+
+        if rules:
+            out.write(f"\n最耗时的过滤规则（前{top}，共 {len(rules)} 条）:\n")
+            for keyword, (calls, seconds, removed) in sorted(rules.items(), key=lambda item: -item[1][1])[:top]:
+                kind = '正则' if keyword.startswith('\\') else '文本'
+                out.write(f"  {seconds:9.4f} s {kind} 删除 {removed:>10} 字符  {keyword}\n")
+
+        if self._allocations:
+            out.write(f"\n各阶段新分配内存最多的位置（每个阶段前 {SNAPSHOT_CALLS} 次执行，前{top}）:\n")
+            for (name, filename, lineno), size in sorted(self._allocations.items(), key=lambda item: -item[1])[:top]:
+                out.write(f"  {_format_bytes(size):>12}  {_short_path(filename)}:{lineno}  [{name}]\n")
+        if snapshot is not None:
+            out.write(f"\n结束时占用内存最多的位置（前{top}）:\n")
+            for stat in snapshot.statistics('lineno')[:top]:
+                frame = stat.traceback[0]
+                out.write(f"  {_format_bytes(stat.size):>12}  {_short_path(frame.filename)}:{frame.lineno}  {stat.count} 个对象\n")
+        return out.getvalue()
+
+def _short_path(filename):
+    """摘要中显示的文件名，包的 __init__.py 带上包名"""
+    parts = filename.replace('\\', '/').split('/')
+    return '/'.join(parts[-2:]) if parts[-1] == '__init__.py' else parts[-1]
+
+def _format_bytes(size):
+    if size >= 1 << 20:
+        return f"{size / (1 << 20):.1f} MB"
+    return f"{size / (1 << 10):.1f} KB"
+
+def start_profiler(directory=PROFILE_DIR, script=None, top=PROFILE_TOP):
+    """
+    开始性能分析，程序退出时（包括出错退出）写出结果并打印摘要
+
+    Args:
+        directory: 结果目录
+        script: 脚本名称
+        top: 摘要中每一类列出的条目数
+
+    Returns:
+        StageProfiler 对象
+    """
+    profiler = StageProfiler(directory, script, top)
+    profiler.start()
+    atexit.register(profiler.finish)
+    return profiler
@@ -0,0 +1,270 @@
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS
+
+# 连接超时和读取超时（秒），生成较长总结时读取可能需要较长时间
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+
+# 遇到限流、服务端错误或网络错误时的最大重试次数
+MAX_RETRIES = 4
+
+# 指数退避的基础等待时间和最长等待时间（秒）
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# 需要重试的HTTP状态码
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504, 529}
+
+# 连续这么多个请求（重试耗尽后）失败时熔断，熔断期间直接失败，不再发送请求
+BREAKER_THRESHOLD = 5
+# 熔断多少秒后放行一个试探请求
+BREAKER_RESET = 60.0
+
+# 每个API源的连接池大小
+DEFAULT_POOL_SIZE = 4
+
+def record_attempt(name, status, seconds, ttfb=None):
+    """
+    记录一次HTTP请求（每次重试分别记录）的状态码和耗时
+
+    Args:
+        name: API源名称
+        status: HTTP状态码，网络错误时为 'error'
+        seconds: 从发出请求到收到完整响应（流式响应为收到响应头）的秒数
+        ttfb: 从发出请求到收到响应头的秒数
+    """
+    METRICS.inc('api_requests', api=name, status=str(status))
+    METRICS.observe('api_request_duration', seconds, api=name)
+    if ttfb is not None:
+        METRICS.observe('api_ttfb', ttfb, api=name)
+
+class CircuitOpenError(ValueError):
+    """API源处于熔断状态时抛出"""
+
+def parse_retry_after(value):
+    """
+    解析 Retry-After 响应头
+
+    Args:
+        value: 响应头的值，可以是秒数或HTTP日期
+
+    Returns:
+        需要等待的秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    计算第 attempt 次重试前的等待时间（指数退避加随机抖动，不少于 Retry-After）
+
+    Args:
+        attempt: 已重试的次数（从0开始）
+        retry_after: 服务端要求等待的秒数，没有时为None
+
+    Returns:
+        等待秒数
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, BACKOFF_MAX))
+    return delay
+
+class CircuitBreaker:
+    """
+    单个API源的熔断器
+
+    连续 BREAKER_THRESHOLD 个请求失败后熔断 BREAKER_RESET 秒，熔断期间直接失败；
+    时间过后放行一个试探请求，成功则恢复，失败则继续熔断。
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            name: API源名称
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def before_request(self):
+        """检查熔断状态，熔断期间抛出 CircuitOpenError"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + BREAKER_RESET - time.monotonic()
+            if remaining > 0 or self._probing:
+                raise CircuitOpenError(f"{self.name} API连续失败 {self._failures} 次，已暂停请求（约 {max(0, int(remaining))} 秒后重试）")
+            # 熔断时间已过，放行一个试探请求
+            self._probing = True
+
+    def release(self):
+        """放弃一个请求且不记录结果（例如请求被取消），试探请求被放弃时允许下一个请求重新试探"""
+        with self._lock:
+            self._probing = False
+
+    def record(self, success):
+        """
+        记录一个请求（重试耗尽后）的结果
+
+        Args:
+            success: 请求是否成功
+        """
+        with self._lock:
+            self._probing = False
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._failures >= BREAKER_THRESHOLD:
+                if self._opened_at is None:
+                    print(f"警告: {self.name} API连续失败 {self._failures} 次，暂停请求 {int(BREAKER_RESET)} 秒")
+                self._opened_at = time.monotonic()
+
+class ProviderClient:
+    """
+    单个API源的HTTP客户端
+
+    复用同一个 requests.Session（保持连接，避免每次请求重新建立TLS连接），
+    对限流、服务端错误和网络错误按指数退避加随机抖动重试（优先使用 Retry-After），
+    连续失败时熔断一段时间，避免在服务不可用时继续排队请求。
+    """
+
+    def __init__(self, name, pool_size=DEFAULT_POOL_SIZE, max_retries=MAX_RETRIES,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        """
+        Args:
+            name: API源名称
+            pool_size: 连接池大小，应不小于对该API源的并发请求数
+            max_retries: 最大重试次数
+            connect_timeout: 连接超时（秒）
+            read_timeout: 读取超时（秒）
+        """
+        self.name = name
+        self.max_retries = max_retries
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.breaker = CircuitBreaker(name)
+
+    def post(self, url, **kwargs):
+        """发送POST请求，必要时重试（见 request）"""
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """发送GET请求，必要时重试（见 request）"""
+        return self.request('GET', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        发送请求，必要时重试
+
+        Args:
+            method: 请求方法，如 'POST'
+            url: 请求地址
+            **kwargs: 传给 requests.Session.request 的其他参数（headers、json等）
+
+        Returns:
+            requests.Response 对象；重试耗尽时返回最后一次的响应，由调用方处理错误状态码
+
+        Raises:
+            CircuitOpenError: API源处于熔断状态
+            requests.exceptions.RequestException: 重试耗尽后仍然出现网络错误，或出现不可重试的请求错误
+        """
+        self.breaker.before_request()
+        kwargs.setdefault('timeout', self.timeout)
+
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                record_attempt(self.name, 'error', time.monotonic() - start)
+                if attempt >= self.max_retries:
+                    self.breaker.record(False)
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"{self.name} API网络错误，{delay:.1f} 秒后重试 ({attempt + 1}/{self.max_retries}): {e}")
+            except Exception:
+                # InvalidURL、TooManyRedirects、ChunkedEncodingError 等重试无意义，直接失败；
+                # 同样要记录结果，否则半开试探状态不会解除，该API源会一直处于熔断
+                record_attempt(self.name, 'error', time.monotonic() - start)
+                self.breaker.record(False)
+                raise
+            else:
+                # 流式响应时 post 在收到响应头后即返回，此时两者相同
+                record_attempt(self.name, response.status_code, time.monotonic() - start, response.elapsed.total_seconds())
+                if response.status_code not in RETRY_STATUS_CODES:
+                    # 4xx 等请求本身的错误重试也不会成功，不计入熔断
+                    self.breaker.record(response.status_code < 500)
+                    return response
+                if attempt >= self.max_retries:
+                    self.breaker.record(False)
+                    return response
+                delay = backoff_delay(attempt, parse_retry_after(response.headers.get('retry-after')))
+                print(f"{self.name} API返回状态码 {response.status_code}，{delay:.1f} 秒后重试 ({attempt + 1}/{self.max_retries})")
+                response.close()
+
+            METRICS.inc('api_retries', api=self.name)
+            time.sleep(delay)
+            attempt += 1
+
+# 每个API源共用一个客户端: {API源名称: ProviderClient}
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+_pool_size = DEFAULT_POOL_SIZE
+
+def configure_clients(pool_size):
+    """
+    设置之后创建的客户端的连接池大小（按并发请求数设置），并丢弃已创建的客户端
+
+    Args:
+        pool_size: 连接池大小
+    """
+    global _pool_size
+    with _CLIENTS_LOCK:
+        _pool_size = max(1, pool_size)
+        for client in _CLIENTS.values():
+            client.session.close()
+        _CLIENTS.clear()
+
+def get_client(name):
+    """
+    获取API源共用的HTTP客户端
+
+    Args:
+        name: API源名称
+
+    Returns:
+        ProviderClient 对象
+    """
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(name)
+        if client is None:
+            client = _CLIENTS[name] = ProviderClient(name, pool_size=_pool_size)
+        return client
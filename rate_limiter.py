@@ -0,0 +1,187 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+# 统计请求数和token数的时间窗口（秒）
+WINDOW_SECONDS = 60.0
+
+class ProviderLimiter:
+    """
+    单个API源的并发和速率限制
+
+    同时进行的请求数不超过 concurrency，任意60秒内的请求数不超过 rpm、
+    估算的token数（输入加最大输出）不超过 tpm。rpm、tpm 为0时不限制。
+    """
+
+    def __init__(self, name, concurrency=4, rpm=0, tpm=0):
+        """
+        Args:
+            name: API源名称
+            concurrency: 最大并发请求数
+            rpm: 每分钟最多请求数，0表示不限制
+            tpm: 每分钟最多token数，0表示不限制
+        """
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.rpm = rpm
+        self.tpm = tpm
+        self._active = 0
+        self._window = deque()  # (请求开始时间, token数)
+        self._window_tokens = 0
+        self._condition = threading.Condition()
+
+    def _expire(self, now):
+        while self._window and self._window[0][0] <= now - WINDOW_SECONDS:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    def _wait_time(self, tokens, now):
+        """返回还需等待的秒数，0表示现在可以发送请求"""
+        if self._active >= self.concurrency:
+            return None
+        waits = [0.0]
+        if self.rpm and len(self._window) >= self.rpm:
+            waits.append(self._window[-self.rpm][0] + WINDOW_SECONDS - now)
+        if self.tpm and self._window and self._window_tokens + tokens > self.tpm:
+            # 从最早的请求开始，找到释放足够token后的时间；单个请求超过tpm时等窗口清空
+            excess = self._window_tokens + tokens - self.tpm
+            released = 0
+            for start, used in self._window:
+                released += used
+                if released >= excess:
+                    break
+            waits.append(start + WINDOW_SECONDS - now)
+        return max(waits)
+
+    def acquire(self, tokens=0):
+        """
+        等待直到可以发送一个请求，并登记该请求
+
+        Args:
+            tokens: 请求估算的token数
+        """
+        waited = False
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                wait = self._wait_time(tokens, now)
+                if wait is not None and wait <= 0:
+                    break
+                if not waited and wait is not None:
+                    print(f"{self.name} API达到速率限制，等待 {wait:.1f} 秒")
+                    waited = True
+                # 并发已满时等待其他请求结束；速率受限时等待窗口滑动
+                self._condition.wait(wait)
+
+            self._active += 1
+            self._window.append((now, tokens))
+            self._window_tokens += tokens
+
+    def release(self):
+        """请求结束，释放并发名额"""
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def limit(self, tokens=0):
+        """
+        在 with 语句中发送请求，自动登记和释放
+
+        Args:
+            tokens: 请求估算的token数
+        """
+        self.acquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+class AsyncProviderLimiter(ProviderLimiter):
+    """
+    在 asyncio 事件循环中使用的并发和速率限制，规则与 ProviderLimiter 相同
+
+    等待时让出事件循环而不是阻塞线程，只能在创建它的事件循环中使用。
+    """
+
+    def __init__(self, name, concurrency=4, rpm=0, tpm=0):
+        super().__init__(name, concurrency, rpm, tpm)
+        self._released = asyncio.Event()
+
+    async def acquire(self, tokens=0):
+        """
+        等待直到可以发送一个请求，并登记该请求
+
+        Args:
+            tokens: 请求估算的token数
+        """
+        waited = False
+        while True:
+            now = time.monotonic()
+            self._expire(now)
+            wait = self._wait_time(tokens, now)
+            if wait is not None and wait <= 0:
+                break
+            if not waited and wait is not None:
+                print(f"{self.name} API达到速率限制，等待 {wait:.1f} 秒")
+                waited = True
+            if wait is None:
+                # 并发已满，等待其他请求结束
+                self._released.clear()
+                await self._released.wait()
+            else:
+                await asyncio.sleep(wait)
+
+        self._active += 1
+        self._window.append((now, tokens))
+        self._window_tokens += tokens
+
+    def release(self):
+        """请求结束，释放并发名额"""
+        self._active -= 1
+        self._released.set()
+
+    @asynccontextmanager
+    async def limit(self, tokens=0):
+        """
+        在 async with 语句中发送请求，自动登记和释放
+
+        Args:
+            tokens: 请求估算的token数
+        """
+        await self.acquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+# 每个API源共用一个限流器: {API源名称: ProviderLimiter}
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+def get_limiter(name, config):
+    """
+    获取API源共用的限流器
+
+    Args:
+        name: API源名称
+        config: 该API源的配置（load_api_config 返回值中的一项），读取 concurrency、rpm、tpm
+
+    Returns:
+        ProviderLimiter 对象
+    """
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(name)
+        if limiter is None:
+            limiter = _LIMITERS[name] = ProviderLimiter(
+                name, config.get('concurrency', 4), config.get('rpm', 0), config.get('tpm', 0)
+            )
+        return limiter
+
+def reset_limiters():
+    """丢弃已创建的限流器，之后按新的配置重新创建（配置文件热加载后使用）"""
+    with _LIMITERS_LOCK:
+        _LIMITERS.clear()
@@ -0,0 +1,329 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+from filter_engine import FilterEngine, read_filter_keywords, backtracking_risk
+from process_chat_logs import strip_headers
+from synthetic_export import parse_size
+
+# 默认的样本大小
+DEFAULT_SAMPLE_SIZE = '5MB'
+
+# 每条规则在样本上执行的时间上限（秒），超过时终止并视为发生了灾难性回溯
+RULE_TIMEOUT = 5.0
+
+# 不以 \ 开头（按普通文本处理）但看起来像正则表达式的写法
+REGEX_LIKE = re.compile(r'\.[*+?]|\\[dDwWsS]|\[\^|\{\d+,\d*\}|^\^')
+
+# 贪婪的 .* 或 .+（前面不是转义符，后面不是 ?）
+GREEDY_DOT = re.compile(r'(?<!\\)\.([*+])(?![?+])')
+
+LEVEL_NAMES = {'error': '错误', 'warning': '警告'}
+
+def load_sample(paths, size):
+    """
+    读取样本：从各聊天记录开头平均读取共约 size 字节，并去掉文件头和日期时间行（与过滤规则实际作用的内容相同）
+
+    Args:
+        paths: 聊天记录文件路径列表
+        size: 样本总大小（字节）
+
+    Returns:
+        样本文本
+    """
+    share = max(1, size // max(1, len(paths)))
+    parts = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read(share)
+            # 在完整的行处截断，避免切开多字节字符
+            if len(data) == share and b'\n' in data:
+                data = data[:data.rindex(b'\n') + 1]
+        parts.append(strip_headers(data.decode('utf-8', errors='ignore').replace('\r\n', '\n')))
+    return ''.join(parts)
+
+def count_matches(keyword, compiled, text):
+    """
+    按逐行的语义统计一条规则在文本中的命中情况
+
+    Args:
+        keyword: 规则
+        compiled: 编译后的正则，普通文本规则为None
+        text: 文本
+
+    Returns:
+        (命中次数, 命中行数, 被删空的行数)
+    """
+    if compiled is None and keyword not in text:
+        return 0, 0, 0
+    hits = lines = emptied = 0
+    for line in text.split('\n'):
+        if compiled is None:
+            count = line.count(keyword)
+            rest = line.replace(keyword, '') if count else line
+        else:
+            rest, count = compiled.subn('', line)
+        if count:
+            hits += count
+            lines += 1
+            if not rest.strip():
+                emptied += 1
+    return hits, lines, emptied
+
+def measure_rule(engine, index, sample, content):
+    """
+    在样本上执行一条规则并统计命中次数、耗时和删除的字节数
+
+    Args:
+        engine: FilterEngine 对象
+        index: 规则下标
+        sample: 原始样本，用于判断规则是否被前面的规则覆盖
+        content: 按顺序执行完前面的规则后的样本
+
+    Returns:
+        (统计字典, 执行此规则后的样本)
+    """
+    keyword, compiled = engine.rules[index]
+    start = time.perf_counter()
+    new_content = engine._apply_rule(index, content)
+    seconds = time.perf_counter() - start
+
+    hits, lines, emptied = count_matches(keyword, compiled, content)
+    result = {
+        'hits': hits,
+        'lines': lines,
+        'emptied_lines': emptied,
+        'bytes_removed': len(content.encode('utf-8')) - len(new_content.encode('utf-8')),
+        'seconds': seconds,
+        # 单独在原始样本上执行时的命中次数
+        'standalone_hits': hits if hits or index == 0 else count_matches(keyword, compiled, sample)[0],
+    }
+
+    if compiled is not None and hits and GREEDY_DOT.search(keyword):
+        # 与非贪婪的写法比较，多删除的内容就是贪婪匹配越过目标吃掉的文字
+        try:
+            lazy = re.compile(GREEDY_DOT.sub(r'.\1?', keyword))
+        except re.error:
+            lazy = None
+        if lazy is not None:
+            lazy_content = '\n'.join(lazy.sub('', line) for line in content.split('\n'))
+            result['greedy_extra_bytes'] = len(lazy_content.encode('utf-8')) - len(new_content.encode('utf-8'))
+    return result, new_content
+
+def _worker(conn, keywords, sample, replay):
+    """子进程: 先按顺序执行已完成的规则，再逐条接收规则下标并返回统计结果"""
+    engine = FilterEngine(keywords)
+    content = sample
+    for index in replay:
+        content = engine._apply_rule(index, content)
+    conn.send(None)
+    for index in iter(conn.recv, None):
+        result, content = measure_rule(engine, index, sample, content)
+        conn.send(result)
+
+def run_rules(keywords, sample, timeout=RULE_TIMEOUT):
+    """
+    按文件中的顺序在样本上逐条执行规则，每条规则有时间上限
+
+    正则在C代码中执行时无法中断，规则在子进程中执行，超时后终止子进程，
+    再启动新的子进程重放已完成的规则，跳过超时的规则继续执行。
+
+    Args:
+        keywords: 规则列表
+        sample: 样本文本
+        timeout: 每条规则的时间上限（秒）
+
+    Returns:
+        {规则下标: 统计字典}，超时的规则为 {'timeout': True}
+    """
+    results = {}
+    applied = []
+    index = 0
+    while index < len(keywords):
+        parent, child = multiprocessing.Pipe()
+        worker = multiprocessing.Process(target=_worker, args=(child, keywords, sample, applied), daemon=True)
+        worker.start()
+        try:
+            parent.recv()
+            while index < len(keywords):
+                parent.send(index)
+                if not parent.poll(timeout):
+                    results[index] = {'timeout': True}
+                    index += 1
+                    break
+                results[index] = parent.recv()
+                applied.append(index)
+                index += 1
+            else:
+                parent.send(None)
+        finally:
+            if worker.is_alive():
+                worker.join(1)
+            if worker.is_alive():
+                worker.kill()
+                worker.join()
+            parent.close()
+    return results
+
+def static_issues(keywords, engine):
+    """
+    不需要样本的检查: 无效的正则、看起来像正则的普通文本、重复的规则、被前面的普通文本规则覆盖的规则、回溯风险
+
+    Returns:
+        {规则下标: [(级别, 说明)]}
+    """
+    issues = {index: [] for index in range(len(keywords))}
+    first_seen = {}
+    for index, (keyword, compiled) in enumerate(engine.rules):
+        if keyword in first_seen:
+            issues[index].append(('warning', f"与第 {first_seen[keyword] + 1} 条规则重复"))
+            continue
+        first_seen[keyword] = index
+
+        if compiled is None:
+            if keyword.startswith('\\'):
+                try:
+                    re.compile(keyword)
+                except re.error as e:
+                    issues[index].append(('error', f"不是有效的正则表达式（{e}），按普通文本处理"))
+            elif REGEX_LIKE.search(keyword):
+                issues[index].append(('warning', "不以 \\ 开头，按普通文本处理，其中的 .* 等写法不会按正则生效"))
+            for earlier in range(index):
+                other, other_compiled = engine.rules[earlier]
+                if other_compiled is None and other and other != keyword and other in keyword:
+                    issues[index].append(('warning', f"包含第 {earlier + 1} 条规则的文本，先执行的第 {earlier + 1} 条已将其删除，此规则不会生效"))
+                    break
+        else:
+            risk = backtracking_risk(keyword)
+            if risk is not None:
+                issues[index].append(('error' if risk[0] == 'exponential' else 'warning', risk[1]))
+    return issues
+
+def analyze_rules(keywords, sample=None, timeout=RULE_TIMEOUT):
+    """
+    分析过滤规则
+
+    Args:
+        keywords: 规则列表（保持文件中的顺序）
+        sample: 样本文本，为空时只进行静态检查
+        timeout: 每条规则的时间上限（秒）
+
+    Returns:
+        每条规则的分析结果列表
+    """
+    engine = FilterEngine(keywords)
+    issues = static_issues(keywords, engine)
+    results = run_rules(keywords, sample, timeout) if sample else {}
+
+    report = []
+    for index, (keyword, compiled) in enumerate(engine.rules):
+        rule_issues = issues[index]
+        stats = results.get(index, {})
+        if stats.get('timeout'):
+            rule_issues.append(('error', f"在 {timeout:g} 秒内没有执行完，可能发生了灾难性回溯"))
+        elif stats and not stats['hits'] and not rule_issues:
+            if stats['standalone_hits']:
+                rule_issues.append(('warning', f"样本中的 {stats['standalone_hits']} 处匹配都已被前面的规则删除（被覆盖）"))
+            else:
+                rule_issues.append(('warning', "样本中没有命中（失效或过时的规则）"))
+        if stats.get('greedy_extra_bytes', 0) > 0:
+            rule_issues.append(('warning', f"贪婪的 .* 比非贪婪的 .*? 多删除了 {stats['greedy_extra_bytes']} 字节，可能吃掉了目标之外的文字"))
+
+        report.append({
+            'index': index + 1,
+            'rule': keyword,
+            'type': 'text' if compiled is None else 'regex',
+            **{key: value for key, value in stats.items() if key != 'timeout'},
+            'timeout': bool(stats.get('timeout')),
+            'issues': [{'level': level, 'message': message} for level, message in rule_issues],
+        })
+    return report
+
+def format_report(report, sample_bytes=0):
+    """生成分析结果的说明文字"""
+    lines = []
+    measured = [rule for rule in report if 'seconds' in rule]
+    if measured:
+        total = sum(rule['seconds'] for rule in measured) or 1e-9
+        lines.append(f"样本 {sample_bytes / (1 << 20):.1f} MB，全部规则耗时 {total * 1000:.1f} ms")
+        lines.append(f"{'#':>4}  类型 {'命中次数':>8} {'命中行数':>8} {'删除字节':>10} {'耗时(ms)':>9} {'占比':>6}  规则")
+        for rule in report:
+            kind = '文本' if rule['type'] == 'text' else '正则'
+            if 'seconds' in rule:
+                lines.append(f"{rule['index']:>4}  {kind} {rule['hits']:>12} {rule['lines']:>12} {rule['bytes_removed']:>14} "
+                             f"{rule['seconds'] * 1000:>11.2f} {rule['seconds'] / total:>7.1%}  {rule['rule']}")
+            else:
+                lines.append(f"{rule['index']:>4}  {kind} {'超时':>12}  {rule['rule']}")
+
+    problems = [(rule, issue) for rule in report for issue in rule['issues']]
+    if problems:
+        lines.append("\n发现的问题:")
+        for rule, issue in sorted(problems, key=lambda item: item[1]['level'] != 'error'):
+            lines.append(f"  [{LEVEL_NAMES[issue['level']]}] 第 {rule['index']} 条 {rule['rule']}: {issue['message']}")
+    else:
+        lines.append("\n没有发现问题")
+    return '\n'.join(lines)
+
+def find_inputs(directory='inputs'):
+    """查找目录下的原始聊天记录（.txt，不含清理后的 cleaned_ 文件）"""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.endswith('.txt') and not name.startswith('cleaned_')]
+
+def main():
+    parser = argparse.ArgumentParser(description='分析过滤规则：在聊天记录样本上统计每条规则的命中次数、耗时和删除的字节数，找出失效、重复、被覆盖和有回溯风险的规则')
+    parser.add_argument('-k', '--filter-file', default='filter_keywords.txt', help='过滤关键词配置文件，默认为filter_keywords.txt')
+    parser.add_argument('-f', '--file', nargs='+', help='作为样本的聊天记录文件，默认为inputs目录下的所有聊天记录')
+    parser.add_argument('-s', '--sample-size', default=DEFAULT_SAMPLE_SIZE, help=f'样本大小，从各文件开头平均读取，默认为{DEFAULT_SAMPLE_SIZE}')
+    parser.add_argument('--timeout', type=float, default=RULE_TIMEOUT, help=f'每条规则的执行时间上限（秒），超时视为灾难性回溯，默认为{RULE_TIMEOUT:g}')
+    parser.add_argument('--static', action='store_true', help='只进行静态检查，不在样本上执行规则')
+    parser.add_argument('-o', '--output', help='将分析结果保存为JSON文件')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.filter_file):
+        print(f"错误: 过滤配置文件 '{args.filter_file}' 不存在")
+        return 1
+    if args.timeout <= 0:
+        print("错误: --timeout 必须为正数")
+        return 1
+    try:
+        sample_size = parse_size(args.sample_size)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return 1
+
+    keywords = read_filter_keywords(args.filter_file)
+    print(f"规则文件: {args.filter_file}，共 {len(keywords)} 条规则")
+
+    sample = ''
+    if not args.static:
+        paths = args.file or find_inputs()
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            print(f"错误: 文件不存在: {', '.join(missing)}")
+            return 1
+        if paths:
+            sample = load_sample(paths, sample_size)
+            print(f"样本: {', '.join(paths)}")
+        else:
+            print("未找到作为样本的聊天记录，只进行静态检查")
+
+    report = analyze_rules(keywords, sample, args.timeout)
+    print(format_report(report, len(sample.encode('utf-8'))))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'filter_file': args.filter_file, 'sample_bytes': len(sample.encode('utf-8')), 'rules': report}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存至: {args.output}")
+
+    # 有错误级别的问题时以状态码1退出，可以在修改共用的规则文件后自动检查
+    return 1 if any(issue['level'] == 'error' for rule in report for issue in rule['issues']) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
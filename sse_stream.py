@@ -0,0 +1,84 @@
+import json
+
+def iter_sse_events(lines):
+    """
+    解析 Server-Sent Events 流
+
+    Args:
+        lines: 逐行的响应文本（不含行尾换行符）
+
+    Yields:
+        (event, data): 事件类型（未指定时为 'message'）和数据（多行 data 以换行符连接）
+    """
+    event = None
+    data = []
+    for line in lines:
+        if not line:
+            # 空行表示一个事件结束
+            if data:
+                yield event or 'message', '\n'.join(data)
+            event = None
+            data = []
+            continue
+        if line.startswith(':'):
+            # 注释行（常用于保持连接）
+            continue
+        field, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        if field == 'event':
+            event = value
+        elif field == 'data':
+            data.append(value)
+
+    if data:
+        yield event or 'message', '\n'.join(data)
+
+def iter_text_deltas(api, events, api_name=None, usage=None):
+    """
+    从流式响应的事件中提取逐段生成的文本
+
+    SiliconFlow 与 OpenAI 的每个事件是一个 chat.completion.chunk，以 data: [DONE] 结束；
+    Anthropic 的文本在 content_block_delta 事件中，以 message_stop 事件结束。
+
+    Args:
+        api: API源名称
+        events: iter_sse_events 返回的事件
+        api_name: 错误信息中显示的API源名称，默认为 api
+        usage: 字典，提供时写入响应中的token用量（Anthropic 的 message_start/message_delta 事件、
+            OpenAI 在请求了 stream_options.include_usage 时最后一个事件中的 usage 字段）
+
+    Yields:
+        新生成的文本片段
+    """
+    api_name = api_name or api
+    for event, data in events:
+        if data == '[DONE]':
+            return
+        try:
+            payload = json.loads(data)
+        except json.JSONDecodeError:
+            raise ValueError(f"无法解析API流式响应: {data[:500]}")
+
+        if event == 'error' or payload.get('type') == 'error' or 'error' in payload:
+            error = payload.get('error') or {}
+            message = error.get('message', '未知错误') if isinstance(error, dict) else str(error)
+            raise ValueError(f"{api_name} API错误: {message}")
+
+        if usage is not None:
+            usage.update((payload.get('message') or {}).get('usage') or {})
+            usage.update(payload.get('usage') or {})
+
+        if api == 'anthropic':
+            if payload.get('type') == 'message_stop':
+                return
+            if payload.get('type') == 'content_block_delta':
+                text = payload.get('delta', {}).get('text')
+                if text:
+                    yield text
+            continue
+
+        for choice in payload.get('choices') or []:
+            text = (choice.get('delta') or {}).get('content')
+            if text:
+                yield text
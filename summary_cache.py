@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# 总结缓存目录的默认路径
+CACHE_DIR = ".summary_cache"
+
+# 缓存条目数量和总大小的上限，超出时按最近使用时间淘汰
+CACHE_MAX_ENTRIES = 1000
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+def cache_key(provider, model, system_prompt, prompt, content, temperature, max_tokens):
+    """
+    计算一次API调用的缓存键，任何影响总结结果的参数变化都会得到不同的键
+
+    Args:
+        provider: API源名称
+        model: 模型名称
+        system_prompt: 系统提示词
+        prompt: 用户提示词
+        content: 需要总结的内容
+        temperature: 采样温度
+        max_tokens: 最大输出token数
+
+    Returns:
+        十六进制SHA-256字符串
+    """
+    payload = json.dumps([provider, model, system_prompt, prompt, content, temperature, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class SummaryCache:
+    """
+    以内容寻址的总结缓存
+
+    每条缓存保存为缓存目录下的一个JSON文件，文件名即缓存键。命中时更新文件的修改时间，
+    写入新条目后按修改时间从旧到新淘汰，直到条目数量和总大小都不超过上限（LRU）。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        """
+        Args:
+            cache_dir: 缓存目录
+            max_entries: 最多保留的条目数量
+            max_bytes: 缓存文件的总大小上限（字节）
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # 多个API源在线程池中并发读写缓存
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """
+        读取缓存的总结
+
+        Args:
+            key: cache_key 返回的缓存键
+
+        Returns:
+            总结内容，未命中时返回None
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                summary = json.load(f)['summary']
+            # 更新修改时间，记录为最近使用
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return summary
+
+    def put(self, key, summary, **meta):
+        """
+        写入总结，并在超出上限时淘汰最久未使用的条目
+
+        Args:
+            key: cache_key 返回的缓存键
+            summary: 总结内容
+            **meta: 随条目保存的附加信息（如API源、模型），便于排查
+        """
+        entry = dict(meta, summary=summary, created=time.strftime('%Y-%m-%d %H:%M:%S'))
+        path = self._path(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # 先写临时文件再替换，避免中途退出时留下不完整的条目
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"警告: 无法写入总结缓存 '{path}': {e}")
+            return
+
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        """按修改时间从旧到新删除条目，直到数量和总大小都不超过上限"""
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for item in it:
+                    if item.name.endswith('.json') and item.is_file():
+                        stat = item.stat()
+                        entries.append((stat.st_mtime_ns, stat.st_size, item.path))
+        except OSError:
+            return
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, path in entries:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            count -= 1
+            total -= size
@@ -0,0 +1,224 @@
+import os
+import re
+import random
+import argparse
+from datetime import datetime, timedelta
+
+# 生成的文件按此大小分批写入
+WRITE_BATCH_BYTES = 1 << 20
+
+# 文件头，与QQ导出的文本格式一致
+EXPORT_HEADER = (
+    "消息记录（此消息记录为文本格式，不支持重新导入）\n\n"
+    "================================================================\n"
+    "消息分组:我加入的群聊\n"
+    "================================================================\n"
+    "消息对象:{group}\n"
+    "================================================================\n\n"
+)
+
+# 群管家等机器人发送的系统消息，会被 filter_keywords.txt 中的规则过滤
+SYSTEM_SENDER = ("Q群管家", 11111111111)
+SYSTEM_MESSAGES = [
+    "@{name} hi～欢迎新的研宝进群！本群为xx官方考研群，群内会发布考研相关信息，若有问题记得找桃子哦！",
+    "请使用最新版手机QQ体验新功能。",
+]
+
+# 广告消息，与 filter_keywords.txt 中的规则匹配
+SPAM_MESSAGES = [
+    "HIJK大学复试上岸救命帮助！压线或不稳的同学请加12345678901，进复试=上岸，报名即将截止，备注“HIJK大学复试”。",
+    "能进HIJK大学复试但没把握上岸的同学加98765432101，可提供上岸帮助和保障，各专业历年上岸率均100%，加好友时请备注“HIJK大学复试”",
+    "[图片]今晚7点，xxC语言课程讲师xx哥来给大家讲讲408怎么复习，扫码预约直播！",
+]
+
+# 普通消息由以下片段随机拼接
+TOPICS = ["复试线", "408", "调剂", "导师", "夏令营", "机试", "英语六级", "数据结构", "操作系统", "计算机网络", "组成原理", "奖学金", "宿舍", "食堂"]
+OPENERS = ["请问", "有没有人知道", "求问", "今年", "听说", "刚看到", "大家觉得", "有学长学姐说说", ""]
+COMMENTS = ["什么时候出", "大概多少分", "难不难", "要准备多久", "是不是改了", "有没有资料", "怎么报名", "靠谱吗", "还来得及吗"]
+REPLIES = ["好的", "谢谢", "哈哈哈", "同问", "+1", "不知道", "等通知吧", "收到", "确实", "蹲一个"]
+EMOJIS = ["[表情]", "[流泪]", "[耶]", "[偷笑]", "[微笑]", "[捂脸]", "[OK]"]
+LINKS = ["https://yz.chsi.com.cn/", "https://grs.nuc.edu.cn/info/1015/8296.htm", "http://yjsc.jsnu.edu.cn/03/22/c10931a394018/page.htm"]
+
+# 各类消息的权重
+MESSAGE_WEIGHTS = [
+    ('text', 50),
+    ('reply', 20),
+    ('mention', 8),
+    ('image', 6),
+    ('emoji', 6),
+    ('multiline', 4),
+    ('link', 2),
+    ('system', 2),
+    ('spam', 1),
+    ('empty', 1),
+]
+
+def parse_size(size):
+    """
+    解析文件大小，如 "500KB"、"100MB"、"2GB"、"1048576"
+
+    Args:
+        size: 大小字符串
+
+    Returns:
+        字节数
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*', size.upper())
+    if not match:
+        raise ValueError(f"无法解析的大小: {size}")
+    number, unit = match.groups()
+    return int(float(number) * {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}[unit])
+
+class ExportGenerator:
+    """
+    按固定随机种子生成QQ聊天记录导出文本，同样的参数总是生成完全相同的内容
+
+    消息时间按在文件中的位置均匀分布在指定的天数内，因此任意大小的文件都跨越相同的日期范围，
+    每天的消息量随文件大小增长。
+    """
+
+    def __init__(self, seed=0, days=30, start_date=datetime(2025, 3, 1), members=500, group='xx26HIJK大学计算机考研群'):
+        """
+        Args:
+            seed: 随机种子
+            days: 消息跨越的天数
+            start_date: 第一天的日期
+            members: 群成员数量
+            group: 群名称
+        """
+        self.rng = random.Random(seed)
+        self.days = days
+        self.start_date = start_date
+        self.group = group
+        self.members = [(self._nickname(i), 100000000 + self.rng.randrange(900000000)) for i in range(members)]
+        kinds, weights = zip(*MESSAGE_WEIGHTS)
+        self._kinds = kinds
+        self._cum_weights = [sum(weights[:i + 1]) for i in range(len(weights))]
+
+    @property
+    def end_date(self):
+        """最后一天的日期"""
+        return self.start_date + timedelta(days=self.days - 1)
+
+    def _nickname(self, i):
+        prefix = self.rng.choice(["", "26", "27", "小", "阿", "考研"])
+        body = self.rng.choice(["上岸", "研宝", "408", "桃子", "复试", "冲冲冲", "学习", "摸鱼", "Alice", "Bob"])
+        return f"{prefix}{body}{i}"
+
+    def _text(self):
+        rng = self.rng
+        return f"{rng.choice(OPENERS)}{rng.choice(TOPICS)}{rng.choice(COMMENTS)}？"
+
+    def _body(self, kind):
+        """生成一种消息的正文"""
+        rng = self.rng
+        if kind == 'text':
+            return self._text()
+        if kind == 'reply':
+            return rng.choice(REPLIES)
+        if kind == 'mention':
+            return f"@{rng.choice(self.members)[0]} {self._text()}"
+        if kind == 'image':
+            return "[图片]" if rng.random() < 0.5 else f"[图片]{self._text()}"
+        if kind == 'emoji':
+            return f"{rng.choice(REPLIES)}{rng.choice(EMOJIS)}"
+        if kind == 'multiline':
+            return '\n'.join(self._text() for _ in range(rng.randint(2, 5)))
+        if kind == 'link':
+            return f"{self._text()} {rng.choice(LINKS)}"
+        if kind == 'system':
+            return rng.choice(SYSTEM_MESSAGES).format(name=rng.choice(self.members)[0])
+        if kind == 'spam':
+            return rng.choice(SPAM_MESSAGES)
+        return ''
+
+    def write(self, output_file, size):
+        """
+        生成约 size 字节的聊天记录并写入文件（超过 size 后写完当前消息即停止）
+
+        Args:
+            output_file: 输出文件路径
+            size: 目标大小（字节）
+
+        Returns:
+            (消息数, 实际字节数)
+        """
+        rng = self.rng
+        seconds_per_byte = self.days * 86400 / max(1, size)
+        header = EXPORT_HEADER.format(group=self.group).encode('utf-8')
+        written = len(header)
+        count = 0
+        last_time = 0
+
+        with open(output_file, 'wb') as f:
+            f.write(header)
+            batch = []
+            batch_bytes = 0
+            while written < size:
+                kind = rng.choices(self._kinds, cum_weights=self._cum_weights)[0]
+                if kind in ('system', 'spam') and rng.random() < 0.8:
+                    name, qq = SYSTEM_SENDER
+                else:
+                    name, qq = rng.choice(self.members)
+                # 时间按在文件中的位置推进，同一秒内的多条消息保持顺序
+                seconds = max(last_time, int(written * seconds_per_byte))
+                last_time = seconds
+                time = self.start_date + timedelta(seconds=seconds)
+                message = f"{time:%Y-%m-%d %H:%M:%S} {name}({qq})\n{self._body(kind)}\n\n".encode('utf-8')
+
+                batch.append(message)
+                batch_bytes += len(message)
+                written += len(message)
+                count += 1
+                if batch_bytes >= WRITE_BATCH_BYTES:
+                    f.write(b''.join(batch))
+                    batch, batch_bytes = [], 0
+            f.write(b''.join(batch))
+
+        return count, written
+
+def generate_export(output_file, size, seed=0, days=30, start_date=datetime(2025, 3, 1)):
+    """
+    生成一个合成的QQ聊天记录导出文件，用于性能测试
+
+    Args:
+        output_file: 输出文件路径
+        size: 目标大小（字节）
+        seed: 随机种子
+        days: 消息跨越的天数
+        start_date: 第一天的日期
+
+    Returns:
+        (消息数, 实际字节数)
+    """
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    return ExportGenerator(seed, days, start_date).write(output_file, size)
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成的QQ聊天记录导出文件，用于性能测试')
+    parser.add_argument('-s', '--size', default='10MB', help='文件大小，如 1MB、500MB、2GB，默认为10MB')
+    parser.add_argument('-o', '--output', default='inputs/synthetic.txt', help='输出文件路径，默认为inputs/synthetic.txt')
+    parser.add_argument('--days', type=int, default=30, help='消息跨越的天数，默认为30')
+    parser.add_argument('--start-date', default='2025-03-01', help='第一天的日期，默认为2025-03-01')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子，相同参数总是生成相同的文件，默认为0')
+
+    args = parser.parse_args()
+
+    try:
+        size = parse_size(args.size)
+        start_date = datetime.strptime(args.start_date, '%Y-%m-%d')
+    except ValueError as e:
+        print(f"错误: {e}")
+        return
+    if args.days <= 0:
+        print("错误: --days 必须为正整数")
+        return
+
+    count, written = generate_export(args.output, size, args.seed, args.days, start_date)
+    end_date = start_date + timedelta(days=args.days - 1)
+    print(f"已生成 {args.output}: {count} 条消息，{written / (1 << 20):.1f} MB，{start_date:%Y-%m-%d} 至 {end_date:%Y-%m-%d}")
+
+if __name__ == "__main__":
+    main()
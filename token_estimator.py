@@ -0,0 +1,95 @@
+import re
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 中日韩字符（含全角标点），大多数模型的分词器中约为一个token
+_CJK_PATTERN = re.compile('[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+# 其他字符（英文、数字、链接等）平均约4个字符一个token
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的token数量，用于在发送请求前控制输入长度
+
+    不依赖具体模型的分词器，中文字符按每个一个token计算，其余字符按每4个一个token计算，
+    对中文聊天记录通常略为高估。
+
+    Args:
+        text: 文本内容
+
+    Returns:
+        估算的token数量
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+# 是否安装了 OpenAI 的分词器 tiktoken（pip install tiktoken），未安装时使用估算
+TIKTOKEN_AVAILABLE = tiktoken is not None
+
+# 自定义分词器: {API源名称或 (API源名称, 模型名称): 计数函数}
+_TOKENIZERS = {}
+_ENCODINGS = {}
+_ENCODINGS_LOCK = threading.Lock()
+
+def register_tokenizer(api, counter, model=None):
+    """
+    为API源（或其中某个模型）注册分词器，例如接入模型自带的分词器以获得准确的token数
+
+    Args:
+        api: API源名称
+        counter: 计数函数 counter(text)，返回token数量
+        model: 模型名称，为None时对该API源的所有模型生效
+    """
+    _TOKENIZERS[(api, model) if model else api] = counter
+
+def _tiktoken_counter(model):
+    """获取 tiktoken 对应模型的计数函数，未知模型使用 cl100k_base 编码"""
+    with _ENCODINGS_LOCK:
+        encoding = _ENCODINGS.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding('cl100k_base')
+            _ENCODINGS[model] = encoding
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+def get_tokenizer(api=None, model=None):
+    """
+    获取API源和模型对应的token计数函数
+
+    依次使用: 注册的模型分词器、注册的API源分词器、OpenAI模型的 tiktoken（已安装时）、estimate_tokens 估算
+
+    Args:
+        api: API源名称
+        model: 模型名称
+
+    Returns:
+        计数函数 counter(text)
+    """
+    counter = _TOKENIZERS.get((api, model)) or _TOKENIZERS.get(api)
+    if counter is not None:
+        return counter
+    if api == 'openai' and TIKTOKEN_AVAILABLE and model:
+        return _tiktoken_counter(model)
+    return estimate_tokens
+
+def count_tokens(text, api=None, model=None):
+    """
+    计算文本在指定API源和模型下的token数量（没有可用的分词器时为估算值）
+
+    Args:
+        text: 文本内容
+        api: API源名称
+        model: 模型名称
+
+    Returns:
+        token数量
+    """
+    return get_tokenizer(api, model)(text)
@@ -0,0 +1,394 @@
+import os
+import time
+import argparse
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+from api_config import CONFIG_FILE, load_api_config
+from pipeline_state import STATE_FILE, load_state, save_state
+from filter_engine import load_filter_engine, set_rule_timeout
+from process_chat_logs import clean_chat_log_incremental
+from provider_client import configure_clients
+from rate_limiter import reset_limiters
+from summary_cache import CACHE_DIR, SummaryCache
+from metrics import METRICS
+import generate_conclusion
+from generate_conclusion import needs_conclusion, summarize_files
+
+# 是否安装了 inotify 接口 inotify_simple（pip install inotify_simple，仅Linux），未安装时定时扫描目录
+INOTIFY_AVAILABLE = INotify is not None
+
+# 文件最后一次修改后等待多少秒仍无变化才开始处理，避免读到导出了一半的文件
+DEBOUNCE_SECONDS = 2.0
+
+# 未使用 inotify 时扫描目录的间隔（秒）
+POLL_INTERVAL = 1.0
+
+def file_signature(path):
+    """文件的修改时间和大小，文件不存在时为None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def is_chat_log(path, input_dir):
+    """是否为输入目录中需要清理的聊天记录（与 process_all_chat_logs 的选择规则相同，另外跳过隐藏的索引文件）"""
+    filename = os.path.basename(path)
+    return (os.path.dirname(os.path.abspath(path)) == os.path.abspath(input_dir)
+            and filename.endswith('.txt') and not filename.startswith(('cleaned_', '.')))
+
+class PollingWatcher:
+    """定时扫描输入目录和配置文件，按修改时间和大小找出变化的文件"""
+
+    def __init__(self, input_dir, extra_files, interval=POLL_INTERVAL):
+        """
+        Args:
+            input_dir: 聊天记录所在的目录
+            extra_files: 需要同时监视的其他文件（过滤规则、API配置）
+            interval: 扫描间隔（秒）
+        """
+        self.input_dir = input_dir
+        self.extra_files = [os.path.abspath(path) for path in extra_files]
+        self.interval = interval
+        self._signatures = self._scan()
+
+    def _scan(self):
+        paths = list(self.extra_files)
+        if os.path.isdir(self.input_dir):
+            paths += [os.path.abspath(os.path.join(self.input_dir, filename)) for filename in os.listdir(self.input_dir)]
+        signatures = {}
+        for path in paths:
+            signature = file_signature(path)
+            if signature is not None:
+                signatures[path] = signature
+        return signatures
+
+    def changes(self, timeout):
+        """
+        等待文件变化
+
+        Args:
+            timeout: 最长等待秒数
+
+        Returns:
+            新建或修改过的文件路径集合（绝对路径），超时时为空集合
+        """
+        time.sleep(min(timeout, self.interval))
+        signatures = self._scan()
+        changed = {path for path, signature in signatures.items() if self._signatures.get(path) != signature}
+        self._signatures = signatures
+        return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """通过 inotify 监视输入目录和配置文件所在的目录，文件写入或移入时立即得到通知"""
+
+    # 写入、写完关闭、新建和移入（编辑器保存配置文件时常先写临时文件再改名）
+    EVENTS = flags.MODIFY | flags.CLOSE_WRITE | flags.CREATE | flags.MOVED_TO if INOTIFY_AVAILABLE else 0
+
+    def __init__(self, input_dir, extra_files):
+        """
+        Args:
+            input_dir: 聊天记录所在的目录
+            extra_files: 需要同时监视的其他文件（过滤规则、API配置）
+        """
+        self.inotify = INotify()
+        self._directories = {}
+        for directory in {os.path.abspath(input_dir)} | {os.path.dirname(os.path.abspath(path)) for path in extra_files}:
+            self._directories[self.inotify.add_watch(directory, self.EVENTS)] = directory
+
+    def changes(self, timeout):
+        """
+        等待文件变化
+
+        Args:
+            timeout: 最长等待秒数
+
+        Returns:
+            新建或修改过的文件路径集合（绝对路径），超时时为空集合
+        """
+        events = self.inotify.read(timeout=int(timeout * 1000))
+        return {os.path.join(self._directories[event.wd], event.name) for event in events
+                if event.wd in self._directories and event.name}
+
+    def close(self):
+        self.inotify.close()
+
+class Debouncer:
+    """
+    合并同一文件短时间内的多次修改
+
+    文件在 quiet 秒内没有新的修改通知、并且修改时间和大小与最后一次通知时相同，才认为已经写完。
+    """
+
+    def __init__(self, quiet=DEBOUNCE_SECONDS):
+        self.quiet = quiet
+        # {文件路径: (最后一次通知的时间, 当时的修改时间和大小)}
+        self._pending = {}
+
+    def touch(self, path, now):
+        """记录文件的一次修改通知"""
+        self._pending[path] = (now, file_signature(path))
+
+    def timeout(self, now, default):
+        """距离最早可能写完的文件还需等待的秒数，没有待处理的文件时为 default"""
+        if not self._pending:
+            return default
+        return max(0.0, min(seen for seen, _ in self._pending.values()) + self.quiet - now)
+
+    def ready(self, now):
+        """
+        取出已经写完的文件
+
+        Returns:
+            文件路径列表，按最后一次修改通知的先后排列
+        """
+        ready = []
+        for path, (seen, signature) in sorted(self._pending.items(), key=lambda item: item[1][0]):
+            if now - seen < self.quiet:
+                continue
+            current = file_signature(path)
+            if current is None:
+                # 文件已被删除或改名
+                del self._pending[path]
+            elif current != signature:
+                # 没有收到通知但文件仍在变化（如扫描间隔内写入），重新计时
+                self._pending[path] = (now, current)
+            else:
+                del self._pending[path]
+                ready.append(path)
+        return ready
+
+class WatchDaemon:
+    """
+    常驻进程：监视输入目录，新导出或追加的聊天记录写完后立即增量清理并总结
+
+    过滤规则、HTTP连接池、总结缓存和延迟历史在各次处理之间保持，过滤规则文件和
+    api_keys.ini 修改后自动重新加载，不需要重启。
+    """
+
+    def __init__(self, input_dir='inputs', output_dir='conclusion', api_sources=None, custom_prompt=None,
+                 filter_file='filter_keywords.txt', state_file=STATE_FILE, model=None, exclude_senders=None,
+                 dedup=False, hedge=False, verbose=False, debounce=DEBOUNCE_SECONDS, poll_interval=POLL_INTERVAL,
+                 use_inotify=True, metrics_json=None, metrics_textfile=None):
+        """
+        Args:
+            input_dir: 聊天记录所在的目录
+            output_dir: 总结输出目录
+            api_sources: API源列表
+            custom_prompt: 自定义提示词
+            filter_file: 过滤关键词配置文件路径
+            state_file: 增量处理状态文件路径
+            model: 指定的SiliconFlow模型名称，重新加载配置后仍然生效
+            exclude_senders: 需要排除的发送者昵称或QQ号集合
+            dedup: 是否合并重复和相似的消息
+            hedge: 每个文件只取最先返回的一个API源的总结
+            verbose: 是否显示详细信息
+            debounce: 文件最后一次修改后等待多少秒仍无变化才开始处理
+            poll_interval: 未使用 inotify 时扫描目录的间隔（秒）
+            use_inotify: 安装了 inotify_simple 时是否使用 inotify
+            metrics_json: 每处理完一个文件后更新的JSON指标报告路径
+            metrics_textfile: 每处理完一个文件后更新的 Prometheus textfile 路径
+        """
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.api_sources = api_sources or ['siliconflow']
+        self.custom_prompt = custom_prompt
+        self.filter_file = filter_file
+        self.state_file = state_file
+        self.model = model
+        self.exclude_senders = exclude_senders
+        self.dedup = dedup
+        self.hedge = hedge
+        self.verbose = verbose
+        self.debouncer = Debouncer(debounce)
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and INOTIFY_AVAILABLE
+        self.metrics_json = metrics_json
+        self.metrics_textfile = metrics_textfile
+        self._filter_path = os.path.abspath(filter_file)
+        self._config_path = os.path.abspath(CONFIG_FILE)
+
+    def _watcher(self):
+        extra_files = [self._filter_path, self._config_path]
+        if self.use_inotify:
+            return InotifyWatcher(self.input_dir, extra_files)
+        return PollingWatcher(self.input_dir, extra_files, self.poll_interval)
+
+    def warm_up(self):
+        """预先编译过滤规则、按配置创建HTTP连接池"""
+        load_filter_engine(self.filter_file)
+        # 导入 generate_conclusion 时已经加载过配置，不再重复读取
+        self._apply_api_config(generate_conclusion.API_CONFIG)
+
+    def _apply_api_config(self, config):
+        """
+        使用新加载的API配置，并发或速率限制变化时重建限流器和连接池
+
+        Returns:
+            发生变化的配置项列表，如 ['siliconflow.model']（不含配置值，避免打印密钥）
+        """
+        if self.model and 'siliconflow' in config:
+            config['siliconflow']['model'] = self.model
+        old = generate_conclusion.API_CONFIG
+        changed = [f"{api}.{key}" for api in config for key in config[api]
+                   if old.get(api, {}).get(key) != config[api][key]]
+        generate_conclusion.API_CONFIG = config
+        if any(key.endswith(('.concurrency', '.rpm', '.tpm')) for key in changed):
+            reset_limiters()
+        configure_clients(max(config[api]['concurrency'] for api in self.api_sources))
+        return changed
+
+    def reload_api_config(self):
+        """api_keys.ini 修改后重新加载"""
+        changed = self._apply_api_config(load_api_config())
+        print(f"已重新加载 {CONFIG_FILE}" + (f"，变化的配置项: {', '.join(changed)}" if changed else "，配置没有变化"))
+        missing = [api for api in self.api_sources if not generate_conclusion.API_CONFIG[api]['api_key']]
+        if missing:
+            print(f"警告: 以下API源未设置密钥: {', '.join(missing)}，总结将会失败")
+
+    def reload_filters(self):
+        """过滤规则文件修改后重新编译，之后清理的文件使用新规则（已生成的清理结果不会重新清理）"""
+        engine = load_filter_engine(self.filter_file)
+        print(f"已重新加载过滤规则 '{self.filter_file}'，共 {len(engine.rules)} 条")
+
+    def process(self, input_file, catching_up=False):
+        """
+        增量清理一个聊天记录，并总结内容有变化的清理结果
+
+        Args:
+            input_file: 聊天记录文件路径
+            catching_up: 是否为启动时补处理（此时文件可能早已写完，不统计从导出到总结的耗时）
+
+        Returns:
+            成功生成总结的文件数
+        """
+        modified = os.path.getmtime(input_file)
+        print(f"开始处理 '{input_file}'")
+        # 每次从文件读取状态，同一状态文件也可以被定时任务中的命令行脚本使用
+        state = load_state(self.state_file)
+        cleaned_files = clean_chat_log_incremental(input_file, state, verbose=self.verbose, filter_file=self.filter_file,
+                                                   exclude_senders=self.exclude_senders, dedup=self.dedup)
+        save_state(state, self.state_file)
+        if not cleaned_files:
+            return 0
+
+        cleaned_files = [path for path in cleaned_files
+                         if needs_conclusion(path, self.output_dir, self.api_sources, state, self.hedge)]
+        if not cleaned_files:
+            print("清理结果没有变化，无需调用API")
+            return 0
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        success_count = summarize_files(cleaned_files, self.output_dir, self.api_sources, self.custom_prompt,
+                                        state, self.state_file, hedge=self.hedge)
+        print(f"'{input_file}' 处理完成，{success_count}/{len(cleaned_files)} 个文件生成了总结")
+        if not catching_up:
+            # 从聊天记录最后一次写入到总结写完的时间
+            METRICS.observe('watch_latency', time.time() - modified)
+            print(f"距聊天记录写入 {time.time() - modified:.1f} 秒")
+        return success_count
+
+    def handle(self, path, catching_up=False):
+        """处理一个已经写完的文件，出错时打印错误并继续监视"""
+        try:
+            if path == self._filter_path:
+                self.reload_filters()
+            elif path == self._config_path:
+                self.reload_api_config()
+            elif is_chat_log(path, self.input_dir):
+                self.process(path, catching_up)
+                METRICS.inc('watch_files', result='ok')
+            else:
+                return
+        except Exception as e:
+            print(f"处理 '{path}' 时出错：{e}")
+            METRICS.inc('watch_files', result='error')
+        # 常驻运行时不会正常退出，每处理完一次就保存延迟历史并更新指标
+        generate_conclusion.LATENCY_HISTORY.save()
+        METRICS.write(self.metrics_json, self.metrics_textfile, 'watch_daemon')
+
+    def catch_up(self):
+        """启动时处理上次运行之后新增的消息（增量状态中没有新消息的文件会直接跳过）"""
+        if not os.path.isdir(self.input_dir):
+            return
+        for filename in sorted(os.listdir(self.input_dir)):
+            path = os.path.abspath(os.path.join(self.input_dir, filename))
+            if is_chat_log(path, self.input_dir):
+                self.handle(path, catching_up=True)
+
+    def run(self):
+        """启动监视，直到按 Ctrl+C 停止"""
+        os.makedirs(self.input_dir, exist_ok=True)
+        self.warm_up()
+        self.catch_up()
+        watcher = self._watcher()
+        mode = 'inotify' if self.use_inotify else f"每 {self.poll_interval:g} 秒扫描一次"
+        print(f"正在监视 '{self.input_dir}'（{mode}），按 Ctrl+C 停止")
+        try:
+            while True:
+                timeout = self.debouncer.timeout(time.monotonic(), self.poll_interval)
+                for path in watcher.changes(max(timeout, 0.05)):
+                    self.debouncer.touch(path, time.monotonic())
+                for path in self.debouncer.ready(time.monotonic()):
+                    self.handle(path)
+        except KeyboardInterrupt:
+            print("已停止监视")
+        finally:
+            watcher.close()
+            generate_conclusion.LATENCY_HISTORY.save()
+
+def main():
+    parser = argparse.ArgumentParser(description='常驻运行，监视聊天记录目录，新导出的聊天记录写完后立即清理并生成总结')
+    parser.add_argument('-d', '--input-dir', default='inputs', help='监视的聊天记录目录，默认为inputs')
+    parser.add_argument('-o', '--output-dir', default='conclusion', help='总结文件输出目录，默认为conclusion')
+    parser.add_argument('-a', '--api', nargs='+', default=['siliconflow'],
+                        choices=['siliconflow', 'openai', 'anthropic'],
+                        help='指定要使用的API源，可多选')
+    parser.add_argument('-p', '--prompt', help='自定义提示词')
+    parser.add_argument('-m', '--model', help='指定要使用的SiliconFlow模型名称')
+    parser.add_argument('-k', '--keywords', default='filter_keywords.txt', help='过滤关键词配置文件路径，修改后自动重新加载')
+    parser.add_argument('-x', '--exclude-sender', nargs='+', default=[], help='排除指定发送者（昵称或QQ号）的消息，可指定多个')
+    parser.add_argument('--dedup', action='store_true', help='合并重复和相似的消息')
+    parser.add_argument('--hedge', action='store_true', help='每个文件只取最先返回的一个API源的总结（见 generate_conclusion.py --hedge）')
+    parser.add_argument('--state-file', default=STATE_FILE, help=f'增量处理状态文件路径，默认为{STATE_FILE}')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS, help=f'文件最后一次修改后等待多少秒仍无变化才开始处理，默认为{DEBOUNCE_SECONDS:g}')
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help=f'未使用inotify时扫描目录的间隔（秒），默认为{POLL_INTERVAL:g}')
+    parser.add_argument('--no-inotify', action='store_true', help='即使安装了inotify_simple也定时扫描目录（如网络文件系统上inotify收不到通知时）')
+    parser.add_argument('--rule-timeout', type=float, default=0, help='每条过滤规则的执行时间上限（秒），默认为0（不限制）')
+    parser.add_argument('--no-cache', action='store_true', help='不使用总结缓存，总是重新调用API')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help=f'总结缓存目录，默认为{CACHE_DIR}')
+    parser.add_argument('--metrics-json', help='每处理完一个文件后更新JSON指标报告')
+    parser.add_argument('--metrics-textfile', help='每处理完一个文件后更新 Prometheus node-exporter 的 textfile（.prom 文件）')
+    parser.add_argument('-v', '--verbose', action='store_true', help='显示详细处理信息')
+
+    args = parser.parse_args()
+    if args.debounce < 0 or args.poll_interval <= 0 or args.rule_timeout < 0:
+        print("错误: --debounce 和 --rule-timeout 不能为负数，--poll-interval 必须大于0")
+        return
+    if not INOTIFY_AVAILABLE and not args.no_inotify:
+        print("提示: 未安装 inotify_simple（pip install inotify_simple），改为定时扫描目录")
+    set_rule_timeout(args.rule_timeout)
+    generate_conclusion.SUMMARY_CACHE = None if args.no_cache else SummaryCache(args.cache_dir)
+
+    missing_keys = [api for api in args.api if not generate_conclusion.API_CONFIG[api]['api_key']]
+    if missing_keys:
+        print(f"错误: 以下API源未设置密钥: {', '.join(missing_keys)}，请使用 'python generate_conclusion.py -c' 设置密钥")
+        return
+
+    daemon = WatchDaemon(
+        args.input_dir, args.output_dir, args.api, args.prompt, filter_file=args.keywords, state_file=args.state_file,
+        model=args.model, exclude_senders=set(args.exclude_sender), dedup=args.dedup, hedge=args.hedge,
+        verbose=args.verbose, debounce=args.debounce, poll_interval=args.poll_interval,
+        use_inotify=not args.no_inotify, metrics_json=args.metrics_json, metrics_textfile=args.metrics_textfile,
+    )
+    daemon.run()
+
+if __name__ == "__main__":
+    main()